@@ -25,6 +25,8 @@ from django.conf import settings
 import evennia
 from evennia.utils import create, logger, search, utils
 
+from world.charnames import CHARNAMES
+
 COMMAND_DEFAULT_CLASS = utils.class_from_module(settings.COMMAND_DEFAULT_CLASS)
 
 _MAX_NR_CHARACTERS = settings.MAX_NR_CHARACTERS
@@ -60,19 +62,12 @@ class MuxAccountLookCommand(COMMAND_DEFAULT_CLASS):
 
         super().parse()
 
-        playable = self.account.db._playable_characters
-        if playable is not None:
-            # clean up list if character object was deleted in between
-            if None in playable:
-                playable = [character for character in playable if character]
-                self.account.db._playable_characters = playable
-        # store playable property
+        # store playable property; deleted characters are dropped by the
+        # handler, without writing anything
         if self.args:
-            self.playable = dict((utils.to_str(char.key.lower()), char) for char in playable).get(
-                self.args.lower(), None
-            )
+            self.playable = self.account.playable.get(self.args)
         else:
-            self.playable = playable
+            self.playable = self.account.playable.all()
 
 
 # Obs - these are all intended to be stored on the Account, and as such,
@@ -165,10 +160,9 @@ class CmdCharCreate(COMMAND_DEFAULT_CLASS):
 
         typeclass = settings.BASE_CHARACTER_TYPECLASS
 
-        if ObjectDB.objects.filter(db_typeclass_path=typeclass, db_key__iexact=key):
-            # check if this Character already exists. Note that we are only
-            # searching the base character typeclass here, not any child
-            # classes.
+        if not CHARNAMES.reserve(key, owner=account):
+            # check if this Character already exists (or is being created
+            # right now), and keep the name until it's created.
             self.msg(f"|rLeider gibt es schon den Spieler '|w{key}|r' schon.|n")
             return
 
@@ -176,9 +170,16 @@ class CmdCharCreate(COMMAND_DEFAULT_CLASS):
         start_location = ObjectDB.objects.get_id(settings.START_LOCATION)
         default_home = ObjectDB.objects.get_id(settings.DEFAULT_HOME)
         permissions = settings.PERMISSION_ACCOUNT_DEFAULT
-        new_character = create.create_object(
-            typeclass, key=key, location=start_location, home=default_home, permissions=permissions
-        )
+        try:
+            new_character = create.create_object(
+                typeclass,
+                key=key,
+                location=start_location,
+                home=default_home,
+                permissions=permissions,
+            )
+        finally:
+            CHARNAMES.release(account)
         # only allow creator (and developers) to puppet this char
         new_character.locks.add(
             "puppet:id(%i) or pid(%i) or perm(Developer) or pperm(Developer);delete:id(%i) or"
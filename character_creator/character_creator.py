@@ -16,6 +16,7 @@ character names from within the menu.
 
 """
 import string
+import time
 from random import choices
 
 from django.conf import settings
@@ -23,11 +24,16 @@ from django.conf import settings
 from evennia import DefaultAccount
 from evennia.commands.default.muxcommand import MuxAccountCommand
 from evennia.objects.models import ObjectDB
+from evennia.typeclasses.attributes import Attribute
+from evennia.typeclasses.tags import Tag
 from evennia.utils import create, search, logger, utils
-from evennia.utils.evmenu import EvMenu
+from evennia.utils.utils import lazy_property
+
+from world import chargen_draft, who
+from world.charnames import CHARNAMES
+
+from .playable import PlayableCharacters
 
-import evennia
-import time
 
 _CHARACTER_TYPECLASS = settings.BASE_CHARACTER_TYPECLASS
 try:
@@ -57,7 +63,7 @@ class ContribCmdCharCreate(MuxAccountCommand):
         session = self.session
 
         # only one character should be in progress at a time, so we check for WIPs first
-        in_progress = [chara for chara in account.db._playable_characters if chara.db.chargen_step]
+        in_progress = [chara for chara in account.playable.all() if chara.db.chargen_step]
 
         if len(in_progress):
             # we're continuing chargen for a WIP character
@@ -66,9 +72,7 @@ class ContribCmdCharCreate(MuxAccountCommand):
             # we're making a new character
             charmax = settings.MAX_NR_CHARACTERS
 
-            if not account.is_superuser and (
-                account.db._playable_characters and len(account.db._playable_characters) >= charmax
-            ):
+            if not account.is_superuser and account.playable.count() >= charmax:
                 plural = "" if charmax == 1 else "s"
                 self.msg(f"Du kannst {charmax} character{plural} haben.")
                 return
@@ -93,38 +97,85 @@ class ContribCmdCharCreate(MuxAccountCommand):
             )
             # initalize the new character to the beginning of the chargen menu
             new_character.db.chargen_step = "menunode_welcome"
-            account.db._playable_characters.append(new_character)
+            account.playable.add(new_character)
 
-        # set the menu node to start at to the character's last saved step
-        startnode = new_character.db.chargen_step
         # attach the character to the session, so the chargen menu can access it
         session.new_char = new_character
+        # set the menu node to start at to the character's last saved step; this
+        # also recovers choices a crash kept from being saved
+        startnode = chargen_draft.open_draft(session, new_character).step
 
         # this gets called every time the player exits the chargen menu
         def finish_char_callback(session, menu):
             char = session.new_char
+            # save the choices made since the last step
+            chargen_draft.close_draft(session)
+            # a chosen name is the key of the character by now
+            CHARNAMES.release(char)
+            # chargen state and name may have changed
+            account.ndb._lobby = None
             if not char.db.chargen_step:
                 # this means character creation was completed - start playing!
                 # execute the ic command to start puppeting the character
                 account.execute_cmd("spiele {}".format(char.key))
 
+        # imported here, as chargen is the only menu accounts use
+        from evennia.utils.evmenu import EvMenu
+
         EvMenu(session, _CHARGEN_MENU, startnode=startnode, cmd_on_exit=finish_char_callback)
 
 
+def _prefetch_lobby(characters):
+    """
+    Get the chargen state and permissions of all characters at once, with
+    one query each instead of two per character.
+
+    Returns:
+        tuple: `({char id: chargen_step}, {char id: [permission, ...]})`.
+
+    """
+    if not characters:
+        return {}, {}
+    ids = [char.id for char in characters]
+    chargen_steps = dict(
+        Attribute.objects.filter(
+            objectdb__id__in=ids, db_key="chargen_step", db_category__isnull=True
+        ).values_list("objectdb__id", "db_value")
+    )
+    permissions = {}
+    for charid, perm in (
+        Tag.objects.filter(objectdb__id__in=ids, db_tagtype="permission")
+        .order_by("id")
+        .values_list("objectdb__id", "db_key")
+    ):
+        permissions.setdefault(charid, []).append(perm)
+    return chargen_steps, permissions
+
+
 class ContribChargenAccount(DefaultAccount):
     """
     A modified Account class that makes minor changes to the OOC look
     output, to incorporate in-progress characters.
     """
 
+    @lazy_property
+    def playable(self):
+        """The characters this account may play (see `character_creator.playable`)."""
+        return PlayableCharacters(self)
+
+    @property
+    def characters(self):
+        """The playable characters, for Evennia code and the website."""
+        return self.playable.all()
+
     def at_look(self, target=None, session=None, **kwargs):
         """
         Called by the OOC look command. It displays a list of playable
         characters and should be mostly identical to the core method.
 
         Args:
-            target (Object or list, optional): An object or a list
-                objects to inspect.
+            target (Object or list, optional): An object to inspect. If
+                a list or not given, the playable characters are listed.
             session (Session, optional): The session doing this look.
             **kwargs (dict): Arbitrary, optional arguments for users
                 overriding the call (unused by default).
@@ -134,10 +185,28 @@ class ContribChargenAccount(DefaultAccount):
                 off to any recipient (usually to ourselves)
         """
 
-        # list of targets - make list to disconnect from db
-        characters = list(tar for tar in target if tar) if target else []
+        if target is None or utils.is_iter(target):
+            # Evennia passes the (legacy) playable characters list
+            characters = self.playable.all()
+        else:
+            return super().at_look(target=target, session=session, **kwargs)
         sessions = self.sessions.all()
         is_su = self.is_superuser
+        charmax = settings.MAX_NR_CHARACTERS
+
+        # everything the text depends on; sessions (also those of others
+        # playing our characters) are tracked by the who-roster's version
+        cachekey = (
+            who.ROSTER.version,
+            session.sessid if session else None,
+            tuple(sess.sessid for sess in sessions),
+            tuple((char.id, char.key) for char in characters),
+            is_su,
+            charmax,
+        )
+        cached = self.ndb._lobby
+        if cached and cached[0] == cachekey:
+            return cached[1]
 
         # text shown when looking in the ooc area
         result = [f"Account |g{self.key}|n (you are Out-of-Character)"]
@@ -147,15 +216,18 @@ class ContribChargenAccount(DefaultAccount):
             result.append("\n\n|wConnected session:|n")
         elif nsess > 1:
             result.append(f"\n\n|wConnected sessions ({nsess}):|n")
+        # sessid -> number shown in the list
+        session_numbers = {}
         for isess, sess in enumerate(sessions):
             csessid = sess.sessid
+            session_numbers[csessid] = isess + 1
             addr = "{protocol} ({address})".format(
                 protocol=sess.protocol_key,
                 address=isinstance(sess.address, tuple)
                 and str(sess.address[0])
                 or str(sess.address),
             )
-            if session.sessid == csessid:
+            if session and session.sessid == csessid:
                 result.append(f"\n |w* {isess+1}|n {addr}")
             else:
                 result.append(f"\n   {isess+1} {addr}")
@@ -163,8 +235,6 @@ class ContribChargenAccount(DefaultAccount):
         result.append("\n\n |whelp|n - mehr commandos")
         result.append("\n |wpublic <Text>|n - talk on public channel")
 
-        charmax = settings.MAX_NR_CHARACTERS
-
         if is_su or len(characters) < charmax:
             result.append("\n |werschaffung|n - So erschaffst du einen neuen Character")
 
@@ -177,30 +247,29 @@ class ContribChargenAccount(DefaultAccount):
         else:
             result.append(f"\n\nVerfuegbare Character{plural} ({len(characters)}/{charmax}):")
 
+        chargen_steps, permissions = _prefetch_lobby(characters)
         for char in characters:
-            if char.db.chargen_step:
+            if chargen_steps.get(char.id):
                 # currently in-progress character; don't display placeholder names
                 result.append("\n - |Yin der erschaffung|n (|werschaffung|n zum fortfahren)")
                 continue
+            perms = ", ".join(permissions.get(char.id, ()))
             csessions = char.sessions.all()
             if csessions:
                 for sess in csessions:
                     # character is already puppeted
-                    sid = sess in sessions and sessions.index(sess) + 1
-                    if sess and sid:
+                    sid = sess and session_numbers.get(sess.sessid)
+                    if sid:
                         result.append(
-                            f"\n - |G{char.key}|n [{', '.join(char.permissions.all())}] (played by"
-                            f" you in session {sid})"
+                            f"\n - |G{char.key}|n [{perms}] (played by you in session {sid})"
                         )
                     else:
-                        result.append(
-                            f"\n - |R{char.key}|n [{', '.join(char.permissions.all())}] (played by"
-                            " someone else)"
-                        )
+                        result.append(f"\n - |R{char.key}|n [{perms}] (played by someone else)")
             else:
                 # character is available
-                result.append(f"\n - {char.key} [{', '.join(char.permissions.all())}]")
+                result.append(f"\n - {char.key} [{perms}]")
         look_string = ("-" * 68) + "\n" + "".join(result) + "\n" + ("-" * 68)
+        self.ndb._lobby = (cachekey, look_string)
         return look_string
 
 
@@ -226,16 +295,12 @@ class DeuCmdCharDelete(MuxAccountCommand):
             self.msg("Usage: loesche <charactername>")
             return
 
-        # use the playable_characters list to search
-        match = [
-            char
-            for char in utils.make_iter(account.db._playable_characters)
-            if char.key.lower() == self.args.lower()
-        ]
+        # use the playable characters to search
+        match = account.playable.get(self.args)
         if not match:
             self.msg("You have no such character to delete.")
             return
-        elif len(match) > 1:
+        elif sum(char.key.lower() == match.key.lower() for char in account.playable.all()) > 1:
             self.msg(
                 "Aborting - there are two characters with the same name. Ask an admin to delete the"
                 " right one."
@@ -249,9 +314,7 @@ class DeuCmdCharDelete(MuxAccountCommand):
                     # only take action
                     delobj = caller.ndb._char_to_delete
                     key = delobj.key
-                    caller.db._playable_characters = [
-                        pc for pc in caller.db._playable_characters if pc != delobj
-                    ]
+                    caller.playable.remove(delobj)
                     delobj.delete()
                     self.msg(f"Character '{key}' was permanently deleted.")
                     logger.log_sec(
@@ -261,7 +324,6 @@ class DeuCmdCharDelete(MuxAccountCommand):
                     self.msg("Deletion was aborted.")
                 del caller.ndb._char_to_delete
 
-            match = match[0]
             account.ndb._char_to_delete = match
 
             # Return if caller has no permission to delete this
@@ -320,18 +382,23 @@ class DeuCmdIC(MuxAccountCommand):
         else:
             # argument given
 
-            if account.db._playable_characters:
-                # look at the playable_characters list first
-                character_candidates.extend(
-                    utils.make_iter(
-                        account.search(
-                            self.args,
-                            candidates=account.db._playable_characters,
-                            search_object=True,
-                            quiet=True,
+            # look at the playable characters first, by name and then partially
+            playable = account.playable.get(self.args)
+            if playable:
+                character_candidates.append(playable)
+            else:
+                playable = account.playable.all()
+                if playable:
+                    character_candidates.extend(
+                        utils.make_iter(
+                            account.search(
+                                self.args,
+                                candidates=playable,
+                                search_object=True,
+                                quiet=True,
+                            )
                         )
                     )
-                )
 
             if account.locks.check_lockstring(account, "perm(Builder)"):
                 # builders and higher should be able to puppet more than their
@@ -396,10 +463,16 @@ class CmdWer(MuxAccountCommand):
 
     Usage:
       wer
+      wer [/raum] [/idle>10m | /idle<10m] [/seite <n>]
       doing
 
     Shows who is currently online. Doing is an alias that limits info
     also for those with all permissions.
+
+    The options list page by page: /raum only those in your room,
+    /idle>10m (or /idle<10m) those idle for longer (shorter) than the
+    given time (s, m, h or d; minutes if no unit is given), /seite
+    starts at the given page.
     """
 
     key = "wer"
@@ -411,69 +484,47 @@ class CmdWer(MuxAccountCommand):
 
     def func(self):
         """
-        Get all connected accounts by polling session.
+        Get all connected accounts from the roster.
         """
         account = self.account
-        session_list = evennia.SESSION_HANDLER.get_sessions()
-
-        session_list = sorted(session_list, key=lambda o: o.account.key)
-
         if self.cmdstring == "doing":
             show_session_data = False
         else:
             show_session_data = account.check_permstring("Developer") or account.check_permstring(
                 "Admins"
             )
+        try:
+            options = who.parse_options(self.raw)
+        except ValueError as err:
+            self.msg(f"Unbekannte Option: {err}\nBenutzung: wer [/raum] [/idle>10m] [/seite <n>]")
+            return
+        if not options:
+            self.msg(who.ROSTER.render(show_session_data, account, self.styled_table))
+            return
 
-        naccounts = evennia.SESSION_HANDLER.account_count()
-        if show_session_data:
-            # privileged info
-            table = self.styled_table(
-                "|wAccount Name",
-                "|wOn for",
-                "|wIdle",
-                "|wPuppeting",
-                "|wRoom",
-                "|wCmds",
-                "|wProtocol",
-                "|wHost",
-            )
-            for session in session_list:
-                if not session.logged_in:
-                    continue
-                delta_cmd = time.time() - session.cmd_last_visible
-                delta_conn = time.time() - session.conn_time
-                session_account = session.get_account()
-                puppet = session.get_puppet()
-                location = puppet.location.key if puppet and puppet.location else "None"
-                table.add_row(
-                    utils.crop(session_account.get_display_name(account), width=25),
-                    utils.time_format(delta_conn, 0),
-                    utils.time_format(delta_cmd, 1),
-                    utils.crop(puppet.get_display_name(account) if puppet else "None", width=25),
-                    utils.crop(location, width=25),
-                    session.cmd_total,
-                    session.protocol_key,
-                    isinstance(session.address, tuple) and session.address[0] or session.address,
-                )
-        else:
-            # unprivileged
-            table = self.styled_table("|wAccount name", "|wOn for", "|wIdle")
-            for session in session_list:
-                if not session.logged_in:
-                    continue
-                delta_cmd = time.time() - session.cmd_last_visible
-                delta_conn = time.time() - session.conn_time
-                session_account = session.get_account()
-                table.add_row(
-                    utils.crop(session_account.get_display_name(account), width=25),
-                    utils.time_format(delta_conn, 0),
-                    utils.time_format(delta_cmd, 1),
-                )
-        is_one = naccounts == 1
-        self.msg(
-            "|wAccounts:|n\n%s\n%s unique account%s logged in."
-            % (table, "One" if is_one else naccounts, "" if is_one else "s")
+        # one timestamp for all pages
+        now = time.time()
+        location = None
+        if options["room"]:
+            puppet = self.session.puppet if self.session else None
+            if not puppet or not puppet.location:
+                self.msg("Du bist in keinem Raum.")
+                return
+            location = puppet.location
+        sessions = who.filter_sessions(
+            who.ROSTER.sessions(), now, location=location, idle=options["idle"]
+        )
+        if not sessions:
+            self.msg("Niemand gefunden.")
+            return
+        who.WhoPager(
+            account,
+            sessions,
+            show_session_data,
+            self.styled_table,
+            now,
+            page=options["page"] or 1,
+            session=self.session,
         )
 
 class CmdEnde(MuxAccountCommand):
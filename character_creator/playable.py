@@ -0,0 +1,183 @@
+"""
+Playable characters
+
+Evennia keeps the characters of an account in the `_playable_characters`
+Attribute: a pickled list that is unpickled, cleaned of deleted characters
+and often written back on every OOC look, and searched by looping over it.
+
+`PlayableCharacters` (`account.playable`) stores the relation as a tag on
+each character instead (key: the account id, category `playable_by`):
+
+- the characters are loaded with one indexed query and kept by lower-case
+  key, so `get(name)` is a dict lookup,
+- `count()` doesn't load any objects,
+- deleting a character drops its tags with it, so there is nothing to
+  clean up.
+
+Code outside this game (Evennia's own `create_character`, the web admin
+...) still appends to the Attribute. The handler migrates whatever it finds
+there into tags on next use and leaves an empty list behind, so that code
+keeps working.
+
+    char = account.playable.get("Bob")
+    nchars = account.playable.count()
+
+"""
+from evennia.objects.models import ObjectDB
+
+TAG_CATEGORY = "playable_by"
+LEGACY_ATTRIBUTE = "_playable_characters"
+
+
+def _index(chars):
+    by_key = {}
+    for char in chars:
+        by_key.setdefault(char.key.lower(), char)
+    return by_key
+
+
+class PlayableCharacters:
+    """
+    Handler for the characters an account may play.
+
+    """
+
+    def __init__(self, account, legacy=False):
+        """
+        Args:
+            account (Account): The account.
+            legacy (bool, optional): Keep using the `_playable_characters`
+                Attribute as storage. Used for guests, whose characters are
+                cleaned up by Evennia through that list.
+
+        """
+        self.account = account
+        self.legacy = legacy
+        self._chars = None
+        self._by_key = {}
+
+    @property
+    def _tag(self):
+        return str(self.account.id)
+
+    def migrate(self):
+        """
+        Move characters found in the `_playable_characters` Attribute into
+        tags. Called on every use, as other code may append to it.
+
+        """
+        legacy = self.account.attributes.get(LEGACY_ATTRIBUTE)
+        if not legacy:
+            return
+        for char in legacy:
+            if char and char.pk:
+                char.tags.add(self._tag, category=TAG_CATEGORY)
+        # keep an empty list; Evennia appends to it and checks `in` it
+        self.account.attributes.add(LEGACY_ATTRIBUTE, [])
+        self._chars = None
+
+    def _load(self):
+        """
+        Returns:
+            tuple: `(characters, {lower-case key: character})`.
+
+        """
+        if self.legacy:
+            legacy = self.account.attributes.get(LEGACY_ATTRIBUTE) or []
+            chars = [char for char in legacy if char and char.pk]
+            return chars, _index(chars)
+        self.migrate()
+        chars = self._chars
+        if chars is None or any(
+            not char.pk or self._by_key.get(char.key.lower()) is None for char in chars
+        ):
+            # first use, or a character was deleted or renamed
+            chars = self._chars = list(
+                ObjectDB.objects.get_by_tag(key=self._tag, category=TAG_CATEGORY).order_by("id")
+            )
+            self._by_key = _index(chars)
+        return chars, self._by_key
+
+    def all(self):
+        """
+        Returns:
+            list: The playable characters, oldest first.
+
+        """
+        return list(self._load()[0])
+
+    def get(self, name):
+        """
+        Get a playable character by name (case-insensitive).
+
+        Returns:
+            Object or None: The character (the oldest one, should two
+                have the same name).
+
+        """
+        return self._load()[1].get(name.strip().lower())
+
+    def count(self):
+        """
+        Returns:
+            int: The number of playable characters.
+
+        """
+        if self.legacy or self._chars is not None:
+            return len(self._load()[0])
+        self.migrate()
+        return ObjectDB.objects.get_by_tag(key=self._tag, category=TAG_CATEGORY).count()
+
+    def add(self, char):
+        """
+        Make a character playable by the account.
+
+        """
+        if self.legacy:
+            chars = [pc for pc in self.account.attributes.get(LEGACY_ATTRIBUTE) or [] if pc]
+            if char not in chars:
+                self.account.attributes.add(LEGACY_ATTRIBUTE, chars + [char])
+            return
+        char.tags.add(self._tag, category=TAG_CATEGORY)
+        self._chars = None
+
+    def remove(self, char):
+        """
+        Make a character no longer playable by the account.
+
+        """
+        if self.legacy:
+            chars = self.account.attributes.get(LEGACY_ATTRIBUTE) or []
+            self.account.attributes.add(LEGACY_ATTRIBUTE, [pc for pc in chars if pc and pc != char])
+            return
+        char.tags.remove(self._tag, category=TAG_CATEGORY)
+        self._chars = None
+
+    def __contains__(self, char):
+        return char in self._load()[0]
+
+    def __len__(self):
+        return self.count()
+
+
+def migrate_all():
+    """
+    Migrate the `_playable_characters` Attribute of all accounts using this
+    handler, e.g. from `evennia shell`. Not needed for things to work - each
+    account is migrated on first use - but empties the old lists in one go.
+
+    Returns:
+        int: The number of accounts migrated.
+
+    """
+    from evennia.accounts.models import AccountDB
+
+    num = 0
+    for account in AccountDB.objects.filter(
+        db_attributes__db_key=LEGACY_ATTRIBUTE, db_attributes__db_category__isnull=True
+    ):
+        handler = getattr(account, "playable", None)
+        if handler is not None and not handler.legacy and account.attributes.get(LEGACY_ATTRIBUTE):
+            handler.migrate()
+            num += 1
+    return num
@@ -8,7 +8,7 @@ from evennia.commands.default import account
 from evennia.utils import inherits_from
 from evennia.utils.test_resources import BaseEvenniaCommandTest
 
-from . import character_creator
+from . import character_creator, playable
 
 
 class TestCharacterCreator(BaseEvenniaCommandTest):
@@ -43,3 +43,92 @@ class TestCharacterCreator(BaseEvenniaCommandTest):
         menu = self.session.ndb._menutree
         self.assertNotEqual(menu, None)
         self.assertTrue(inherits_from(self.session.new_char, DefaultCharacter))
+
+    def test_char_delete_same_name(self):
+        self.account.playable.add(self.char1)
+        self.account.playable.add(self.char2)
+        # the same name but for the case
+        self.char2.key = self.char1.key.upper()
+        self.call(
+            character_creator.DeuCmdCharDelete(),
+            self.char1.key.lower(),
+            "Aborting - there are two characters with the same name.",
+            caller=self.account,
+        )
+        self.assertEqual(self.account.playable.count(), 2)
+
+    def test_wer_options(self):
+        self.call(
+            character_creator.CmdWer(), " /foo", "Unbekannte Option: /foo", caller=self.account
+        )
+        with patch.object(character_creator.who, "ROSTER", character_creator.who.Roster()), patch(
+            "evennia.SESSION_HANDLER.get_sessions", return_value=[]
+        ):
+            self.call(
+                character_creator.CmdWer(), " /idle>10m", "Niemand gefunden.", caller=self.account
+            )
+
+    def test_ooc_look_prefetched_and_cached(self):
+        self.account.db._playable_characters = [self.char1, self.char2]
+        self.char2.db.chargen_step = "menunode_welcome"
+        self.char1.permissions.add("Player")
+        characters = self.account.playable.all()
+        with self.assertNumQueries(2):
+            text = self.account.at_look(target=characters, session=self.session)
+        self.assertIn("in der erschaffung", text)
+        self.assertIn("\n - Char [developer, player]", text)
+        # nothing changed - cached
+        with self.assertNumQueries(0):
+            self.assertEqual(self.account.at_look(target=characters, session=self.session), text)
+        # sessions changed
+        self.account.puppet_object(self.session, self.char1)
+        # done by the puppet hooks of our Character typeclass
+        character_creator.who.ROSTER.changed()
+        self.assertIn(
+            "|GChar|n [developer, player] (played by you in session 1)",
+            self.account.at_look(target=characters, session=self.session),
+        )
+
+
+class TestPlayableCharacters(BaseEvenniaCommandTest):
+    def setUp(self):
+        super().setUp()
+        self.account.swap_typeclass(character_creator.ContribChargenAccount)
+        self.account.db._playable_characters = [self.char1, None]
+
+    def test_migrates_legacy_list(self):
+        handler = self.account.playable
+        self.assertEqual(handler.count(), 1)
+        self.assertEqual(self.account.db._playable_characters, [])
+        self.assertTrue(self.char1.tags.has(str(self.account.id), category=playable.TAG_CATEGORY))
+        # appended by other code later
+        self.account.db._playable_characters.append(self.char2)
+        self.assertEqual(handler.all(), [self.char1, self.char2])
+
+    def test_get_and_count(self):
+        handler = self.account.playable
+        handler.add(self.char2)
+        self.assertEqual(handler.get(" CHAR2"), self.char2)
+        self.assertIsNone(handler.get("nobody"))
+        with self.assertNumQueries(0):
+            self.assertEqual(handler.count(), 2)
+            self.assertEqual(handler.get("char"), self.char1)
+        handler.remove(self.char1)
+        self.assertEqual(handler.all(), [self.char2])
+
+    def test_deleted_and_renamed(self):
+        handler = self.account.playable
+        handler.add(self.char2)
+        handler.all()
+        self.char2.key = "Renamed"
+        self.assertEqual(handler.get("renamed"), self.char2)
+        self.char2.delete()
+        self.assertEqual(handler.all(), [self.char1])
+
+    def test_legacy_storage(self):
+        handler = playable.PlayableCharacters(self.account, legacy=True)
+        handler.add(self.char2)
+        self.assertEqual(self.account.db._playable_characters, [self.char1, self.char2])
+        self.assertEqual(handler.get("char2"), self.char2)
+        handler.remove(self.char1)
+        self.assertEqual(self.account.db._playable_characters, [self.char2])
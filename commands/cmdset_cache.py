@@ -0,0 +1,367 @@
+"""
+Shared cmdsets
+
+Cmdsets like `DeuCmdSet` hold no per-character state, so there is no need
+for every character to build its own instance. This module keeps one
+pre-built instance per cmdset class (those marked `shared = True`) and
+installs it idempotently:
+
+    install_cmdset(character, DeuCmdSet)
+
+only touches the database the very first time a character gets the cmdset.
+After that (e.g. on every puppet) it is a pure in-memory check, at most
+swapping the instance Evennia re-imported on reload for the shared one.
+
+A shared instance is not bound to any object, so its commands get no
+`obj` (it stays `None`), and whether it is stored for an object is kept by
+that object's handler (`persistent_shared`), not on the instance.
+
+`dedupe_cmdset_storage` is run at server start to clean up characters
+that collected the same persistent cmdset several times.
+
+Merge caching
+
+Because all characters now stack the very same cmdset instances, merging
+them gives the same result for everyone:
+
+- `SharedCmdSetHandler` (the Character's `cmdset` handler) hands out the
+  shared instances and takes its merged `current` cmdset from a cache keyed
+  by the tuple of stacked cmdset keys and the object's permissions.
+- The cmdhandler's own merge cache is keyed on the ids of the cmdsets to
+  merge but only holds weak references, so the result is usually collected
+  right after the command and merged again for the next one.
+  `install_merge_cache` swaps it for a bounded LRU holding strong references
+  (each entry keeps its source cmdsets alive via `merged_from`, so the ids
+  stay valid), which turns the per-command merge into a dict lookup.
+
+Both caches are bounded LRUs; they are cleared with `clear_merge_cache`
+and start out empty on every reload.
+
+"""
+from collections import OrderedDict
+
+from evennia.commands.cmdsethandler import _CACHED_CMDSETS, CmdSetHandler, _EmptyCmdSet
+from evennia.objects.models import ObjectDB
+from evennia.utils import logger
+
+_SHARED_CMDSETS = {}
+
+# max number of merged cmdsets kept by each merge cache
+_MERGE_CACHE_SIZE = 2000
+
+
+def shared_cmdset(cmdset_class):
+    """
+    Get the shared instance of a cmdset class, building it on first use.
+
+    Args:
+        cmdset_class (CmdSet): A cmdset class without per-object state.
+
+    Returns:
+        cmdset (CmdSet): The shared instance. It is not bound to any object
+            (`cmdsetobj` is None).
+
+    """
+    cmdset = _SHARED_CMDSETS.get(cmdset_class.path)
+    if cmdset is None:
+        cmdset = _SHARED_CMDSETS[cmdset_class.path] = cmdset_class()
+    return cmdset
+
+
+def is_shared(cmdset):
+    """
+    Returns:
+        bool: If `cmdset` is the shared instance of its class.
+
+    """
+    return cmdset is _SHARED_CMDSETS.get(getattr(cmdset, "path", None))
+
+
+def install_cmdset(obj, cmdset_class, persistent=True):
+    """
+    Make sure `obj` has the shared instance of `cmdset_class` in its cmdset
+    stack, exactly once.
+
+    Args:
+        obj (Object): The object to install the cmdset on.
+        cmdset_class (CmdSet): The cmdset class to install.
+        persistent (bool, optional): Store the cmdset so it survives a reload.
+            This only matters the first time it is installed.
+
+    Returns:
+        added (bool): If the cmdset was newly added to the stack.
+
+    """
+    handler = obj.cmdset
+    shared = shared_cmdset(cmdset_class)
+    stack = handler.cmdset_stack
+    positions = [pos for pos, cset in enumerate(stack) if cset.path == shared.path]
+
+    if not positions:
+        handler.add(shared, persistent=persistent)
+        return True
+
+    changed = False
+    if len(positions) > 1:
+        # drop duplicates from memory and (once) from storage
+        for pos in reversed(positions[1:]):
+            del stack[pos]
+        storage = obj.cmdset_storage
+        deduped = _dedupe_paths(storage, shared.path)
+        if deduped != storage:
+            obj.cmdset_storage = deduped
+        changed = True
+    pos = positions[0]
+    if stack[pos] is not shared:
+        # re-imported instance (e.g. after reload); swap in the shared one
+        if stack[pos].persistent:
+            handler.persistent_shared.add(shared.path)
+        stack[pos] = shared
+        changed = True
+    if changed:
+        handler.update()
+    return False
+
+
+def _dedupe_paths(paths, path):
+    """
+    Remove all but the first occurrence of `path` from a list of cmdset
+    paths. The first (default cmdset) position is left alone.
+
+    """
+    seen = False
+    deduped = []
+    for pos, stored in enumerate(paths):
+        if pos and stored == path:
+            if seen:
+                continue
+            seen = True
+        deduped.append(stored)
+    return deduped
+
+
+def dedupe_cmdset_storage(path):
+    """
+    Remove duplicate entries of a persistent cmdset path from all objects'
+    cmdset storage. Works directly on the database field without loading
+    the typeclasses, so it is meant to run at server start.
+
+    Args:
+        path (str): Python path of the cmdset, like `cmdset_class.path`.
+
+    Returns:
+        fixed (int): The number of objects whose storage was cleaned up.
+
+    """
+    fixed = 0
+    rows = ObjectDB.objects.filter(db_cmdset_storage__contains=path).values_list(
+        "id", "db_cmdset_storage"
+    )
+    for dbid, storage in rows:
+        paths = [stored.strip() for stored in storage.split(",")]
+        deduped = _dedupe_paths(paths, path)
+        if deduped != paths:
+            ObjectDB.objects.filter(id=dbid).update(db_cmdset_storage=",".join(deduped))
+            fixed += 1
+    if fixed:
+        logger.log_info(f"Removed duplicate '{path}' cmdsets from {fixed} object(s).")
+    return fixed
+
+
+class SharedCmdSetHandler(CmdSetHandler):
+    """
+    CmdSetHandler using the shared instance of every cmdset class marked
+    with `shared = True`, and caching the merge of its stack.
+
+    """
+
+    def __init__(self, obj, init_true=True):
+        # paths of the shared cmdsets stored for this object; the `persistent`
+        # flag of a shared instance would be the same for all objects
+        self.persistent_shared = set()
+        super().__init__(obj, init_true)
+
+    def _import_cmdset(self, cmdset_path, emit_to_obj=None):
+        cmdset_class = _CACHED_CMDSETS.get(cmdset_path)
+        if cmdset_class and getattr(cmdset_class, "shared", False):
+            # class already imported once; skip building a throwaway instance
+            return shared_cmdset(cmdset_class)
+        cmdset = super()._import_cmdset(cmdset_path, emit_to_obj=emit_to_obj)
+        if cmdset and getattr(cmdset, "shared", False):
+            cmdset = shared_cmdset(type(cmdset))
+        return cmdset
+
+    def _merge_key(self):
+        """
+        Cache key of the current stack, or `None` if it holds cmdsets that
+        are not shared (their merge can't be reused for other objects).
+
+        """
+        keys = []
+        for cmdset in self.cmdset_stack:
+            if cmdset.key != "_EMPTY_CMDSET" and not is_shared(cmdset):
+                return None
+            keys.append(cmdset.key)
+        return tuple(keys), frozenset(self.obj.permissions.all())
+
+    def is_persistent(self, cmdset):
+        """
+        Returns:
+            bool: If `cmdset` is stored for this object.
+
+        """
+        if is_shared(cmdset):
+            return cmdset.path in self.persistent_shared
+        return cmdset.persistent
+
+    def add(self, cmdset, emit_to_obj=None, persistent=False, default_cmdset=False, **kwargs):
+        if isinstance(cmdset, type) and getattr(cmdset, "shared", False):
+            cmdset = shared_cmdset(cmdset)
+        elif isinstance(cmdset, str):
+            cmdset = self._import_cmdset(cmdset, emit_to_obj=emit_to_obj) or cmdset
+        if not is_shared(cmdset):
+            super().add(
+                cmdset,
+                emit_to_obj=emit_to_obj,
+                persistent=persistent,
+                default_cmdset=default_cmdset,
+                **kwargs,
+            )
+            return
+        # as `CmdSetHandler.add`, without setting `persistent` on the instance
+        if persistent:
+            storage = self.obj.cmdset_storage or [""]
+            if default_cmdset:
+                storage[0] = cmdset.path
+            else:
+                storage.append(cmdset.path)
+            self.obj.cmdset_storage = storage
+            self.persistent_shared.add(cmdset.path)
+        if default_cmdset:
+            self.cmdset_stack[0] = cmdset
+        else:
+            self.cmdset_stack.append(cmdset)
+        self.update()
+
+    def remove(self, cmdset=None, default_cmdset=False):
+        # as `CmdSetHandler.remove`, asking `is_persistent` instead of the instance
+        stack = self.cmdset_stack
+        if default_cmdset:
+            removed = stack[:1]
+            if stack:
+                if self.is_persistent(stack[0]):
+                    storage = self.obj.cmdset_storage or [""]
+                    storage[0] = ""
+                    self.obj.cmdset_storage = storage
+                stack[0] = _EmptyCmdSet(cmdsetobj=self.obj)
+            else:
+                self.cmdset_stack = [_EmptyCmdSet(cmdsetobj=self.obj)]
+        elif len(stack) < 2:
+            # don't allow deleting default cmdsets here.
+            return
+        elif not cmdset:
+            # remove the last one in the stack
+            removed = [stack.pop()]
+            if self.is_persistent(removed[0]):
+                storage = self.obj.cmdset_storage
+                storage.pop()
+                self.obj.cmdset_storage = storage
+        else:
+            if callable(cmdset) and hasattr(cmdset, "path"):
+                removed = [cset for cset in stack[1:] if cset.path == cmdset.path]
+            else:
+                removed = [cset for cset in stack[1:] if cmdset in (cset.path, cset.key)]
+            persistent = [cset for cset in removed if self.is_persistent(cset)]
+            if persistent:
+                storage = self.obj.cmdset_storage
+                for cset in persistent:
+                    if cset.path in storage:
+                        storage.remove(cset.path)
+                self.obj.cmdset_storage = storage
+            for cset in removed:
+                if cset in stack:
+                    stack.remove(cset)
+        storage = self.obj.cmdset_storage or []
+        for cset in removed:
+            if cset.path not in storage:
+                self.persistent_shared.discard(cset.path)
+        self.update()
+
+    # legacy alias
+    delete = remove
+
+    def update(self, init_mode=False):
+        if init_mode:
+            # imports the stored stack (see _import_cmdset) and merges it
+            super().update(init_mode=True)
+            self.persistent_shared.update(
+                cmdset.path for cmdset in self.cmdset_stack if is_shared(cmdset)
+            )
+            key = self._merge_key()
+            if key is not None:
+                _STACK_MERGES.setdefault(key, (self.current, list(self.mergetype_stack)))
+            return
+        key = self._merge_key()
+        cached = _STACK_MERGES.get(key) if key is not None else None
+        if cached:
+            self.current, mergetype_stack = cached
+            self.mergetype_stack = list(mergetype_stack)
+            return
+        super().update()
+        if key is not None:
+            _STACK_MERGES[key] = (self.current, list(self.mergetype_stack))
+
+
+class MergeCache(OrderedDict):
+    """
+    Bounded LRU mapping used in place of the cmdhandler's weak merge cache.
+
+    """
+
+    def __init__(self, maxsize=_MERGE_CACHE_SIZE):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+# (stacked cmdset keys, permissions) -> (merged current, mergetype stack)
+_STACK_MERGES = MergeCache()
+
+
+def install_merge_cache(maxsize=_MERGE_CACHE_SIZE):
+    """
+    Replace the cmdhandler's weak merge cache with a strong, bounded one.
+    Safe to call more than once.
+
+    """
+    from evennia.commands import cmdhandler
+
+    if not isinstance(cmdhandler._CMDSET_MERGE_CACHE, MergeCache):
+        cmdhandler._CMDSET_MERGE_CACHE = MergeCache(maxsize)
+
+
+def clear_merge_cache():
+    """
+    Forget all cached merges, e.g. after a shared cmdset was changed in place.
+
+    """
+    from evennia.commands import cmdhandler
+
+    _STACK_MERGES.clear()
+    cmdhandler._CMDSET_MERGE_CACHE.clear()
@@ -1,6 +1,11 @@
+import re
+
 from commands.command import Command
 from evennia import CmdSet
-from evennia.utils import utils
+from evennia.commands.default.muxcommand import MuxCommand
+from evennia.typeclasses.attributes import NickTemplateInvalid
+from world import broadcast, inventory, nameindex, statussheet, transfer
+from world.statblock import LEGACY_CATEGORIES, STAT_NAMES, migrate_legacy_stats
 
 
 class CmdEcho(Command):
@@ -28,87 +33,68 @@ class CmdSpielerStatus(Command):
     aliases = ["sp","status"]
 
     def func(self):
-
-        self.caller.msg("""
-+-----------------------------------------------------------------------------+
-|  Name: {name:60}         |
-+-----------------------------------------------------------------------------+
-|  Staerke      :{sta:3d}        Intelligenz :{int:3d}        Weissheit     :{wei:3d}        |
-|  Ausdauer     :{ausd:3d}        Vitalitaet  :{vit:3d}        konsentrazion :{kons:3d}        |
-|  Schnelligkeit:{schn:3d}        Aura        :{aur:3d}        Willenskraft  :{will:3d}        |
-+-----------------------------------------------------------------------------+
-|  lebenspunkte  :                                                            |
-|  Aktionspunkte :                                                            |
-|  Zauberpunkte  :                                                            |
-|  Manapunkte    :                                                            |
-+-----------------------------------------------------------------------------+
-|  Rasse : {rasse:15}        Rang : {rang:30}       |
-+-----------------------------------------------------------------------------+
-|  Level :{lvl:3d}                Erfahrungspunkte: {ep:30d} |
-+-----------------------------------------------------------------------------+ 
-                                                                   
-        """.format(sta=self.caller.staerke,
-        int=self.caller.intelligenz, 
-        wei=self.caller.weissheit,
-        ausd=self.caller.ausdauer,
-        vit=self.caller.vitalitaet,
-        kons=self.caller.konsentrazion,
-        schn=self.caller.schnelligkeit,
-        aur=self.caller.aura,
-        will=self.caller.willenskraft,
-        ep=self.caller.erfahrungspunke,
-        lvl=self.caller.level,
-        rasse=self.caller.attributes.get("rasse",category='rasse'),
-        rang=self.caller.rang,	
-        name=self.caller.name      ))
+        self.caller.msg(statussheet.get_sheet(self.caller).render())
 
 
 
-class CmdNimm(Command):
+class CmdStatusCache(Command):
     """
-    
-    Nimm etwas auf
+    Zeigt die Trefferquote des Spielerstatus-Caches
+
+    Usage:
+      statuscache
+      statuscache reset
 
+    Shows how often the status sheet was served from cache (hits) and
+    how often it had to be re-rendered (misses, with the number of
+    re-rendered cells). With 'reset' the counters are zeroed.
     """
 
-    key = "nimm"
-    aliases = ["nehmen", "aufheben"]
-    locks = "cmd:all();view:perm(Developer);read:perm(Developer)"
-    arg_regex = r"\s|$"
+    key = "statuscache"
+    locks = "cmd:perm(Admin)"
+    help_category = "Admin"
 
     def func(self):
-        """implements the command."""
+        if self.args.strip() == "reset":
+            statussheet.reset_cache_stats()
+            self.caller.msg("Statuscache-Zaehler zurueckgesetzt.")
+            return
+        stats = statussheet.cache_stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = 100.0 * stats["hits"] / total if total else 0.0
+        self.caller.msg(
+            f"Statuscache: {stats['hits']} Treffer, {stats['misses']} Fehlschlaege"
+            f" ({ratio:.1f}% Treffer), {stats['cells']} Zellen neu gerendert."
+        )
 
-        caller = self.caller
 
-        if not self.args:
-            caller.msg("Nimm was?")
-            return
-        obj = caller.search(self.args, location=caller.location)
-        if not obj:
-            return
-        if caller == obj:
-            caller.msg("Du kannst Dich nicht selber nehmen.")
-            return
-        if not obj.access(caller, "get"):
-            if obj.db.get_err_msg:
-                caller.msg(obj.db.get_err_msg)
-            else:
-                caller.msg("Du kannst das nicht nehmen.")
-            return
+class CmdStatMigrate(Command):
+    """
+    Stellt alte Character auf den Statblock um
 
-        # calling at_pre_get hook method
-        if not obj.at_pre_get(caller):
-            return
+    Usage:
+      statmigrate
+
+    Characters created before the stat block stored each stat as its own
+    Attribute. This packs those values into the stat block record and
+    removes the old Attributes.
+    """
+
+    key = "statmigrate"
+    locks = "cmd:perm(Developer)"
+    help_category = "Admin"
+
+    def func(self):
+        # imported here to avoid a circular import with the typeclass
+        from typeclasses.characters import Character
+
+        candidates = Character.objects.filter_family(
+            db_attributes__db_category__in=LEGACY_CATEGORIES,
+            db_attributes__db_key__in=STAT_NAMES,
+        ).distinct()
+        migrated = migrate_legacy_stats(candidates)
+        self.caller.msg(f"{migrated} Character auf den Statblock umgestellt.")
 
-        success = obj.move_to(caller, quiet=True, move_type="get")
-        if not success:
-            caller.msg("Das kann man nicht aufheben.")
-        else:
-            singular, _ = obj.get_numbered_name(1, caller)
-            caller.location.msg_contents(f"$You() nimmt {singular}.", from_obj=caller)
-            # calling at_get hook method
-            obj.at_get(caller)
 
 #-------------------------------------------------------------------------------------------
 class CmdHomeDeu(Command):
@@ -142,6 +128,11 @@ class CmdNimm(Command):
     
     Nimm etwas auf
 
+    Usage:
+      nimm <obj>
+      nimm <anzahl> <obj>
+      nimm alles
+
     """
 
     key = "nimm"
@@ -157,7 +148,11 @@ class CmdNimm(Command):
         if not self.args:
             caller.msg("Nimm was?")
             return
-        obj = caller.search(self.args, location=caller.location)
+        bulk = transfer.parse_amount(self.args)
+        if bulk:
+            self.get_many(*bulk)
+            return
+        obj = nameindex.search(caller, self.args, caller.location)
         if not obj:
             return
         if caller == obj:
@@ -183,8 +178,30 @@ class CmdNimm(Command):
             # calling at_get hook method
             obj.at_get(caller)
 
+    def get_many(self, amount, name):
+        """nimm alles / nimm <anzahl> <obj>"""
+        caller = self.caller
+        objs = transfer.select(caller, amount, name, caller.location)
+        if not objs:
+            if amount is None:
+                caller.msg("Hier liegt nichts, was du nehmen koenntest.")
+            return
+
+        def _can_get(obj):
+            return obj.access(caller, "get") and obj.at_pre_get(caller)
 
-class CmdNickDeu(Command):
+        moved = transfer.transfer(objs, caller, "get", check=_can_get)
+        if not moved:
+            caller.msg("Du kannst das nicht nehmen.")
+            return
+        caller.location.msg_contents(
+            f"$You() nimmt {transfer.describe(moved, caller)}.", from_obj=caller
+        )
+        for obj in moved:
+            obj.at_get(caller)
+
+
+class CmdNickDeu(MuxCommand):
     """
     define a personal alias/nick by defining a string to
     match and replace it with another on the fly
@@ -259,11 +276,13 @@ class CmdNickDeu(Command):
         specified_nicktype = bool(nicktypes)
         nicktypes = nicktypes if specified_nicktype else ["inputline"]
 
-        nicklist = (
-            utils.make_iter(caller.nicks.get(category="inputline", return_obj=True) or [])
-            + utils.make_iter(caller.nicks.get(category="object", return_obj=True) or [])
-            + utils.make_iter(caller.nicks.get(category="account", return_obj=True) or [])
-        )
+        # all nicks in one go, instead of one lookup per type
+        nicks_by_type = caller.nicks.by_category()
+        nicklist = [
+            nick
+            for nicktype in ("inputline", "object", "account")
+            for nick in nicks_by_type.get(nicktype, ())
+        ]
 
         if "list" in switches or self.cmdstring in ("nicks",):
 
@@ -327,56 +346,7 @@ class CmdNickDeu(Command):
             if not specified_nicktype:
                 nicktypes = ("object", "account", "inputline")
             for nicktype in nicktypes:
-                nicks = [
-                    nick
-                    for nick in utils.make_iter(
-                        caller.nicks.get(category=nicktype, return_obj=True)
-                    )
-                    if nick
-                ]
-                for nick in nicks:
-                    _, _, nick, repl = nick.value
-                    if nick.startswith(self.lhs):
-                        strings.append(f"{nicktype.capitalize()}-nick: '{nick}' -> '{repl}'")
-            if strings:
-                caller.msg("\n".join(strings))
-            else:
-                caller.msg(f"No nicks found matching '{self.lhs}'")
-            return
-
-        if not self.rhs and self.lhs:
-            # check what a nick is set to
-            strings = []
-            if not specified_nicktype:
-                nicktypes = ("object", "account", "inputline")
-            for nicktype in nicktypes:
-                if nicktype == "account":
-                    obj = account
-                else:
-                    obj = caller
-                nicks = utils.make_iter(obj.nicks.get(category=nicktype, return_obj=True))
-                for nick in nicks:
-                    _, _, nick, repl = nick.value
-                    if nick.startswith(self.lhs):
-                        strings.append(f"{nicktype.capitalize()}-nick: '{nick}' -> '{repl}'")
-            if strings:
-                caller.msg("\n".join(strings))
-            else:
-                caller.msg(f"No nicks found matching '{self.lhs}'")
-            return
-
-        if not self.rhs and self.lhs:
-            # check what a nick is set to
-            strings = []
-            if not specified_nicktype:
-                nicktypes = ("object", "account", "inputline")
-            for nicktype in nicktypes:
-                if nicktype == "account":
-                    obj = account
-                else:
-                    obj = caller
-                nicks = utils.make_iter(obj.nicks.get(category=nicktype, return_obj=True))
-                for nick in nicks:
+                for nick in nicks_by_type.get(nicktype, ()):
                     _, _, nick, repl = nick.value
                     if nick.startswith(self.lhs):
                         strings.append(f"{nicktype.capitalize()}-nick: '{nick}' -> '{repl}'")
@@ -443,35 +413,42 @@ class CmdAusruestung(Command):
     Zeigt dir deine Ausruestung an
 
     Usage:
-      inventory
-      inv
+      inventory [<seite>]
+      inv [<seite>]
+      inv /suche <name>
       1
       ausruestung
       ausr
-    Shows your inventory.
+    Shows your inventory, grouping identical items. Long inventories are
+    shown in pages.
     """
 
     key = "inventory"
     aliases = ["inv", "i","ausr","ausruestung"]
     locks = "cmd:all()"
-    arg_regex = r"$"
+    arg_regex = r"\s|$"
 
     def func(self):
         """check inventory"""
-        items = self.caller.contents
-        if not items:
-            string = "Du hast nichts bei dir."
+        args = self.args.strip()
+        page, search = 1, None
+        if args.startswith("/suche"):
+            search = args[len("/suche") :].strip()
+        elif args.isdigit():
+            page = int(args)
+        elif args:
+            self.caller.msg("Usage: inv [<seite>] oder inv /suche <name>")
+            return
+
+        table, page, npages = inventory.get_view(self.caller).render(
+            self.styled_table, page=page, search=search
+        )
+        if not table:
+            string = f"Du hast kein {search} bei dir." if search else "Du hast nichts bei dir."
         else:
-            from evennia.utils.ansi import raw as raw_ansi
-
-            table = self.styled_table(border="header")
-            for item in items:
-                singular, _ = item.get_numbered_name(1, self.caller)
-                table.add_row(
-                    f"|C{singular}|n",
-                    "{}|n".format(utils.crop(raw_ansi(item.db.desc or ""), width=50) or ""),
-                )
             string = f"|wDu traegst bei dir:\n{table}"
+            if npages > 1:
+                string += f"\n|wSeite {page}/{npages}|n (inv <seite>)"
         self.caller.msg(text=(string, {"type": "inventory"}))
 
 
@@ -481,6 +458,8 @@ class CmdLeg(Command):
 
     Usage:
       leg <obj>
+      leg <anzahl> <obj>
+      leg alles
 
     Lets you drop an object from your inventory into the
     location you are currently in.
@@ -498,12 +477,17 @@ class CmdLeg(Command):
         if not self.args:
             caller.msg("Lege was?")
             return
+        bulk = transfer.parse_amount(self.args)
+        if bulk:
+            self.drop_many(*bulk)
+            return
 
         # Because the DROP command by definition looks for items
         # in inventory, call the search function using location = caller
-        obj = caller.search(
+        obj = nameindex.search(
+            caller,
             self.args,
-            location=caller,
+            caller,
             nofound_string=f"{self.args} hast du nicht bei dir.",
             multimatch_string=f"Welches {self.args} willst du hinlegen:",
         )
@@ -519,10 +503,30 @@ class CmdLeg(Command):
             caller.msg("Das kannst du nicht hinlegen.")
         else:
             singular, _ = obj.get_numbered_name(1, caller)
-            caller.location.msg_contents(f"$You() $conj(drop) {singular}.", from_obj=caller)
+            caller.location.msg_contents(f"$You() legt {singular} ab.", from_obj=caller)
             # Call the object script's at_drop() method.
             obj.at_drop(caller)
 
+    def drop_many(self, amount, name):
+        """leg alles / leg <anzahl> <obj>"""
+        caller = self.caller
+        objs = transfer.select(caller, amount, name, caller)
+        if not objs:
+            if amount is None:
+                caller.msg("Du hast nichts bei dir.")
+            return
+        moved = transfer.transfer(
+            objs, caller.location, "drop", check=lambda obj: obj.at_pre_drop(caller)
+        )
+        if not moved:
+            caller.msg("Das kannst du nicht hinlegen.")
+            return
+        caller.location.msg_contents(
+            f"$You() legt {transfer.describe(moved, caller)} ab.", from_obj=caller
+        )
+        for obj in moved:
+            obj.at_drop(caller)
+
 
 class CmdGib(Command):
     """
@@ -530,6 +534,8 @@ class CmdGib(Command):
 
     Usage:
       gib <obj> <=> <Ziel>
+      gib <anzahl> <obj> = <Ziel>
+      gib alles = <Ziel>
 
     Gives an item from your inventory to another person,
     placing it in their inventory.
@@ -540,6 +546,11 @@ class CmdGib(Command):
     locks = "cmd:all()"
     arg_regex = r"\s|$"
 
+    def parse(self):
+        """split into <obj> = <Ziel>"""
+        lhs, _, rhs = self.args.partition("=")
+        self.lhs, self.rhs = lhs.strip(), rhs.strip()
+
     def func(self):
         """Implement give"""
 
@@ -547,9 +558,14 @@ class CmdGib(Command):
         if not self.args or not self.rhs:
             caller.msg("Usage: gib <object> = <Ziel>")
             return
-        to_give = caller.search(
+        bulk = transfer.parse_amount(self.lhs)
+        if bulk:
+            self.give_many(*bulk)
+            return
+        to_give = nameindex.search(
+            caller,
             self.lhs,
-            location=caller,
+            caller,
             nofound_string=f"{self.lhs} hast du nicht bei dir.",
             multimatch_string=f"Du traegst mehrer von {self.lhs}:",
         )
@@ -559,7 +575,7 @@ class CmdGib(Command):
 
         singular, _ = to_give.get_numbered_name(1, caller)
         if target == caller:
-            caller.msg(f"Wollte sich das wohl selbst geben.")
+            caller.msg("Wollte sich das wohl selbst geben.")
             return
         if not to_give.location == caller:
             caller.msg(f"{singular} wolltest du wohl behalten.")
@@ -579,6 +595,31 @@ class CmdGib(Command):
             # Call the object script's at_give() method.
             to_give.at_give(caller, target)
 
+    def give_many(self, amount, name):
+        """gib alles = <Ziel> / gib <anzahl> <obj> = <Ziel>"""
+        caller = self.caller
+        target = caller.search(self.rhs)
+        if not target:
+            return
+        if target == caller:
+            caller.msg("Wollte sich das wohl selbst geben.")
+            return
+        objs = transfer.select(caller, amount, name, caller)
+        if not objs:
+            if amount is None:
+                caller.msg("Du hast nichts bei dir.")
+            return
+        moved = transfer.transfer(
+            objs, target, "give", check=lambda obj: obj.at_pre_give(caller, target)
+        )
+        if not moved:
+            caller.msg(f"Du konntest das wohl {target.key} nicht geben.")
+            return
+        caller.msg(f"du gibst {transfer.describe(moved, caller)} an {target.key}.")
+        target.msg(f"{caller.key} hat dir {transfer.describe(moved, target)} gegeben.")
+        for obj in moved:
+            obj.at_give(caller, target)
+
 
 
 class CmdSag(Command):
@@ -619,7 +660,7 @@ class CmdSag(Command):
         caller.at_say(speech, msg_self=True)
 
 
-class Cmdfluestern(Command):
+class Cmdfluestern(MuxCommand):
     """
     Sprechen von Spieler zu Spieler
 
@@ -643,10 +684,10 @@ class Cmdfluestern(Command):
             caller.msg("Benutze: fluester <Spieler> = <Nachricht>")
             return
 
-        receivers = [recv.strip() for recv in self.lhs.split(",")]
+        names = dict.fromkeys(recv.strip() for recv in self.lhs.split(","))
 
-        receivers = [caller.search(receiver) for receiver in set(receivers)]
-        receivers = [recv for recv in receivers if recv]
+        # one pass over the room for all names instead of a search per name
+        receivers = broadcast.resolve_names(caller, names)
 
         speech = self.rhs
         # If the speech is empty, abort the command
@@ -658,7 +699,7 @@ class Cmdfluestern(Command):
 
         # no need for self-message if we are whispering to ourselves (for some reason)
         msg_self = None if caller in receivers else True
-        caller.at_say(speech, msg_self=msg_self, receivers=receivers, whisper=True)
+        broadcast.whisper(caller, speech, receivers, msg_self=msg_self)
 
 
 class CmdEmoteDeu(Command):
@@ -711,6 +752,15 @@ class CmdEmoteDeu(Command):
 
 #---------------------------------------------------------------------------------------------
 class DeuCmdSet(CmdSet):
+    """
+    The German command layer on top of the default character commands.
+    Holds no per-character state; one shared instance is used for all
+    characters (see `commands.cmdset_cache`), so its commands must not use
+    `self.obj` (it is `None`).
+    """
+
+    key = "DeuCmdSet"
+    shared = True
 
     def at_cmdset_creation(self):
         self.add(CmdEcho)
@@ -724,3 +774,5 @@ class DeuCmdSet(CmdSet):
         self.add(CmdAusruestung)
         self.add(CmdNickDeu)
         self.add(CmdHomeDeu)
+        self.add(CmdStatMigrate)
+        self.add(CmdStatusCache)
@@ -15,7 +15,6 @@ own cmdsets by inheriting from them or directly from `evennia.CmdSet`.
 """
 
 from evennia import default_cmds
-from character_creator.character_creator import *
 from evennia.utils import utils
 from evennia.contrib.grid import extended_room 
 
@@ -25,9 +24,15 @@ class CharacterCmdSet(default_cmds.CharacterCmdSet):
     The `CharacterCmdSet` contains general in-game commands like `look`,
     `get`, etc available on in-game Character objects. It is merged with
     the `AccountCmdSet` when an Account puppets a Character.
+
+    One instance is shared by all characters, so its commands are not bound
+    to any of them: `self.obj` is `None` and must not be used, use
+    `self.caller` instead.
     """
 
     key = "DefaultCharacter"
+    # stateless; one instance is shared by all characters (see commands.cmdset_cache)
+    shared = True
 
     def at_cmdset_creation(self):
         """
@@ -61,6 +66,15 @@ class CharacterCmdSet(default_cmds.CharacterCmdSet):
 class AccountCmdSet(default_cmds.AccountCmdSet):
 
     def at_cmdset_creation(self):
+        # imported when the first account logs in, not at server start
+        from character_creator.character_creator import (
+            CmdEnde,
+            CmdWer,
+            ContribCmdCharCreate,
+            DeuCmdCharDelete,
+            DeuCmdIC,
+        )
+
         super().at_cmdset_creation()
         self.add(ContribCmdCharCreate)
         self.add(DeuCmdCharDelete)
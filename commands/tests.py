@@ -0,0 +1,344 @@
+"""
+Tests for the game commands and cmdset handling.
+
+"""
+
+from unittest.mock import patch
+
+from evennia.commands import cmdparser as default_cmdparser
+from evennia.commands.command import Command
+from evennia.objects.models import ObjectDB
+from evennia.utils import create
+from evennia.utils.test_resources import EvenniaCommandTest, EvenniaTest
+
+from server.benchmarks import benchmark, compare
+from server.conf import cmdparser
+
+from . import cmdset_cache
+from world import inventory
+
+from .d_commands import (
+    CmdAusruestung,
+    CmdGib,
+    CmdLeg,
+    CmdNickDeu,
+    CmdNimm,
+    Cmdfluestern,
+    DeuCmdSet,
+)
+
+
+class TestCmdSetCache(EvenniaTest):
+    def _deu_sets(self, obj):
+        return [cset for cset in obj.cmdset.cmdset_stack if cset.path == DeuCmdSet.path]
+
+    def test_install_is_idempotent(self):
+        self.assertTrue(cmdset_cache.install_cmdset(self.char1, DeuCmdSet))
+        self.assertFalse(cmdset_cache.install_cmdset(self.char1, DeuCmdSet))
+        self.assertEqual(len(self._deu_sets(self.char1)), 1)
+        self.assertEqual(self.char1.cmdset_storage.count(DeuCmdSet.path), 1)
+
+    def test_instance_is_shared(self):
+        cmdset_cache.install_cmdset(self.char1, DeuCmdSet)
+        cmdset_cache.install_cmdset(self.char2, DeuCmdSet)
+        self.assertIs(self._deu_sets(self.char1)[0], self._deu_sets(self.char2)[0])
+
+    def test_reimported_instance_is_swapped(self):
+        self.char1.cmdset.add(DeuCmdSet, persistent=True)
+        # what a plain CmdSetHandler would have imported from storage
+        self.char1.cmdset.cmdset_stack[-1] = DeuCmdSet(self.char1)
+        storage = self.char1.db_cmdset_storage
+        cmdset_cache.install_cmdset(self.char1, DeuCmdSet)
+        self.assertIs(self._deu_sets(self.char1)[0], cmdset_cache.shared_cmdset(DeuCmdSet))
+        self.assertEqual(self.char1.db_cmdset_storage, storage)
+
+    def test_persistence_per_object(self):
+        self.char1.cmdset.add(DeuCmdSet, persistent=True)
+        self.char2.cmdset.add(DeuCmdSet, persistent=False)
+        shared = cmdset_cache.shared_cmdset(DeuCmdSet)
+        self.assertTrue(self.char1.cmdset.is_persistent(shared))
+        self.assertFalse(self.char2.cmdset.is_persistent(shared))
+        # removing the unstored one doesn't touch the other's storage
+        self.char2.cmdset.remove(DeuCmdSet)
+        self.assertIn(DeuCmdSet.path, self.char1.cmdset_storage)
+        self.char1.cmdset.remove(DeuCmdSet)
+        self.assertNotIn(DeuCmdSet.path, self.char1.cmdset_storage)
+        self.assertFalse(self.char1.cmdset.is_persistent(shared))
+
+    def test_reimported_persistence_kept(self):
+        self.char1.cmdset.add(DeuCmdSet, persistent=True)
+        self.char1.cmdset.cmdset_stack[-1] = DeuCmdSet(self.char1)
+        self.char1.cmdset.cmdset_stack[-1].persistent = True
+        self.char1.cmdset.persistent_shared.clear()
+        cmdset_cache.install_cmdset(self.char1, DeuCmdSet)
+        self.assertTrue(self.char1.cmdset.is_persistent(cmdset_cache.shared_cmdset(DeuCmdSet)))
+
+    def test_dedupe_storage(self):
+        for _ in range(3):
+            self.char1.cmdset.add(DeuCmdSet, persistent=True)
+        self.assertEqual(cmdset_cache.dedupe_cmdset_storage(DeuCmdSet.path), 1)
+        storage = ObjectDB.objects.filter(id=self.char1.id).values_list(
+            "db_cmdset_storage", flat=True
+        )[0]
+        self.assertEqual(storage.split(",").count(DeuCmdSet.path), 1)
+        self.assertEqual(cmdset_cache.dedupe_cmdset_storage(DeuCmdSet.path), 0)
+
+
+class TestMergeCache(EvenniaTest):
+    def test_stack_merge_shared_between_characters(self):
+        cmdset_cache.install_cmdset(self.char1, DeuCmdSet)
+        cmdset_cache.install_cmdset(self.char2, DeuCmdSet)
+        self.assertIs(self.char1.cmdset.cmdset_stack[0], self.char2.cmdset.cmdset_stack[0])
+        self.char2.permissions.add(self.char1.permissions.all())
+        self.char2.cmdset.update()
+        self.assertIs(self.char1.cmdset.current, self.char2.cmdset.current)
+        # the German commands shadow the defaults in the merged set
+        self.assertEqual(self.char1.cmdset.current.get("nimm").__class__.__name__, "CmdNimm")
+
+    def test_permissions_are_part_of_key(self):
+        cmdset_cache.install_cmdset(self.char1, DeuCmdSet)
+        cmdset_cache.install_cmdset(self.char2, DeuCmdSet)
+        self.char2.permissions.clear()
+        self.char2.permissions.add("Builder")
+        self.char2.cmdset.update()
+        self.assertIsNot(self.char1.cmdset.current, self.char2.cmdset.current)
+
+    def test_lru_bounds(self):
+        cache = cmdset_cache.MergeCache(maxsize=2)
+        cache["a"], cache["b"] = 1, 2
+        cache["a"]
+        cache["c"] = 3
+        self.assertEqual(list(cache), ["a", "c"])
+
+    def test_stack_merges_bounded(self):
+        cmdset_cache.clear_merge_cache()
+        with patch.object(cmdset_cache._STACK_MERGES, "maxsize", 1):
+            self.char1.cmdset.update()
+            # another key: the permissions are part of it
+            self.char1.permissions.add("Builder")
+            self.char1.cmdset.update()
+            self.assertEqual(len(cmdset_cache._STACK_MERGES), 1)
+            ((_, permissions),) = cmdset_cache._STACK_MERGES.keys()
+            self.assertIn("builder", permissions)
+
+    def test_cmdhandler_merge_is_kept(self):
+        from evennia.commands import cmdhandler
+
+        cmdset_cache.install_merge_cache()
+        cmdset_cache.clear_merge_cache()
+        first = cmdhandler.get_and_merge_cmdsets(
+            self.char1, None, None, self.char1, "object", ""
+        ).result
+        first_id = id(first)
+        del first
+        second = cmdhandler.get_and_merge_cmdsets(
+            self.char1, None, None, self.char1, "object", ""
+        ).result
+        self.assertEqual(id(second), first_id)
+        self.assertEqual(len(cmdhandler._CMDSET_MERGE_CACHE), 1)
+
+
+class TestTrieCmdParser(EvenniaTest):
+    INPUTS = (
+        "f bob=hallo",
+        ":grinst",
+        "i",
+        "b",
+        "nimm schwert",
+        "nimmschwert",
+        "2-nimm schwert",
+        "nimm-2 schwert",
+        "@home",
+        "home",
+        "spielerstatus",
+        "look",
+        "l",
+        "LOOK me",
+        "@@@",
+        "@",
+        "gibt es nicht",
+        "sag hallo",
+        "'hallo",
+        "help nimm",
+    )
+
+    def setUp(self):
+        super().setUp()
+        cmdset_cache.install_cmdset(self.char1, DeuCmdSet)
+        self.cmdset = self.char1.cmdset.current
+
+    def test_same_matches_as_default_parser(self):
+        for raw_string in self.INPUTS:
+            for match_index in (None, 1, 2):
+                with self.subTest(raw_string=raw_string, match_index=match_index):
+                    self.assertEqual(
+                        cmdparser.cmdparser(raw_string, self.cmdset, self.char1, match_index),
+                        default_cmdparser.cmdparser(
+                            raw_string, self.cmdset, self.char1, match_index
+                        ),
+                    )
+
+    def test_trie_is_cached_per_cmdset(self):
+        trie = cmdparser.get_trie(self.cmdset)
+        self.assertIs(cmdparser.get_trie(self.cmdset), trie)
+
+    def test_no_command_asked_to_match(self):
+        cmdparser.get_trie(self.cmdset)
+        with patch.object(Command, "match", autospec=True, side_effect=Command.match) as match:
+            for raw_string in self.INPUTS:
+                cmdparser.cmdparser(raw_string, self.cmdset, self.char1)
+            self.assertEqual(match.call_count, 0)
+            # the default parser asks every command, for every input
+            for raw_string in self.INPUTS:
+                default_cmdparser.cmdparser(raw_string, self.cmdset, self.char1)
+            self.assertGreaterEqual(match.call_count, len(self.INPUTS) * len(self.cmdset.commands))
+
+    @benchmark
+    def test_benchmark_against_default_parser(self):
+        def run(parser):
+            for raw_string in self.INPUTS:
+                parser(raw_string, self.cmdset, self.char1)
+
+        cmdparser.get_trie(self.cmdset)
+        times = compare(
+            f"cmdparser, {len(self.INPUTS)} inputs, {len(self.cmdset.commands)} commands",
+            50,
+            trie=lambda: run(cmdparser.cmdparser),
+            default=lambda: run(default_cmdparser.cmdparser),
+        )
+        self.assertLess(times["trie"], times["default"])
+
+
+class TestBulkTransfer(EvenniaCommandTest):
+    def setUp(self):
+        super().setUp()
+        self.swords = [
+            create.create_object("typeclasses.objects.Object", key="Schwert", location=self.room1)
+            for _ in range(3)
+        ]
+
+    def test_nimm_alles(self):
+        self.call(CmdNimm(), "alles", "You nimmt")
+        for obj in self.swords + [self.obj1, self.obj2]:
+            self.assertEqual(obj.location, self.char1)
+        # characters and exits stay where they are
+        self.assertEqual(self.char2.location, self.room1)
+        self.assertEqual(self.exit.location, self.room1)
+
+    def test_nimm_anzahl(self):
+        self.call(CmdNimm(), "2 Schwert", "You nimmt two Schwerts.")
+        self.assertEqual(sum(obj.location == self.char1 for obj in self.swords), 2)
+
+    def test_one_room_message(self):
+        with patch.object(self.room1, "msg_contents") as msg_contents:
+            self.call(CmdNimm(), "alles")
+        msg_contents.assert_called_once()
+
+    def test_lege_alles(self):
+        for obj in self.swords:
+            obj.move_to(self.char1, quiet=True)
+        self.call(CmdLeg(), "alles", "You legt three Schwerts ab.")
+        self.assertFalse(self.char1.contents)
+
+    def test_gib_alles(self):
+        for obj in self.swords:
+            obj.move_to(self.char1, quiet=True)
+        self.call(CmdGib(), "alles = Char2", "du gibst three Schwerts an Char2.")
+        self.assertEqual(len(self.char2.contents), 3)
+
+    def test_gib_alles_self(self):
+        self.call(CmdGib(), "alles = Char", "Wollte sich das wohl selbst geben.")
+
+
+class TestCmdfluestern(EvenniaCommandTest):
+    def test_whisper(self):
+        with patch.object(self.char2, "msg") as msg:
+            self.call(Cmdfluestern(), "Char2 = hallo", "You whisper to Char2")
+        self.assertIn("hallo", msg.call_args.kwargs["text"][0])
+
+    def test_several_receivers(self):
+        with patch.object(self.char2, "msg") as msg2, patch.object(self.obj1, "msg") as msg1:
+            self.call(Cmdfluestern(), "Char2, Obj = hallo", "You whisper to Char2")
+        self.assertIn("hallo", msg1.call_args.kwargs["text"][0])
+        self.assertIn("hallo", msg2.call_args.kwargs["text"][0])
+
+    def test_usage(self):
+        self.call(Cmdfluestern(), "Char2", "Benutze: fluester <Spieler> = <Nachricht>")
+
+
+class TestInventory(EvenniaCommandTest):
+    def _give(self, key, count=1, desc=None):
+        for _ in range(count):
+            obj = create.create_object("typeclasses.objects.Object", key=key, location=self.char1)
+            if desc:
+                obj.db.desc = desc
+
+    def test_groups_identical_items(self):
+        self._give("Pfeil", 3, desc="Ein spitzer Pfeil.")
+        self._give("Schild")
+        output = self.call(CmdAusruestung(), "", "Du traegst bei dir:")
+        self.assertIn("three Pfeils", output)
+        self.assertIn("Ein spitzer Pfeil.", output)
+        self.assertIn("a Schild", output)
+
+    def test_pages_and_search(self):
+        for num in range(inventory.PAGE_SIZE + 5):
+            self._give(f"Ding{num:02d}")
+        output = self.call(CmdAusruestung(), "")
+        self.assertIn("Seite 1/2", output)
+        self.assertNotIn("Ding24", output)
+        output = self.call(CmdAusruestung(), "2")
+        self.assertIn("Ding24", output)
+        self.assertNotIn("Ding00", output)
+        output = self.call(CmdAusruestung(), "/suche ding03")
+        self.assertIn("Ding03", output)
+        self.assertNotIn("Ding04", output)
+
+    def test_cached_until_inventory_changes(self):
+        self._give("Pfeil", 2)
+        with patch.object(inventory, "prefetch_descs", wraps=inventory.prefetch_descs) as fetch:
+            self.call(CmdAusruestung(), "")
+            self.call(CmdAusruestung(), "")
+            self.assertEqual(fetch.call_count, 1)
+            self.obj1.move_to(self.char1, quiet=True)
+            self.call(CmdAusruestung(), "", "Du traegst bei dir:")
+            self.assertEqual(fetch.call_count, 2)
+            self._give("Schild")
+            self.call(CmdAusruestung(), "", "Du traegst bei dir:")
+            self.assertEqual(fetch.call_count, 3)
+
+    def test_desc_change_invalidates(self):
+        self._give("Pfeil", desc="Spitz.")
+        self.call(CmdAusruestung(), "", "Du traegst bei dir:")
+        pfeil = self.char1.contents[0]
+        pfeil.db.desc = "Stumpf."
+        output = self.call(CmdAusruestung(), "")
+        self.assertIn("Stumpf.", output)
+        pfeil.attributes.remove("desc")
+        output = self.call(CmdAusruestung(), "")
+        self.assertNotIn("Stumpf.", output)
+
+    def test_only_last_search_kept(self):
+        self._give("Pfeil")
+        view = inventory.get_view(self.char1)
+        for search in ("a", "b", "c"):
+            self.call(CmdAusruestung(), f"/suche {search}")
+        self.assertEqual(list(view._pages), [1])
+        self.assertEqual(view._search, "c")
+
+    def test_prefetch_descs(self):
+        self._give("Pfeil", desc="Spitz.")
+        self._give("Schild")
+        descs = inventory.prefetch_descs(self.char1.contents)
+        self.assertEqual(list(descs.values()), ["Spitz."])
+
+
+class TestCmdNickDeu(EvenniaCommandTest):
+    def test_add_lookup_list_delete(self):
+        self.call(CmdNickDeu(), "hi = sag Hallo!", "Inputline-nick 'hi' mapped to 'sag Hallo!'.")
+        self.call(CmdNickDeu(), "/object tom = der grosse Mann", "Object-nick 'tom' mapped to")
+        self.call(CmdNickDeu(), "h", "Inputline-nick: 'hi' -> 'sag Hallo!'")
+        self.call(CmdNickDeu(), "/list", "Defined Nicks:")
+        self.assertEqual(self.char1.nicks.nickreplace("hi"), "sag Hallo!")
+        self.call(CmdNickDeu(), "/delete hi", "Inputline-nick removed: 'hi' -> sag Hallo!.")
+        self.assertEqual(self.char1.nicks.nickreplace("hi"), "hi")
@@ -0,0 +1,45 @@
+"""
+Benchmarks
+
+Timing one way of doing something against another is too noisy for the test
+suite on a busy machine. The tests check what a change saves in terms that
+don't vary between runs (queries, calls), and the timings only run when
+asked for, with the `BENCHMARKS` environment variable or setting:
+
+    BENCHMARKS=1 evennia test --settings settings.py
+
+Benchmark tests are marked with `@benchmark` and time their candidates with
+`compare()`.
+
+"""
+import os
+from timeit import timeit
+from unittest import skipUnless
+
+from django.conf import settings
+
+ENABLED = bool(os.environ.get("BENCHMARKS") or getattr(settings, "BENCHMARKS", False))
+
+benchmark = skipUnless(ENABLED, "set BENCHMARKS=1 to run the benchmarks")
+
+
+def compare(title, number, **funcs):
+    """
+    Time functions against each other and print the result.
+
+    Args:
+        title (str): What is timed.
+        number (int): How often to call each function.
+        **funcs (callable): The functions to time, by name.
+
+    Returns:
+        dict: Seconds per call, by name.
+
+    """
+    times = {name: timeit(func, number=number) / number for name, func in funcs.items()}
+    print(f"\n{title}: " + ", ".join(f"{name} {_format(secs)}" for name, secs in times.items()))
+    return times
+
+
+def _format(secs):
+    return f"{secs * 1e6:.1f}us" if secs < 0.001 else f"{secs * 1000:.1f}ms"
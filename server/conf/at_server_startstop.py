@@ -30,7 +30,27 @@ def at_server_start():
     This is called every time the server starts up, regardless of
     how it was shut down.
     """
-    pass
+    from commands.cmdset_cache import (
+        dedupe_cmdset_storage,
+        install_merge_cache,
+        shared_cmdset,
+    )
+    from commands.d_commands import DeuCmdSet
+    from server.menu_login import usernames
+    from server.menu_login.screen_cache import SCREENS
+    from world import chargen_draft, charnames
+
+    # clean up stacks that collected DeuCmdSet on every puppet, then
+    # pre-build the instance shared by all characters
+    dedupe_cmdset_storage(DeuCmdSet.path)
+    shared_cmdset(DeuCmdSet)
+    # keep merged cmdsets around instead of re-merging on every command
+    install_merge_cache()
+    usernames.at_server_start()
+    SCREENS.load()
+    charnames.at_server_start()
+    # save chargen choices a crash kept from being saved
+    chargen_draft.recover_all()
 
 
 def at_server_stop():
@@ -38,7 +58,9 @@ def at_server_stop():
     This is called just before the server is shut down, regardless
     of it is for a reload, reset or shutdown.
     """
-    pass
+    from world import chargen_draft
+
+    chargen_draft.flush_all()
 
 
 def at_server_reload_start():
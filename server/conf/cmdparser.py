@@ -23,13 +23,140 @@ three elements being the parsed cmdname (lower case), the remaining
 arguments, and the matched cmdobject from the cmdset.
 
 
-This module is not accessed by default. To tell Evennia to use it
-instead of the default command parser, add the following line to
-your settings file:
+This module replaces the default parser (see `COMMAND_PARSER` in the
+settings file):
 
     COMMAND_PARSER = "server.conf.cmdparser.cmdparser"
 
+It returns exactly the same matches as the default parser, but instead of
+asking every command in the cmdset whether it matches, it walks a prefix
+trie over all command keys and aliases (including one-letter aliases like
+`f`, `i`, `b` or the `:` pose alias). That makes a lookup O(len(input))
+rather than O(number of commands). The trie is built once per merged
+cmdset and kept for as long as that cmdset lives.
+
 """
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+
+from evennia.commands.cmdparser import create_match, try_num_differentiators
+from evennia.utils.logger import log_trace
+
+_CMD_IGNORE_PREFIXES = settings.CMD_IGNORE_PREFIXES
+
+# merged cmdset -> CmdTrie
+_TRIE_CACHE = WeakKeyDictionary()
+
+
+class CmdTrie:
+    """
+    Prefix trie over the keys and aliases of all commands in a cmdset.
+
+    Two tries are kept: one over the full keys/aliases and one over the
+    variants with ignored prefixes (like `@`) stripped, mirroring the two
+    modes of `Command.match`. Each terminal node lists
+    `(cmd_index, rank, cmdname, raw_cmdname)`, where `rank` is the position
+    of the key/alias in the order `Command.match` tries them.
+
+    """
+
+    __slots__ = ("commands", "prefixed", "noprefix")
+
+    def __init__(self, cmdset):
+        # Commands all hash the same and compare by key/alias, so they are
+        # referred to by their position in the cmdset rather than used as keys
+        self.commands = list(cmdset)
+        self.prefixed = {}
+        self.noprefix = {}
+        for index, cmd in enumerate(self.commands):
+            for rank, keyalias in enumerate(cmd._keyaliases):
+                self._insert(self.prefixed, keyalias, (index, rank, keyalias, keyalias))
+            for rank, (stripped, keyalias) in enumerate(cmd._noprefix_aliases.items()):
+                self._insert(self.noprefix, stripped, (index, rank, stripped, keyalias))
+
+    @staticmethod
+    def _insert(root, word, entry):
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(entry)
+
+    def lookup(self, search_string, include_prefixes=True):
+        """
+        Find the commands whose key or alias starts the search string.
+
+        Args:
+            search_string (str): Lower-case input.
+            include_prefixes (bool, optional): Match the unstripped keys.
+
+        Returns:
+            list: `(cmd, cmdname, raw_cmdname)` for each matching command, in
+                cmdset order. For every command this is the key/alias
+                `Command.match` would have returned.
+
+        """
+        node = self.prefixed if include_prefixes else self.noprefix
+        candidates = list(node.get(None, ()))
+        for char in search_string:
+            node = node.get(char)
+            if node is None:
+                break
+            candidates.extend(node.get(None, ()))
+        if not candidates:
+            return []
+
+        best = {}
+        commands = self.commands
+        for index, rank, cmdname, raw_cmdname in candidates:
+            if index in best and best[index][0] < rank:
+                continue
+            arg_regex = commands[index].arg_regex
+            if not arg_regex or arg_regex.match(search_string[len(cmdname) :]):
+                best[index] = (rank, cmdname, raw_cmdname)
+        return [
+            (commands[index], cmdname, raw_cmdname)
+            for index, (_, cmdname, raw_cmdname) in sorted(best.items())
+        ]
+
+
+def get_trie(cmdset):
+    """
+    Get the (cached) trie of a merged cmdset.
+
+    """
+    trie = _TRIE_CACHE.get(cmdset)
+    if trie is None or len(trie.commands) != len(cmdset.commands):
+        # new cmdset, or commands were added to it after the merge
+        trie = _TRIE_CACHE[cmdset] = CmdTrie(cmdset)
+    return trie
+
+
+def build_matches(raw_string, cmdset, include_prefixes=False):
+    """
+    Trie-based drop-in for `evennia.commands.cmdparser.build_matches`.
+
+    Args:
+        raw_string (str): Input string; the command name/alias must be first in it.
+        cmdset (CmdSet): The current cmdset to pick Commands from.
+        include_prefixes (bool): If set, include prefixes like @, ! etc (specified in settings)
+            in the match, otherwise strip them before matching.
+
+    Returns:
+        matches (list) A list of match tuples created by `cmdparser.create_match`.
+
+    """
+    matches = []
+    try:
+        if not include_prefixes and len(raw_string) > 1:
+            raw_string = raw_string.lstrip(_CMD_IGNORE_PREFIXES)
+        search_string = raw_string.lower()
+        for cmd, cmdname, raw_cmdname in get_trie(cmdset).lookup(search_string, include_prefixes):
+            if cmdname:
+                matches.append(create_match(cmdname, raw_string, cmd, raw_cmdname))
+    except Exception:
+        log_trace("cmdhandler error. raw_input:%s" % raw_string)
+    return matches
 
 
 def cmdparser(raw_string, cmdset, caller, match_index=None):
@@ -44,7 +171,7 @@ def cmdparser(raw_string, cmdset, caller, match_index=None):
                   list of same-named command matches.
 
     Returns:
-     list of tuples: [(cmdname, args, cmdobj, cmdlen, mratio), ...]
+     list of tuples: [(cmdname, args, cmdobj, cmdlen, mratio, raw_cmdname), ...]
             where cmdname is the matching command name and args is
             everything not included in the cmdname. Cmdobj is the actual
             command instance taken from the cmdset, cmdlen is the length
@@ -52,4 +179,58 @@ def cmdparser(raw_string, cmdset, caller, match_index=None):
             (possibly) separate multiple matches.
 
     """
-    # Your implementation here
+    if not raw_string:
+        return []
+
+    # find matches, first using the full name
+    matches = build_matches(raw_string, cmdset, include_prefixes=True)
+
+    if not matches or len(matches) > 1:
+        # no single match, try parsing for optional numerical tags like 1-cmd
+        # or cmd-2, cmd.2 etc
+        match_index, new_raw_string = try_num_differentiators(raw_string)
+        if match_index is not None:
+            matches.extend(build_matches(new_raw_string, cmdset, include_prefixes=True))
+
+    if not matches and _CMD_IGNORE_PREFIXES:
+        # still no match. Try to strip prefixes
+        raw_string = raw_string.lstrip(_CMD_IGNORE_PREFIXES) if len(raw_string) > 1 else raw_string
+        matches = build_matches(raw_string, cmdset, include_prefixes=False)
+
+    # only select command matches we are actually allowed to call.
+    matches = [match for match in matches if match[2].access(caller, "cmd")]
+
+    # try to bring the number of matches down to 1
+    if len(matches) > 1:
+        # See if it helps to analyze the match with preserved case but only if
+        # it leaves at least one match.
+        trimmed = [match for match in matches if raw_string.startswith(match[0])]
+        if trimmed:
+            matches = trimmed
+
+    if len(matches) > 1:
+        # we still have multiple matches. Sort them by count quality.
+        matches = sorted(matches, key=lambda m: m[3])
+        # only pick the matches with highest count quality
+        quality = [mat[3] for mat in matches]
+        matches = matches[-quality.count(quality[-1]) :]
+
+    if len(matches) > 1:
+        # still multiple matches. Fall back to ratio-based quality.
+        matches = sorted(matches, key=lambda m: m[4])
+        # only pick the highest rated ratio match
+        quality = [mat[4] for mat in matches]
+        matches = matches[-quality.count(quality[-1]) :]
+
+    if len(matches) > 1 and match_index is not None:
+        # We couldn't separate match by quality, but we have an
+        # index argument to tell us which match to use.
+        if 0 < match_index <= len(matches):
+            matches = [matches[match_index - 1]]
+        else:
+            # we tried to give an index outside of the range - this means
+            # a no-match
+            matches = []
+
+    # no matter what we have at this point, we have to return it.
+    return matches
@@ -52,6 +52,9 @@ AUTO_CREATE_CHARACTER_WITH_ACCOUNT = False
 AUTO_PUPPET_ON_LOGIN = False
 CHARGEN_MENU = "world.char_menu"
 
+# trie-based drop-in for the default command parser
+COMMAND_PARSER = "server.conf.cmdparser.cmdparser"
+
 ######################################################################
 # Settings given in secret_settings.py override those in this file.
 ######################################################################
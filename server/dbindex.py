@@ -0,0 +1,40 @@
+"""
+Functional indexes
+
+Case-insensitive lookups (`LOWER(column) = ...`) can't use a plain index on
+the column. `create_lower_index()` adds a functional index on
+`LOWER(column)`, for the name lookups of the login
+(`server.menu_login.usernames`) and of chargen (`world.charnames`).
+
+"""
+from django.db import DatabaseError, connection
+
+from evennia.utils import logger
+
+
+def create_lower_index(table, column, name):
+    """
+    Create a functional index on `LOWER(column)` of a table, if the database
+    supports it. Does nothing if the index exists.
+
+    Args:
+        table (str): The table, like `Model._meta.db_table`.
+        column (str): The column to index the lower-case values of.
+        name (str): The name of the index.
+
+    Returns:
+        bool: If the index exists now.
+
+    """
+    if connection.vendor == "mysql":
+        sql = f"CREATE INDEX {name} ON {table} ((LOWER({column})))"
+    else:
+        sql = f"CREATE INDEX IF NOT EXISTS {name} ON {table} (LOWER({column}))"
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+    except DatabaseError as err:
+        # mysql has no IF NOT EXISTS here and fails if the index exists
+        logger.log_info(f"Index {name} not created: {err}")
+        return False
+    return True
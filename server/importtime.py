@@ -0,0 +1,129 @@
+"""
+Import-time report
+
+Measures what importing the game's startup modules costs, with Python's own
+`-X importtime` in a fresh interpreter, so modules already imported by the
+running process don't hide anything. Every reload pays this again, so it's
+worth keeping small - modules only some commands need (like the chargen
+menu) should be imported where they're used.
+
+The test suite checks that none of `LAZY_MODULES` gets imported at startup,
+and that no more than `IMPORT_BUDGET_MODULES` game modules are. The time
+itself varies with the machine, so it's only checked against
+`IMPORT_BUDGET_MS` (and the report printed) with the benchmarks:
+
+    BENCHMARKS=1 evennia test --settings settings.py server.tests
+
+"""
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+
+# what the server imports from the game dir when it starts
+STARTUP_MODULES = (
+    "server.conf.at_server_startstop",
+    "commands.default_cmdsets",
+    "typeclasses.accounts",
+    "typeclasses.characters",
+    "typeclasses.rooms",
+    "typeclasses.exits",
+    "typeclasses.objects",
+    "typeclasses.scripts",
+    "typeclasses.channels",
+)
+# packages of the game dir
+GAME_PACKAGES = ("character_creator", "commands", "server", "typeclasses", "web", "world")
+# only imported once needed
+LAZY_MODULES = ("world.char_menu", "character_creator.account_commands")
+# game modules imported at startup
+IMPORT_BUDGET_MODULES = getattr(settings, "IMPORT_BUDGET_MODULES", 35)
+# self time of all game modules together
+IMPORT_BUDGET_MS = getattr(settings, "IMPORT_BUDGET_MS", 100)
+
+_SCRIPT = """
+import django
+django.setup()
+import evennia
+evennia._init()
+{imports}
+"""
+_RE_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure(modules=STARTUP_MODULES):
+    """
+    Import `modules` after setting up Evennia in a new interpreter.
+
+    Returns:
+        list: `(module, self µs, cumulative µs, depth)` for every module
+            imported, in import order.
+
+    """
+    imports = "\n".join(f"import {module}" for module in modules)
+    env = dict(os.environ)
+    settings_module = env.get("DJANGO_SETTINGS_MODULE") or "server.conf.settings"
+    if settings_module.endswith(".py"):
+        # `evennia test --settings settings.py` leaves the file name here
+        settings_module = f"server.conf.{settings_module[:-3]}"
+    env["DJANGO_SETTINGS_MODULE"] = settings_module
+    # the same import path, as the settings module may be found through it
+    env["PYTHONPATH"] = os.pathsep.join([settings.GAME_DIR] + [path for path in sys.path if path])
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SCRIPT.format(imports=imports)],
+        cwd=settings.GAME_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode:
+        raise RuntimeError(f"Import failed:\n{proc.stderr[-2000:]}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = _RE_LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            entries.append((module, int(own), int(cumulative), len(indent) // 2))
+    return entries
+
+
+def is_game_module(module):
+    return module.split(".", 1)[0] in GAME_PACKAGES
+
+
+def game_modules(entries):
+    """
+    Returns:
+        list: The game modules imported, in import order.
+
+    """
+    return [module for module, _, _, _ in entries if is_game_module(module)]
+
+
+def game_cost(entries):
+    """
+    Returns:
+        float: The self time of all game modules, in ms.
+
+    """
+    return sum(own for module, own, _, _ in entries if is_game_module(module)) / 1000
+
+
+def report(entries, top=15):
+    """
+    Returns:
+        str: The game modules that took longest to import, and the total.
+
+    """
+    game = sorted(
+        (entry for entry in entries if is_game_module(entry[0])), key=lambda entry: -entry[1]
+    )
+    lines = [f"{'module':<45} {'self ms':>8} {'cumul. ms':>10}"]
+    for module, own, cumulative, _ in game[:top]:
+        lines.append(f"{module:<45} {own / 1000:>8.1f} {cumulative / 1000:>10.1f}")
+    lines.append(
+        f"{len(game)} game modules: {game_cost(entries):.1f}ms (budget {IMPORT_BUDGET_MS}ms)"
+    )
+    return "\n".join(lines)
@@ -0,0 +1,313 @@
+"""
+Login admission
+
+Every new connection gets its own login menu right away. A crawler or bot
+flood opening hundreds of connections thus builds hundreds of menus, all
+competing with the logged-in players for the server.
+
+`ADMISSION` decides, before any menu is built, whether a new connection
+may log in now:
+
+- every address has a token bucket; connecting faster than it refills
+  gets the connection dropped right away, as does having more than
+  `max_per_ip` connections logging in or waiting at once,
+- a global token bucket and a limit of login menus open at once
+  (`max_active`) shape the overall rate; connections over it wait in a
+  bounded queue and are told their place in it,
+- if the queue is full too, the connection is dropped.
+
+Queued connections get their menu when a login menu closes or the global
+bucket has refilled. A connection that hasn't logged in `LOGIN_TIMEOUT`
+seconds after getting its menu is dropped, so idle connections can't hold
+on to the places forever.
+
+    ADMISSION.admit(session, start_menu)   # start_menu(session) builds the menu
+    ADMISSION.release(session)             # when the login menu closes
+
+"""
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from twisted.internet import reactor
+
+import evennia
+
+# tokens (connections) per address: burst and refill per second
+PER_IP_BURST = getattr(settings, "LOGIN_PER_IP_BURST", 5)
+PER_IP_RATE = getattr(settings, "LOGIN_PER_IP_RATE", 0.1)
+# tokens for all connections together
+GLOBAL_BURST = getattr(settings, "LOGIN_GLOBAL_BURST", 50)
+GLOBAL_RATE = getattr(settings, "LOGIN_GLOBAL_RATE", 10)
+# login menus open at once, and connections waiting for one
+MAX_ACTIVE = getattr(settings, "LOGIN_MAX_ACTIVE", 100)
+MAX_QUEUED = getattr(settings, "LOGIN_MAX_QUEUED", 200)
+# connections per address logging in or waiting at once
+MAX_PER_IP = getattr(settings, "LOGIN_MAX_PER_IP", 3)
+# seconds to log in, once the login menu is open
+LOGIN_TIMEOUT = getattr(settings, "LOGIN_TIMEOUT", 120)
+# forget full per-address buckets when there are more than this
+MAX_BUCKETS = 10000
+
+_MSG_THROTTLED = "|RZu viele Verbindungen von deiner Adresse, bitte versuche es spaeter.|n"
+_MSG_FULL = "|RDer Server ist gerade ueberlastet, bitte versuche es spaeter.|n"
+_MSG_QUEUED = "Es melden sich gerade viele an. Du bist Nummer {} in der Warteschlange."
+_MSG_TIMEOUT = "|RDie Anmeldung hat zu lange gedauert, bitte verbinde dich neu.|n"
+
+
+class TokenBucket:
+    """
+    Allows `burst` events at once and `rate` more per second after that.
+
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + max(0, now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, now):
+        """
+        Use up a token, if there is one.
+
+        Returns:
+            bool: If there was a token.
+
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait(self, now):
+        """
+        Returns:
+            float: Seconds until the next token.
+
+        """
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class AdmissionController:
+    """
+    Decides which new connections get a login menu, and when.
+
+    """
+
+    def __init__(
+        self,
+        per_ip_rate=PER_IP_RATE,
+        per_ip_burst=PER_IP_BURST,
+        global_rate=GLOBAL_RATE,
+        global_burst=GLOBAL_BURST,
+        max_active=MAX_ACTIVE,
+        max_queued=MAX_QUEUED,
+        max_per_ip=MAX_PER_IP,
+        timeout=LOGIN_TIMEOUT,
+    ):
+        self.per_ip_rate = per_ip_rate
+        self.per_ip_burst = per_ip_burst
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_per_ip = max_per_ip
+        self.timeout = timeout
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic())
+        self._buckets = {}
+        # sessid -> session with an open login menu
+        self._active = {}
+        # (session, start callable)
+        self._queue = deque()
+        # address -> connections of it active or queued
+        self._per_ip = Counter()
+        # sessid -> timer dropping the session if it hasn't logged in
+        self._deadlines = {}
+        self._timer = None
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _alive(self, session):
+        return session.sessid in evennia.SESSION_HANDLER
+
+    def _reject(self, session, message):
+        self.rejected += 1
+        session.msg(message)
+        session.sessionhandler.disconnect(session, "")
+
+    def _address(self, session):
+        address = session.address
+        return address[0] if isinstance(address, tuple) else address
+
+    def _forget(self, session):
+        # the session neither logs in nor waits anymore
+        address = self._address(session)
+        self._per_ip[address] -= 1
+        if self._per_ip[address] <= 0:
+            del self._per_ip[address]
+        deadline = self._deadlines.pop(session.sessid, None)
+        if deadline is not None and deadline.active():
+            deadline.cancel()
+
+    def _ip_bucket(self, address, now):
+        bucket = self._buckets.get(address)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                # a full bucket is the same as none at all
+                self._buckets = {
+                    key: old for key, old in self._buckets.items() if not old.is_full(now)
+                }
+            bucket = self._buckets[address] = TokenBucket(self.per_ip_rate, self.per_ip_burst, now)
+        return bucket
+
+    def _prune(self):
+        # drop sessions that disconnected without closing their menu
+        for sessid, sess in list(self._active.items()):
+            if not self._alive(sess):
+                del self._active[sessid]
+                self._forget(sess)
+        if any(not self._alive(sess) for sess, _ in self._queue):
+            for sess, _ in self._queue:
+                if not self._alive(sess):
+                    self._forget(sess)
+            self._queue = deque(entry for entry in self._queue if self._alive(entry[0]))
+
+    def _has_room(self):
+        if len(self._active) >= self.max_active:
+            self._prune()
+        return len(self._active) < self.max_active
+
+    def _start(self, session, start):
+        self._active[session.sessid] = session
+        self._deadlines[session.sessid] = self._call_later(self.timeout, self._expire, session)
+        start(session)
+
+    def _expire(self, session):
+        self._deadlines.pop(session.sessid, None)
+        if self._active.get(session.sessid) is session:
+            self.timed_out += 1
+            session.msg(_MSG_TIMEOUT)
+            session.sessionhandler.disconnect(session, "")
+            self.release(session)
+
+    def admit(self, session, start, now=None):
+        """
+        Let a new connection in, queue it or drop it.
+
+        Args:
+            session (Session): The new connection.
+            start (callable): Called as `start(session)` to build its login
+                menu, now or once it's its turn.
+            now (float, optional): Current `time.monotonic()`.
+
+        Returns:
+            bool: `False` if the connection was dropped.
+
+        """
+        now = time.monotonic() if now is None else now
+        address = self._address(session)
+        if self._per_ip[address] >= self.max_per_ip:
+            # some of them may be gone already
+            self._prune()
+        if self._per_ip[address] >= self.max_per_ip or not self._ip_bucket(address, now).take(now):
+            self._reject(session, _MSG_THROTTLED)
+            return False
+        if not self._queue and self._has_room() and self._global.take(now):
+            self._per_ip[address] += 1
+            self._start(session, start)
+            return True
+        if len(self._queue) >= self.max_queued:
+            self._reject(session, _MSG_FULL)
+            return False
+        self._per_ip[address] += 1
+        self._queue.append((session, start))
+        session.msg(_MSG_QUEUED.format(len(self._queue)))
+        self._schedule(now)
+        return True
+
+    def position(self, session):
+        """
+        Returns:
+            int: The place of a session in the queue; 0 if not queued.
+
+        """
+        for position, (queued, _) in enumerate(self._queue, 1):
+            if queued.sessid == session.sessid:
+                return position
+        return 0
+
+    def release(self, session):
+        """
+        A login menu closed; let the next connection in.
+
+        """
+        if self._active.pop(session.sessid, None) is None:
+            return
+        self._forget(session)
+        if self._queue:
+            self.drain()
+
+    def drain(self, now=None):
+        """
+        Start login menus for queued connections, as far as there is room.
+
+        """
+        now = time.monotonic() if now is None else now
+        started = False
+        while self._queue and self._has_room():
+            session, start = self._queue[0]
+            if not self._alive(session):
+                self._queue.popleft()
+                self._forget(session)
+                continue
+            if not self._global.take(now):
+                break
+            self._queue.popleft()
+            self._start(session, start)
+            started = True
+        if started:
+            for position, (session, _) in enumerate(self._queue, 1):
+                session.msg(_MSG_QUEUED.format(position))
+        self._schedule(now)
+
+    def _on_timer(self):
+        self._timer = None
+        self.drain()
+
+    def _call_later(self, delay, func, *args):
+        return reactor.callLater(delay, func, *args)
+
+    def _schedule(self, now):
+        # wait for the global bucket to refill - or, if all menus are taken,
+        # check now and then for connections that dropped without closing theirs
+        if self._queue and self._timer is None:
+            delay = self._global.wait(now) if len(self._active) < self.max_active else 1
+            self._timer = self._call_later(max(0.1, delay), self._on_timer)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Login menus `active`, connections `queued` and the totals
+                of `rejected` connections and those `timed_out` logging in.
+
+        """
+        return {
+            "active": len(self._active),
+            "queued": len(self._queue),
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+ADMISSION = AdmissionController()
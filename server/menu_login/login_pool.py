@@ -0,0 +1,174 @@
+"""
+Login worker pool
+
+Checking a password (and hashing a new one) runs PBKDF2 with many thousand
+iterations - on purpose, it's supposed to be slow. Done in the reactor
+thread, every login attempt freezes the game for that long, and after a
+restart a few dozen reconnecting clients freeze it for seconds.
+
+`LOGIN_POOL` runs only the hashing in a small, bounded thread pool instead
+(it releases the GIL, so threads are enough) and fires a Deferred with the
+result back in the reactor thread. Looking up and creating the account, with
+all its hooks and signals, stays in the reactor thread, as the ORM and the
+typeclass caches aren't safe to use from other threads. It also
+
+- limits how many logins per IP address may be in flight at once,
+- keeps counters for monitoring (`LOGIN_POOL.metrics()`), and logs a
+  warning when the queue of waiting logins grows long.
+
+    deferred = LOGIN_POOL.submit(address, check_password, password, account.password)
+    if deferred is None:
+        ...  # too many logins from this address
+    deferred.addCallback(...)
+
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+from evennia.utils import logger
+
+# worker threads hashing passwords
+MAX_WORKERS = getattr(settings, "LOGIN_WORKER_THREADS", 4)
+# logins in flight per IP address
+MAX_PER_IP = getattr(settings, "LOGIN_MAX_PER_IP", 2)
+# warn when this many logins wait for a worker
+QUEUE_WARNING = getattr(settings, "LOGIN_QUEUE_WARNING", 20)
+
+
+def check_password(password, encoded):
+    """
+    Check a password against its stored hash. Run in the pool.
+
+    Args:
+        password (str): The password given.
+        encoded (str or None): The stored hash; `None` if there is no such
+            account, which takes as long to check (so doesn't give that away).
+
+    Returns:
+        tuple: `(valid, rehashed)`; `rehashed` is a new hash of the password
+            to store if its hasher settings changed since, else `None`.
+
+    """
+    rehashed = []
+    valid = hashers.check_password(
+        password, encoded, setter=lambda raw: rehashed.append(hashers.make_password(raw))
+    )
+    return valid, rehashed[0] if rehashed else None
+
+
+def hash_password(password):
+    """
+    Hash a new password. Run in the pool.
+
+    Returns:
+        str: The hash to store.
+
+    """
+    return hashers.make_password(password)
+
+
+class LoginPool:
+    """
+    Bounded worker pool for login and account creation.
+
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_per_ip=MAX_PER_IP):
+        self.max_workers = max_workers
+        self.max_per_ip = max_per_ip
+        self._pool = None
+        # address -> logins in flight
+        self._per_ip = {}
+        self.pending = 0
+        self.max_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._warned = False
+
+    def _start(self):
+        if self._pool is None:
+            self._pool = ThreadPool(minthreads=0, maxthreads=self.max_workers, name="login")
+            self._pool.start()
+            reactor.addSystemEventTrigger("during", "shutdown", self._pool.stop)
+        return self._pool
+
+    def _run(self, func, *args, **kwargs):
+        return threads.deferToThreadPool(reactor, self._start(), func, *args, **kwargs)
+
+    @property
+    def queued(self):
+        """Logins waiting for a free worker."""
+        return max(0, self.pending - self.max_workers)
+
+    def submit(self, address, func, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` in the pool.
+
+        Args:
+            address (str or tuple): Address the login comes from.
+            func (callable): Usually `check_password` or `hash_password`;
+                it must not touch the database.
+
+        Returns:
+            Deferred or None: Fires with the return of `func` in the reactor
+                thread. `None` if `address` already has `max_per_ip` logins
+                in flight; nothing is run then.
+
+        """
+        address = address[0] if isinstance(address, tuple) else address
+        if self._per_ip.get(address, 0) >= self.max_per_ip:
+            self.rejected += 1
+            return None
+        self._per_ip[address] = self._per_ip.get(address, 0) + 1
+        self.pending += 1
+        self.submitted += 1
+        queued = self.queued
+        self.max_queued = max(self.max_queued, queued)
+        if queued >= QUEUE_WARNING and not self._warned:
+            self._warned = True
+            logger.log_warn(f"Login pool: {queued} logins waiting for a worker.")
+
+        def _done(result, failed=False):
+            self.pending -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            if self._per_ip[address] <= 1:
+                del self._per_ip[address]
+            else:
+                self._per_ip[address] -= 1
+            if self._warned and not self.queued:
+                self._warned = False
+            return result
+
+        deferred = self._run(func, *args, **kwargs)
+        deferred.addCallbacks(_done, _done, errbackKeywords={"failed": True})
+        return deferred
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Counters for monitoring - logins `pending` (running or
+                queued), `queued` now and `max_queued` so far, addresses
+                with logins `in_flight_ips`, and totals of `submitted`,
+                `completed`, `failed` and `rejected` logins.
+
+        """
+        return {
+            "pending": self.pending,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "in_flight_ips": len(self._per_ip),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+LOGIN_POOL = LoginPool()
@@ -1,5 +1,5 @@
 """
-A login menu using EvMenu.
+A menu-like login.
 
 Contribution - Vincent-lg 2016, Griatch 2019 (rework for modern EvMenu)
 
@@ -15,22 +15,26 @@ Reload the server and the new connection method will be active. If you want to m
 way the connection screen looks, use the current one as a guide and create a new one in your
 game folder. Then update the settings file CONNECTION_SCREEN_MODULE to point to yours.
 
-This uses Evennia's menu system EvMenu and is triggered by a command that is
-called automatically when a new user connects.
+This started out on Evennia's menu system EvMenu; it is now a small state
+machine (`LoginState`) started by a command that is called automatically
+when a new user connects.
 
 """
 
 from django.conf import settings
 
+import evennia
 from evennia import CmdSet, Command, syscmdkeys
-from evennia.utils.evmenu import EvMenu
-from evennia.utils.utils import (
-    callables_from_module,
-    class_from_module,
-    random_string_from_module,
-)
+from evennia.accounts.accounts import LOGIN_THROTTLE
+from evennia.accounts.models import AccountDB
+from evennia.utils import logger
+from evennia.utils.utils import class_from_module
+
+from .admission import _MSG_QUEUED, ADMISSION
+from .login_pool import LOGIN_POOL, check_password, hash_password
+from .screen_cache import SCREENS
+from .usernames import USERNAMES
 
-_CONNECTION_SCREEN_MODULE = settings.CONNECTION_SCREEN_MODULE
 _GUEST_ENABLED = settings.GUEST_ENABLED
 _ACCOUNT = class_from_module(settings.BASE_ACCOUNT_TYPECLASS)
 _GUEST = class_from_module(settings.BASE_GUEST_TYPECLASS)
@@ -41,187 +45,327 @@ _PASSWORD_HELP = (
     "can contain a mix of letters, spaces, digits and @/./+/-/_/'/, only."
 )
 
-# Menu nodes
+# Login states
+#
+# Each state has a prompt, shown when entering it, and an input handler
+# returning the state to go to next (the same one to show it again) or
+# `None` to stay put without a prompt. `quit` and `help` work in all of them.
 
 
-def _show_help(caller, raw_string, **kwargs):
-    """Echo help message, then re-run node that triggered it"""
-    help_entry = kwargs["help_entry"]
-    caller.msg(help_entry)
-    return None  # re-run calling node
+def _prompt_username(state):
+    """
+    Start of the login: display the connection screen and ask for a user name.
 
+    """
+    # precompiled, and sent on its own so it can go out already rendered
+    SCREENS.send(state.session)
 
-def node_enter_username(caller, raw_text, **kwargs):
+    if _GUEST_ENABLED:
+        text = "Melde dich mit deinem Namen an oder schreibe 'gast' fuer den Gastzugang:"
+    else:
+        text = "Melde dich mit deinem Namen an:"
+    return "\n{}".format(text)
+
+
+def _input_username(state, username):
     """
-    Start node of menu
-    Start login by displaying the connection screen and ask for a user name.
+    Called when user enters a username string. Check if this username already
+    exists and set the flag `new_user` if not. Will also directly login if the
+    username is 'gast' and GUEST_ENABLED is True.
 
     """
+    if not username:
+        return "username"
 
-    def _check_input(caller, username, **kwargs):
-        """
-        'Goto-callable', set up to be called from the _default option below.
+    if username == "gast" and _GUEST_ENABLED:
+        # do an immediate guest login
+        session = state.session
+        account, errors = _GUEST.authenticate(ip=session.address)
+        if account:
+            state.login(account)
+            return None
+        session.msg("|R{}|n".format("\n".join(errors)))
+        return "username"
 
-        Called when user enters a username string. Check if this username already exists and set the
-        flag 'new_user' if not. Will also directly login if the username is 'guest' and
-        GUEST_ENABLED is True.
+    state.username = username
+    state.new_user = not USERNAMES.exists(username)
+    state.retry = False
+    return "password"
 
-        The return from this goto-callable determines which node we go to next
-        and what kwarg it will be called with.
 
-        """
-        username = username.rstrip("\n")
-
-        if username == "gast" and _GUEST_ENABLED:
-            # do an immediate guest login
-            session = caller
-            address = session.address
-            account, errors = _GUEST.authenticate(ip=address)
-            if account:
-                return "node_quit_or_login", {"login": True, "account": account}
-            else:
-                session.msg("|R{}|n".format("\n".join(errors)))
-                return None  # re-run the username node
-
-        try:
-            _ACCOUNT.objects.get(username__iexact=username)
-        except _ACCOUNT.DoesNotExist:
-            new_user = True
-        else:
-            new_user = False
-
-        # pass username/new_user into next node as kwargs
-        return "node_enter_password", {"new_user": new_user, "username": username}
-
-    callables = callables_from_module(_CONNECTION_SCREEN_MODULE)
-    if "connection_screen" in callables:
-        connection_screen = callables["connection_screen"]()
-    else:
-        connection_screen = random_string_from_module(_CONNECTION_SCREEN_MODULE)
+def _prompt_password(state):
+    if state.new_user:
+        if state.retry:
+            # Attempting to fix password
+            return "Gib dein Password ein :"
+        return "Erstelle neuen Account |c{}|n. Gib dein Password ein (`Enter` zum abbrechen):".format(
+            state.username
+        )
+    return "Gib dein Password fuer den Account |c{}|n (`Enter` zum abbrechen):".format(
+        state.username
+    )
 
-    if _GUEST_ENABLED:
-        text = "Melde dich mit deinem Namen an oder schreibe 'gast' fuer den Gastzugang:"
-    else:
-        text = "Melde dich mit deinem Namen an:"
-    text = "{}\n\n{}".format(connection_screen, text)
 
-    options = (
-        {"key": "", "goto": "node_enter_username"},
-        {"key": ("quit", "q"), "goto": "node_quit_or_login"},
-        {"key": ("help", "h"), "goto": (_show_help, {"help_entry": _ACCOUNT_HELP, **kwargs})},
-        {"key": "_default", "goto": _check_input},
+def _input_password(state, password):
+    """
+    Called when user enters a password string. Hands the password to the
+    login pool, which hashes it for a new account or checks it against the
+    stored one.
+
+    """
+    session = state.session
+    if not password:
+        session.msg("|yCancelled login.|n")
+        return "username"
+
+    address = session.address
+    account = None
+    if state.new_user:
+        # no need to hash a password `create()` turns down
+        valid, errors = _ACCOUNT.validate_password(
+            password, account=_ACCOUNT(username=state.username)
+        )
+        if not valid:
+            session.msg("|R{}".format("\n".join(errors)))
+            state.retry = True
+            return "password"
+        job = (hash_password, password)
+    else:
+        account, errors = _find_account(state.username, _ip(session))
+        if errors:
+            session.msg("|R{}".format("\n".join(errors)))
+            state.retry = True
+            return "password"
+        job = (check_password, password, account.password if account else None)
+    # hashing the password takes a while - don't block the game with it
+    deferred = LOGIN_POOL.submit(address, *job)
+    if deferred is None:
+        session.msg("|RDu meldest dich schon an, bitte warte einen Moment.|n")
+        state.retry = True
+        return "password"
+    deferred.addCallbacks(
+        _login_checked,
+        _login_failed,
+        callbackArgs=(state, password, account),
+        errbackArgs=(state,),
     )
-    return text, options
+    return "wait"
+
 
+def _ip(session):
+    address = session.address
+    return str(address[0] if isinstance(address, (tuple, list)) else address)
 
-def node_enter_password(caller, raw_string, **kwargs):
+
+def _find_account(username, ip):
     """
-    Handle password input.
+    What `authenticate` does before checking the password: the throttle, bans
+    and looking up the account.
+
+    Returns:
+        tuple: `(account, errors)`; the account is `None` if there is none by
+            that name, which is then told only after the (pretend) check.
 
     """
+    if ip and LOGIN_THROTTLE.check(ip):
+        return None, ["Too many login failures; please try again in a few minutes."]
+    if _ACCOUNT.is_banned(username=username, ip=ip):
+        logger.log_sec(f"Authentication Denied (Banned): {username} (IP: {ip}).")
+        LOGIN_THROTTLE.update(ip, "Too many sightings of banned artifact.")
+        return None, [
+            "|rYou have been banned and cannot continue from here."
+            "\nIf you feel this ban is in error, please email an admin.|x"
+        ]
+    return AccountDB.objects.filter(username__iexact=username).first(), []
+
+
+def _authenticated(state, account, checked):
+    """
+    What `authenticate` does after checking the password.
 
-    def _check_input(caller, password, **kwargs):
-        """
-        'Goto-callable', set up to be called from the _default option below.
+    """
+    session = state.session
+    ip = _ip(session)
+    valid, rehashed = checked
+    if account and valid:
+        if rehashed:
+            account.password = rehashed
+            account.save(update_fields=["password"])
+        logger.log_sec(f"Authentication Success: {account} (IP: {ip}).")
+        return account, []
+    logger.log_sec(f"Authentication Failure: {state.username} (IP: {ip}).")
+    if ip:
+        LOGIN_THROTTLE.update(ip, "Too many authentication failures.")
+    if account:
+        account.at_failed_login(session)
+    return None, ["Username and/or password is incorrect."]
+
+
+def _create_account(state, password, encoded):
+    """
+    Create the new account with the password hashed in the pool.
 
-        Called when user enters a password string. Check username + password
-        viability. If it passes, the account will have been created and login
-        will be initiated.
+    """
+    with _ACCOUNT.prehashed(password, encoded):
+        return _ACCOUNT.create(
+            username=state.username, password=password, ip=state.session.address
+        )
 
-        The return from this goto-callable determines which node we go to next
-        and what kwarg it will be called with.
 
-        """
-        # these flags were set by the goto-callable
-        username = kwargs["username"]
-        new_user = kwargs["new_user"]
-        password = password.rstrip("\n")
-
-        session = caller
-        address = session.address
-        if new_user:
-            # create a new account
-            account, errors = _ACCOUNT.create(
-                username=username, password=password, ip=address, session=session
-            )
-        else:
-            # check password against existing account
-            account, errors = _ACCOUNT.authenticate(
-                username=username, password=password, ip=address, session=session
-            )
+def _prompt_wait(state):
+    return "Pruefe das Password, einen Moment ..."
 
-        if account:
-            if new_user:
-                session.msg("|gA neuer Account |c{}|g wurde erstellt. Willkommen!|n".format(username))
-            # pass login info to login node
-            return "node_quit_or_login", {"login": True, "account": account}
-        else:
-            # restart due to errors
-            session.msg("|R{}".format("\n".join(errors)))
-            kwargs["retry_password"] = True
-            return "node_enter_password", kwargs
 
-    def _restart_login(caller, *args, **kwargs):
-        caller.msg("|yCancelled login.|n")
-        return "node_enter_username"
+def _input_wait(state, text):
+    # anything just shows the text again
+    return "wait"
 
-    username = kwargs["username"]
-    if kwargs["new_user"]:
 
-        if kwargs.get("retry_password"):
-            # Attempting to fix password
-            text = "Gib dein Password ein :"
-        else:
-            text = "Erstelle neuen Account |c{}|n. Gib dein Password ein (`Enter` zum abbrechen):".format(
-                username
+def _disconnected(state):
+    """
+    Check if the session went away while its password was checked; its
+    `ndb` (and so the state) outlives the connection.
+
+    """
+    if state.session.sessid in evennia.SESSION_HANDLER:
+        return False
+    if state.node is not None:
+        state._finish()
+    return True
+
+
+def _login_checked(result, state, password, account):
+    """
+    Called in the reactor thread when the password was checked or hashed in
+    the pool. Creating the account, or logging in to it, happens here.
+
+    """
+    if _disconnected(state):
+        return
+    if state.node != "wait":
+        # left the login in the meantime
+        return
+    if state.new_user:
+        account, errors = _create_account(state, password, result)
+    else:
+        account, errors = _authenticated(state, account, result)
+    if account:
+        if state.new_user:
+            state.session.msg(
+                "|gA neuer Account |c{}|g wurde erstellt. Willkommen!|n".format(state.username)
             )
+        state.login(account)
     else:
-        text = "Gib dein Password fuer den Account |c{}|n (`Enter` zum abbrechen):".format(username)
-    options = (
-        {"key": "", "goto": _restart_login},
-        {"key": ("quit", "q"), "goto": "node_quit_or_login"},
-        {"key": ("help", "h"), "goto": (_show_help, {"help_entry": _PASSWORD_HELP, **kwargs})},
-        {"key": "_default", "goto": (_check_input, kwargs)},
-    )
-    return text, options
+        # restart due to errors
+        state.session.msg("|R{}".format("\n".join(errors)))
+        state.retry = True
+        state.goto("password")
 
 
-def node_quit_or_login(caller, raw_text, **kwargs):
+def _login_failed(failure, state):
     """
-    Exit menu, either by disconnecting or logging in.
+    Called if the login check raised an error.
 
     """
-    session = caller
-    if kwargs.get("login"):
-        account = kwargs.get("account")
-        session.msg("|gLogging in ...|n")
-        session.sessionhandler.login(session, account)
-    else:
-        session.sessionhandler.disconnect(session, "Bis bald, Logge aus.")
-    return "", {}
+    logger.log_trace(f"Login check failed: {failure.getErrorMessage()}")
+    if _disconnected(state) or state.node != "wait":
+        return
+    state.session.msg("|RDie Anmeldung ist fehlgeschlagen, bitte versuche es noch einmal.|n")
+    state.retry = True
+    state.goto("password")
 
 
-# EvMenu helper function
+# state -> (prompt, input handler, help text)
+_STATES = {
+    "username": (_prompt_username, _input_username, _ACCOUNT_HELP),
+    "password": (_prompt_password, _input_password, _PASSWORD_HELP),
+    "wait": (_prompt_wait, _input_wait, None),
+}
+_QUIT = ("quit", "q")
+_HELP = ("help", "h")
 
 
-class MenuLoginEvMenu(EvMenu):
+class LoginState:
     """
-    Version of EvMenu that does not display any of its options.
+    Where a not yet logged-in session is in its login, kept on the session
+    as `ndb._login`.
+
+    This used to be an EvMenu per connection, with its own cmdset merged
+    onto the session and its option parsing and formatting on every input.
+    The login is only ever a few prompts in a row, so all sessions share
+    the one `UnloggedinCmdSet` and the fixed `_STATES` table instead.
 
     """
 
-    def node_formatter(self, nodetext, optionstext):
-        return nodetext
+    __slots__ = ("session", "node", "username", "new_user", "retry")
+
+    def __init__(self, session):
+        self.session = session
+        self.node = None
+        self.username = None
+        self.new_user = False
+        self.retry = False
+
+    def goto(self, node):
+        """
+        Enter a state and show its prompt.
+
+        """
+        self.node = node
+        self.session.msg(_STATES[node][0](self))
+
+    def handle(self, raw_string):
+        """
+        Handle a line of input.
+
+        """
+        if self.node is None:
+            return
+        text = raw_string.rstrip("\n")
+        command = text.strip().lower()
+        if command in _QUIT:
+            self.quit()
+            return
+        _, handler, help_entry = _STATES[self.node]
+        if help_entry and command in _HELP:
+            self.session.msg(help_entry)
+            self.goto(self.node)
+            return
+        node = handler(self, text)
+        if node:
+            self.goto(node)
+
+    def _finish(self):
+        self.node = None
+        self.session.ndb._login = None
+        # lets the next connection in
+        ADMISSION.release(self.session)
+
+    def login(self, account):
+        """
+        Log the session in to `account`.
 
-    def options_formatter(self, optionlist):
-        """Do not display the options, only the text.
+        """
+        self._finish()
+        self.session.msg("|gLogging in ...|n")
+        self.session.sessionhandler.login(self.session, account)
 
-        This function is used by EvMenu to format the text of nodes. The menu login
-        is just a series of prompts so we disable all automatic display decoration
-        and let the nodes handle everything on their own.
+    def quit(self):
+        """
+        Disconnect the session.
 
         """
-        return ""
+        self._finish()
+        self.session.sessionhandler.disconnect(self.session, "Bis bald, Logge aus.")
+
+
+def start_login(session):
+    """
+    Start the login of a newly connected session.
+
+    """
+    state = session.ndb._login = LoginState(session)
+    state.goto("username")
 
 
 # Commands and CmdSets
@@ -235,13 +379,14 @@ class UnloggedinCmdSet(CmdSet):
     def at_cmdset_creation(self):
         "Called when cmdset is first created."
         self.add(CmdUnloggedinLook())
+        self.add(CmdUnloggedinInput())
 
 
 class CmdUnloggedinLook(Command):
     """
     An unloggedin version of the look command. This is called by the server
-    when the account first connects. It sets up the menu before handing off
-    to the menu's own look command.
+    when the account first connects. It starts the login, which then gets
+    all further input through `CmdUnloggedinInput`.
 
     """
 
@@ -251,20 +396,33 @@ class CmdUnloggedinLook(Command):
 
     def func(self):
         """
-        Run the menu using the nodes in this module.
+        Start the login, or queue it.
 
         """
-        menu_nodes = {
-            "node_enter_username": node_enter_username,
-            "node_enter_password": node_enter_password,
-            "node_quit_or_login": node_quit_or_login,
-        }
-
-        MenuLoginEvMenu(
-            self.caller,
-            menu_nodes,
-            startnode="node_enter_username",
-            auto_look=False,
-            auto_quit=False,
-            cmd_on_exit=None,
-        )
+        # may drop or queue the connection when too many log in at once
+        ADMISSION.admit(self.session, start_login)
+
+
+class CmdUnloggedinInput(Command):
+    """
+    Gets all input of a session that is not logged in and hands it to its
+    login.
+
+    """
+
+    key = syscmdkeys.CMD_NOINPUT
+    aliases = [syscmdkeys.CMD_NOMATCH]
+    locks = "cmd:all()"
+
+    def func(self):
+        session = self.session
+        state = session.ndb._login
+        if state is None:
+            position = ADMISSION.position(session)
+            if position:
+                session.msg(_MSG_QUEUED.format(position))
+            else:
+                # the state was lost with a server reload
+                ADMISSION.admit(session, start_login)
+            return
+        state.handle(self.raw_string)
@@ -0,0 +1,163 @@
+"""
+Connection screen cache
+
+The username prompt of the login used to look through the connection screen
+module (`callables_from_module`, `random_string_from_module`) every time it
+was shown - for every new connection and again after every failed input.
+
+`SCREENS` reads the module once and renders every screen up front for the
+kinds of telnet/ssh clients there are:
+
+- `xterm256` - 256 colors,
+- `ansi` - 16 colors,
+- `nocolor` - color codes stripped,
+- `screenreader` - color codes and decorative lines stripped.
+
+Such clients are sent the rendered screen as-is (the `raw` send option), so
+the Portal doesn't parse it again either. Other clients (the webclient)
+render the markup themselves and get the unrendered screen.
+
+If the module defines a `connection_screen()` callable, that one is called
+every time, as before - such screens are meant to be dynamic.
+
+Use `SCREENS.reload()` after editing the screens to pick up the changes
+without reloading the server.
+
+    SCREENS.send(session)
+
+"""
+import random
+import re
+from importlib import reload as reload_module
+
+from django.conf import settings
+
+from evennia.utils.ansi import parse_ansi
+from evennia.utils.utils import callables_from_module, mod_import, string_from_module
+
+# protocols where we render the color codes ourselves
+RAW_PROTOCOLS = ("telnet", "telnet/ssl", "ssh")
+VARIANTS = ("xterm256", "ansi", "nocolor", "screenreader")
+
+_RE_SCREENREADER_REGEX = re.compile(
+    r"%s" % settings.SCREENREADER_REGEX_STRIP, re.DOTALL + re.MULTILINE
+)
+
+
+def render(text, variant):
+    """
+    Render the color codes of a text like the Portal would for a client.
+
+    Args:
+        text (str): Text with Evennia markup.
+        variant (str): One of `VARIANTS`.
+
+    Returns:
+        str: The rendered text.
+
+    """
+    if variant == "screenreader":
+        return _RE_SCREENREADER_REGEX.sub("", parse_ansi(text, strip_ansi=True))
+    # end with a color reset, like the Portal does
+    return parse_ansi(
+        text + ("||n" if text.endswith("|") else "|n"),
+        strip_ansi=variant == "nocolor",
+        xterm256=variant == "xterm256",
+    )
+
+
+def client_variant(session):
+    """
+    Find out what a session's client can display, with the same rules the
+    Portal uses for telnet.
+
+    Returns:
+        str or None: One of `VARIANTS`, or `None` if the client should get
+            the unrendered text.
+
+    """
+    if getattr(session, "protocol_key", None) not in RAW_PROTOCOLS:
+        return None
+    flags = session.protocol_flags
+    if flags.get("RAW") or flags.get("MXP"):
+        return None
+    if flags.get("SCREENREADER"):
+        return "screenreader"
+    ttype = flags.get("TTYPE", False)
+    xterm256 = flags.get("XTERM256", False) if ttype else True
+    useansi = flags.get("ANSI", False) if ttype else True
+    if flags.get("NOCOLOR") or not (xterm256 or useansi):
+        return "nocolor"
+    return "xterm256" if xterm256 else "ansi"
+
+
+class ScreenCache:
+    """
+    The connection screens, read once and rendered for all client kinds.
+
+    """
+
+    __slots__ = ("module", "dynamic", "screens", "rendered")
+
+    def __init__(self, module=settings.CONNECTION_SCREEN_MODULE):
+        self.module = module
+        self.dynamic = None
+        self.screens = None
+        # variant -> rendered screens, in the order of `screens`
+        self.rendered = {}
+
+    def load(self):
+        """
+        Read the screens from the module and render them.
+
+        """
+        callables = callables_from_module(self.module)
+        self.dynamic = callables.get("connection_screen")
+        self.screens = [] if self.dynamic else string_from_module(self.module) or []
+        self.rendered = {
+            variant: [render(screen, variant) for screen in self.screens] for variant in VARIANTS
+        }
+
+    def reload(self):
+        """
+        Re-import the screen module and render it anew, after its content
+        was edited.
+
+        """
+        module = mod_import(self.module)
+        if module:
+            reload_module(module)
+        self.load()
+
+    def get(self, session):
+        """
+        Pick a connection screen for a session.
+
+        Returns:
+            tuple: `(text, options)`; `options` are the send options to use
+                (`{"raw": True}` if the text is rendered already).
+
+        """
+        if self.screens is None:
+            self.load()
+        if self.dynamic:
+            return self.dynamic(), {}
+        if not self.screens:
+            return "", {}
+        index = random.randrange(len(self.screens))
+        variant = client_variant(session)
+        if variant is None:
+            return self.screens[index], {}
+        return self.rendered[variant][index], {"raw": True}
+
+    def send(self, session):
+        """
+        Send a connection screen to a session.
+
+        """
+        text, options = self.get(session)
+        # the protocols only look at `options`, not at options in the text kwargs
+        session.msg(text=text, options=options)
+
+
+SCREENS = ScreenCache()
@@ -3,11 +3,439 @@ Test menu_login
 
 """
 
+import gc
+import tracemalloc
+from unittest.mock import MagicMock, patch
+
+from twisted.internet import defer
+
+import evennia
 from evennia.commands.default.tests import BaseEvenniaCommandTest
+from evennia.server.serversession import ServerSession
+from evennia.server.sessionhandler import SESSIONS
+from evennia.utils import create
+from evennia.utils.evmenu import EvMenu
 
-from . import menu_login
+from . import admission, login_pool, menu_login, screen_cache, usernames
 
 
 class TestMenuLogin(BaseEvenniaCommandTest):
     def test_cmdunloggedlook(self):
-        self.call(menu_login.CmdUnloggedinLook(), "", "======")
+        session = self.session
+        session.protocol_key = "telnet"
+        session.protocol_flags.update({"TTYPE": True, "XTERM256": True})
+        controller = admission.AdmissionController()
+        controller._call_later = MagicMock()
+        with patch.object(menu_login, "ADMISSION", controller), patch.object(
+            session, "msg"
+        ) as msg:
+            self.call(menu_login.CmdUnloggedinLook(), "")
+        # the cached screen, rendered for the client, goes out first
+        sent = msg.call_args_list[0].kwargs
+        self.assertEqual(sent["options"], {"raw": True})
+        variant = screen_cache.client_variant(session)
+        self.assertIn(sent["text"], menu_login.SCREENS.rendered[variant])
+        self.assertIn("======", sent["text"])
+        self.assertEqual(session.ndb._login.node, "username")
+
+    def test_states(self):
+        session = self.session
+        with patch.object(session, "msg") as msg, patch.object(
+            session.sessionhandler, "disconnect"
+        ) as disconnect, patch.object(menu_login.ADMISSION, "release") as release:
+            menu_login.start_login(session)
+            state = session.ndb._login
+            self.assertEqual(state.node, "username")
+            state.handle("HELP")
+            msg.assert_any_call(menu_login._ACCOUNT_HELP)
+            self.assertEqual(state.node, "username")
+            state.handle(self.account.key)
+            self.assertEqual((state.node, state.new_user), ("password", False))
+            state.handle("")
+            self.assertEqual(state.node, "username")
+            state.handle("q")
+            disconnect.assert_called_once()
+            release.assert_called_with(session)
+            self.assertIsNone(session.ndb._login)
+
+    def _sessions(self, num):
+        # unlogged-in sessions with their cmdsets, as a new connection has them
+        sessions = []
+        for sessid in range(100, 100 + num):
+            session = ServerSession()
+            session.init_session("telnet", ("10.0.0.1", sessid), SESSIONS)
+            session.sessid = sessid
+            session.at_sync()
+            SESSIONS[sessid] = session
+            self.addCleanup(SESSIONS.pop, sessid, None)
+            sessions.append(session)
+        return sessions
+
+    def _memory_per_connection(self, sessions, start_login):
+        # the first one fills caches (like the connection screens)
+        start_login(sessions.pop())
+        gc.collect()
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            for session in sessions:
+                start_login(session)
+            used = tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+        return used / len(sessions)
+
+    def test_memory_per_connection(self):
+        def _evmenu_login(session):
+            # how the login started before: an EvMenu per connection
+            MenuLoginEvMenu(
+                session,
+                {"node_enter_username": _evmenu_username},
+                startnode="node_enter_username",
+                auto_look=False,
+                auto_quit=False,
+                cmd_on_exit=None,
+            )
+
+        # sending (a Mock in tests) would count too
+        with patch.object(SESSIONS, "data_out", lambda *args, **kwargs: None):
+            evmenu = self._memory_per_connection(self._sessions(51), _evmenu_login)
+            states = self._memory_per_connection(self._sessions(51), menu_login.start_login)
+        # both include the session's ndb (about 2kB), created on first use
+        self.assertLess(states * 2, evmenu, f"{states:.0f} vs {evmenu:.0f} bytes")
+
+
+class MenuLoginEvMenu(EvMenu):
+    """
+    The EvMenu of the login before `LoginState`, not displaying options.
+
+    """
+
+    def node_formatter(self, nodetext, optionstext):
+        return nodetext
+
+    def options_formatter(self, optionlist):
+        return ""
+
+
+def _evmenu_username(caller, raw_string, **kwargs):
+    # the first node of the EvMenu login
+    options = (
+        {"key": "", "goto": "node_enter_username"},
+        {"key": ("quit", "q"), "goto": "node_quit_or_login"},
+        {"key": ("help", "h"), "goto": (_evmenu_help, {"help_entry": menu_login._ACCOUNT_HELP})},
+        {"key": "_default", "goto": _evmenu_help},
+    )
+    return menu_login._prompt_username(menu_login.LoginState(caller)), options
+
+
+def _evmenu_help(caller, raw_string, **kwargs):
+    return None
+
+
+class TestLoginPool(BaseEvenniaCommandTest):
+    def setUp(self):
+        super().setUp()
+        self.pool = login_pool.LoginPool(max_workers=2, max_per_ip=1)
+        # run the jobs when told to, instead of in threads
+        self.jobs = []
+
+        def _run(func, *args, **kwargs):
+            deferred = defer.Deferred()
+            self.jobs.append((deferred, lambda: func(*args, **kwargs)))
+            return deferred
+
+        self.pool._run = _run
+
+    def _finish(self):
+        while self.jobs:
+            deferred, job = self.jobs.pop(0)
+            try:
+                deferred.callback(job())
+            except Exception as err:
+                deferred.errback(err)
+
+    def test_per_ip_limit_and_metrics(self):
+        results = []
+        self.pool.submit(("1.2.3.4", 5000), lambda: 1).addCallback(results.append)
+        self.assertIsNone(self.pool.submit("1.2.3.4", lambda: 2))
+        for num in range(3):
+            self.pool.submit(f"10.0.0.{num}", lambda: 3)
+        metrics = self.pool.metrics()
+        self.assertEqual(metrics["pending"], 4)
+        self.assertEqual(metrics["queued"], 2)
+        self.assertEqual(metrics["in_flight_ips"], 4)
+        self.assertEqual(metrics["rejected"], 1)
+        self._finish()
+        self.assertEqual(results, [1])
+        metrics = self.pool.metrics()
+        self.assertEqual((metrics["pending"], metrics["completed"]), (0, 4))
+        self.assertEqual(metrics["max_queued"], 2)
+        # the address may log in again
+        self.assertIsNotNone(self.pool.submit("1.2.3.4", lambda: 4))
+
+    def test_errors_counted(self):
+        def _broken():
+            raise ValueError("broken")
+
+        errors = []
+        self.pool.submit("1.2.3.4", _broken).addErrback(errors.append)
+        self._finish()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.pool.metrics()["failed"], 1)
+        self.assertEqual(self.pool.metrics()["in_flight_ips"], 0)
+
+    def test_login_resumes_after_check(self):
+        with patch.object(menu_login, "LOGIN_POOL", self.pool):
+            state = menu_login.LoginState(self.session)
+            state.username, state.node = self.account.key, "password"
+            state.handle("falsch")
+            self.assertEqual(state.node, "wait")
+            self._finish()
+            self.assertEqual(state.node, "password")
+            self.assertTrue(state.retry)
+            with patch.object(self.session.sessionhandler, "login") as login:
+                state.handle("testpassword")
+                self.assertFalse(login.called)
+                self._finish()
+                login.assert_called_with(self.session, self.account)
+            self.assertIsNone(state.node)
+
+    def _hash_only(self):
+        # the jobs in the pool do no database work, the callbacks may
+        jobs, self.jobs = self.jobs, []
+        with self.assertNumQueries(0):
+            results = [(deferred, job()) for deferred, job in jobs]
+        for deferred, result in results:
+            deferred.callback(result)
+
+    def test_only_hashing_in_pool(self):
+        with patch.object(menu_login, "LOGIN_POOL", self.pool), patch.object(
+            self.session.sessionhandler, "login"
+        ) as login:
+            state = menu_login.LoginState(self.session)
+            state.username, state.new_user, state.node = "Neuling", True, "password"
+            state.handle("Wurzelbrot77")
+            self._hash_only()
+            account = login.call_args[0][1]
+            self.assertEqual(account.key, "Neuling")
+            self.assertTrue(account.check_password("Wurzelbrot77"))
+
+            state = menu_login.LoginState(self.session)
+            state.username, state.node = "neuling", "password"
+            state.handle("Wurzelbrot77")
+            self._hash_only()
+            login.assert_called_with(self.session, account)
+
+    def test_no_account_after_quit(self):
+        with patch.object(menu_login, "LOGIN_POOL", self.pool), patch.object(
+            menu_login._ACCOUNT, "create"
+        ) as create, patch.object(self.session.sessionhandler, "disconnect"):
+            state = menu_login.LoginState(self.session)
+            state.username, state.new_user, state.node = "Neuling", True, "password"
+            state.handle("Wurzelbrot77")
+            self.assertEqual(state.node, "wait")
+            # quits before a worker gets to it
+            state.handle("q")
+            self._finish()
+            self.assertFalse(create.called)
+
+    def test_no_login_after_disconnect(self):
+        with patch.object(menu_login, "LOGIN_POOL", self.pool), patch.object(
+            menu_login.ADMISSION, "release"
+        ) as release:
+            state = menu_login.LoginState(self.session)
+            state.username, state.node = self.account.key, "password"
+            state.handle("testpassword")
+            with patch.dict(evennia.SESSION_HANDLER), patch.object(
+                self.session.sessionhandler, "login"
+            ) as login:
+                # the client disconnects while its password is checked
+                del evennia.SESSION_HANDLER[self.session.sessid]
+                self._finish()
+                self.assertFalse(login.called)
+            release.assert_called_with(self.session)
+            self.assertIsNone(state.node)
+
+
+class TestUsernames(BaseEvenniaCommandTest):
+    def setUp(self):
+        super().setUp()
+        self.usernames = usernames.UsernameIndex()
+
+    def test_unknown_names_need_no_query(self):
+        self.usernames.load()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.usernames.exists("SomeBot123"))
+        with self.assertNumQueries(1):
+            self.assertTrue(self.usernames.exists(self.account.key.upper()))
+
+    def test_kept_up_to_date(self):
+        with patch.object(usernames, "USERNAMES", self.usernames):
+            self.usernames.load()
+            account = create.create_account("NeuerSpieler", None, "passwort123")
+            with self.assertNumQueries(1):
+                self.assertTrue(self.usernames.exists("neuerspieler"))
+            account.key = "Umbenannt"
+            self.assertFalse(self.usernames.exists("neuerspieler"))
+            self.assertTrue(self.usernames.exists("UMBENANNT"))
+            account.delete()
+            with self.assertNumQueries(0):
+                self.assertFalse(self.usernames.exists("umbenannt"))
+
+    def test_lower_index(self):
+        self.assertTrue(usernames.create_lower_index())
+        # creating it again is harmless
+        self.assertTrue(usernames.create_lower_index())
+        self.assertTrue(self.usernames.exists(self.account.key))
+
+    def test_username_state(self):
+        with patch.object(menu_login, "USERNAMES", self.usernames):
+            self.usernames.load()
+            state = menu_login.LoginState(self.session)
+            self.assertEqual(menu_login._input_username(state, "niemand"), "password")
+            self.assertTrue(state.new_user)
+
+
+class TestScreenCache(BaseEvenniaCommandTest):
+    def setUp(self):
+        super().setUp()
+        self.screens = screen_cache.ScreenCache()
+
+    def test_rendered_once(self):
+        with patch.object(
+            screen_cache, "string_from_module", wraps=screen_cache.string_from_module
+        ) as introspect:
+            for _ in range(5):
+                self.screens.get(self.session)
+            self.assertEqual(introspect.call_count, 1)
+
+    def test_variants(self):
+        self.screens.load()
+        self.session.protocol_key = "telnet"
+        self.session.protocol_flags.update({"TTYPE": True, "XTERM256": False, "ANSI": True})
+        text, options = self.screens.get(self.session)
+        self.assertEqual(options, {"raw": True})
+        self.assertIn("\033[", text)
+        self.assertNotIn("|b", text)
+        self.session.protocol_flags["SCREENREADER"] = True
+        text, options = self.screens.get(self.session)
+        self.assertNotIn("\033[", text)
+        self.assertNotIn("=====", text)
+        self.session.protocol_key = "webclient/websocket"
+        text, options = self.screens.get(self.session)
+        self.assertEqual(options, {})
+        self.assertIn("|b=====", text)
+
+    def test_sent_raw(self):
+        self.screens.load()
+        self.session.protocol_key = "telnet"
+        self.session.protocol_flags.update({"TTYPE": True, "XTERM256": True})
+        sessionhandler = self.session.sessionhandler
+        with patch.object(sessionhandler, "data_out") as data_out:
+            self.screens.send(self.session)
+        # what the Portal gets
+        sent = sessionhandler.clean_senddata(self.session, dict(data_out.call_args.kwargs))
+        self.assertTrue(sent["text"][1]["options"]["raw"])
+        self.assertIn("\033[", sent["text"][0][0])
+
+    def test_reload(self):
+        self.screens.load()
+        module = screen_cache.mod_import(self.screens.module)
+        with patch.object(module, "CONNECTION_SCREEN_3", "Neu", create=True):
+            self.screens.load()
+            self.assertIn("Neu", self.screens.screens)
+        self.screens.reload()
+        self.assertNotIn("Neu", self.screens.screens)
+
+
+class TestAdmission(BaseEvenniaCommandTest):
+    def setUp(self):
+        super().setUp()
+        self.admission = admission.AdmissionController(
+            per_ip_rate=1,
+            per_ip_burst=2,
+            global_rate=1,
+            global_burst=2,
+            max_active=2,
+            max_queued=2,
+            max_per_ip=3,
+            timeout=60,
+        )
+        self.admission._call_later = MagicMock()
+        self.alive = set()
+        self.admission._alive = lambda session: session.sessid in self.alive
+        self.started = []
+
+    def _session(self, sessid, address="10.0.0.1"):
+        session = MagicMock(sessid=sessid, address=(address, 4000))
+        self.alive.add(sessid)
+        return session
+
+    def test_per_ip_rejection(self):
+        sessions = [self._session(num) for num in range(3)]
+        self.assertTrue(self.admission.admit(sessions[0], self.started.append, now=0))
+        self.assertTrue(self.admission.admit(sessions[1], self.started.append, now=0))
+        self.assertFalse(self.admission.admit(sessions[2], self.started.append, now=0))
+        sessions[2].sessionhandler.disconnect.assert_called_once()
+        self.assertEqual(self.started, sessions[:2])
+        # the bucket refills
+        self.assertTrue(self.admission.admit(self._session(4), self.started.append, now=10))
+
+    def test_queue_and_release(self):
+        sessions = [self._session(num, f"10.0.0.{num}") for num in range(5)]
+        for session in sessions:
+            self.admission.admit(session, self.started.append, now=0)
+        self.assertEqual(self.started, sessions[:2])
+        self.assertEqual(
+            self.admission.metrics(), {"active": 2, "queued": 2, "rejected": 1, "timed_out": 0}
+        )
+        sessions[3].msg.assert_called_with(admission._MSG_QUEUED.format(2))
+        self.assertTrue(self.admission._call_later.called)
+        # no room yet, though the global bucket has refilled
+        self.admission.drain(now=5)
+        self.assertEqual(len(self.started), 2)
+        self.admission.release(sessions[0])
+        self.assertEqual(self.started, sessions[:3])
+        sessions[3].msg.assert_called_with(admission._MSG_QUEUED.format(1))
+
+    def test_dropped_sessions_free_their_place(self):
+        sessions = [self._session(num, f"10.0.0.{num}") for num in range(4)]
+        for session in sessions:
+            self.admission.admit(session, self.started.append, now=0)
+        # both menu sessions and the first queued one disconnect
+        self.alive -= {0, 1, 2}
+        self.admission.drain(now=5)
+        self.assertEqual(self.started, [sessions[0], sessions[1], sessions[3]])
+
+    def test_login_timeout(self):
+        sessions = [self._session(num, f"10.0.0.{num}") for num in range(3)]
+        for session in sessions:
+            self.admission.admit(session, self.started.append, now=0)
+        self.admission._call_later.assert_any_call(60, self.admission._expire, sessions[0])
+        # the first one idles at the prompt
+        self.admission._expire(sessions[0])
+        sessions[0].msg.assert_any_call(admission._MSG_TIMEOUT)
+        sessions[0].sessionhandler.disconnect.assert_called_once()
+        self.assertEqual(self.started, sessions)
+        self.assertEqual(self.admission.metrics()["timed_out"], 1)
+        # logged in in time
+        deadline = self.admission._deadlines[sessions[1].sessid]
+        self.admission.release(sessions[1])
+        deadline.cancel.assert_called_once()
+        self.admission._expire(sessions[1])
+        sessions[1].sessionhandler.disconnect.assert_not_called()
+
+    def test_connections_per_ip(self):
+        self.admission.per_ip_burst = 10
+        sessions = [self._session(num) for num in range(4)]
+        for session in sessions[:3]:
+            self.assertTrue(self.admission.admit(session, self.started.append, now=0))
+        # slow enough for the bucket, but too many at once
+        self.assertFalse(self.admission.admit(sessions[3], self.started.append, now=100))
+        sessions[3].msg.assert_called_with(admission._MSG_THROTTLED)
+        self.admission.release(sessions[0])
+        self.assertTrue(self.admission.admit(self._session(5), self.started.append, now=200))
+        # one dropped without closing its menu
+        self.alive.discard(1)
+        self.assertTrue(self.admission.admit(self._session(6), self.started.append, now=300))
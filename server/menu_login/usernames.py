@@ -0,0 +1,136 @@
+"""
+Username index
+
+The login menu asks the database whether a typed name belongs to an
+account, with a case-insensitive lookup that most backends can't serve from
+an index. Bots probing the login prompt with random names turn that into
+pure database load.
+
+`USERNAMES` keeps the lower-case names of all accounts in memory. It is
+loaded when the server starts and kept up to date through signals when an
+account is created, renamed or deleted. Names not in the set are answered
+without touching the database; a hit is confirmed with one query, in case
+the account was deleted from outside the server (like from `evennia shell`).
+
+That confirmation filters on `LOWER(username)`; `create_lower_index()`
+adds a matching functional index. It is optional and only created if the
+`USERNAME_LOWER_INDEX` setting is set.
+
+    if USERNAMES.exists(name):
+        ...
+
+"""
+from django.conf import settings
+from django.db.models.functions import Lower
+from django.db.models.signals import post_delete, post_save
+
+from evennia.accounts.models import AccountDB
+from evennia.server.signals import SIGNAL_ACCOUNT_POST_RENAME
+
+from server import dbindex
+
+LOWER_INDEX_NAME = "accounts_accountdb_username_lower"
+
+
+class UsernameIndex:
+    """
+    The lower-case names of all accounts.
+
+    """
+
+    __slots__ = ("_names",)
+
+    def __init__(self):
+        self._names = None
+
+    def load(self):
+        """
+        (Re)load all account names with one query.
+
+        """
+        self._names = {name.lower() for name in AccountDB.objects.values_list("username", flat=True)}
+
+    def exists(self, username):
+        """
+        Check if an account of this name exists, ignoring case.
+
+        Args:
+            username (str): The name.
+
+        Returns:
+            bool: If the account exists.
+
+        """
+        if self._names is None:
+            self.load()
+        name = username.lower()
+        if name not in self._names:
+            return False
+        if (
+            AccountDB.objects.annotate(username_lower=Lower("username"))
+            .filter(username_lower=name)
+            .exists()
+        ):
+            return True
+        # deleted behind our back
+        self._names.discard(name)
+        return False
+
+    def add(self, username):
+        """
+        Add the name of a new or renamed account.
+
+        """
+        if self._names is not None:
+            self._names.add(username.lower())
+
+    def discard(self, username):
+        """
+        Remove the name of a deleted or renamed account.
+
+        """
+        if self._names is not None:
+            self._names.discard(username.lower())
+
+
+USERNAMES = UsernameIndex()
+
+
+def _account_saved(sender, instance, created=False, **kwargs):
+    if created and isinstance(instance, AccountDB):
+        USERNAMES.add(instance.username)
+
+
+def _account_deleted(sender, instance, **kwargs):
+    if isinstance(instance, AccountDB):
+        USERNAMES.discard(instance.username)
+
+
+def _account_renamed(sender, old_name=None, new_name=None, **kwargs):
+    USERNAMES.discard(old_name)
+    USERNAMES.add(new_name)
+
+
+# typeclasses are proxy models sending as themselves, so no `sender` filter
+post_save.connect(_account_saved, dispatch_uid="usernames_saved")
+post_delete.connect(_account_deleted, dispatch_uid="usernames_deleted")
+SIGNAL_ACCOUNT_POST_RENAME.connect(_account_renamed, dispatch_uid="usernames_renamed")
+
+
+def create_lower_index():
+    """
+    Create a functional index on `LOWER(username)` for the accounts table, if
+    the database supports it. Does nothing if the index exists.
+
+    """
+    return dbindex.create_lower_index(AccountDB._meta.db_table, "username", LOWER_INDEX_NAME)
+
+
+def at_server_start():
+    """
+    Load the names, and create the index if wanted. Called at server start.
+
+    """
+    if getattr(settings, "USERNAME_LOWER_INDEX", False):
+        create_lower_index()
+    USERNAMES.load()
@@ -0,0 +1,26 @@
+"""
+Tests for the server setup.
+
+"""
+
+from django.test import SimpleTestCase
+
+from . import importtime
+from .benchmarks import benchmark
+
+
+class TestImportTime(SimpleTestCase):
+    def test_startup_imports(self):
+        entries = importtime.measure()
+        imported = {module for module, _, _, _ in entries}
+        self.assertIn("commands.default_cmdsets", imported)
+        self.assertFalse(imported.intersection(importtime.LAZY_MODULES))
+        self.assertLessEqual(
+            len(importtime.game_modules(entries)), importtime.IMPORT_BUDGET_MODULES
+        )
+
+    @benchmark
+    def test_import_budget(self):
+        entries = importtime.measure()
+        print("\n" + importtime.report(entries))
+        self.assertLess(importtime.game_cost(entries), importtime.IMPORT_BUDGET_MS)
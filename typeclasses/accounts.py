@@ -22,13 +22,74 @@ several more options for customizing the Guest account system.
 
 """
 
+from contextlib import contextmanager
+
 from evennia.accounts.accounts import DefaultAccount, DefaultGuest
+from evennia.typeclasses.attributes import ModelAttributeBackend
+from evennia.utils import logger
+from evennia.utils.utils import lazy_property
 
 from character_creator.character_creator import ContribChargenAccount
+from character_creator.playable import PlayableCharacters
+from world import who
+from world.nicks import CompiledNickHandler
 
 
+class AccountParent:
+    """
+    Mixin for all account typeclasses, keeping the `wer` roster (see
+    `world.who`) up to date, compiling nicks (see `world.nicks`), and taking passwords hashed ahead of time by
+    the login (see `server.menu_login.login_pool`).
 
-class Account(ContribChargenAccount):
+    """
+
+    # password -> its hash, while an account is created with it
+    _prehashed = {}
+
+    @classmethod
+    @contextmanager
+    def prehashed(cls, password, encoded):
+        """
+        Let `set_password` use a hash of `password` made in advance, so
+        `create()` doesn't hash it again.
+
+            with Account.prehashed(password, encoded):
+                account, errors = Account.create(username=..., password=password)
+
+        """
+        cls._prehashed[password] = encoded
+        try:
+            yield
+        finally:
+            cls._prehashed.pop(password, None)
+
+    def set_password(self, password, **kwargs):
+        encoded = self._prehashed.get(password)
+        if encoded is None:
+            super().set_password(password, **kwargs)
+            return
+        # as `DefaultAccount.set_password`, without hashing
+        self.password = encoded
+        self._password = password
+        logger.log_sec(f"Password successfully changed for {self}.")
+        self.at_password_change()
+
+    @lazy_property
+    def nicks(self):
+        """Nicks, compiled for fast input-line replacement (see `world.nicks`)."""
+        return CompiledNickHandler(self, ModelAttributeBackend)
+
+    def at_post_login(self, session=None, **kwargs):
+        super().at_post_login(session=session, **kwargs)
+        if session:
+            who.ROSTER.add(session)
+
+    def at_disconnect(self, reason=None, **kwargs):
+        super().at_disconnect(reason=reason, **kwargs)
+        who.ROSTER.remove_disconnected()
+
+
+class Account(AccountParent, ContribChargenAccount):
     # your Account class code
 
 #class Account(DefaultAccount):
@@ -98,13 +159,17 @@ class Account(ContribChargenAccount):
 
     """
 
-    pass
-
 
-class Guest(DefaultGuest):
+class Guest(AccountParent, DefaultGuest):
     """
     This class is used for guest logins. Unlike Accounts, Guests and their
     characters are deleted after disconnection.
     """
 
-    pass
+    @lazy_property
+    def playable(self):
+        """
+        The characters of the guest. Evennia deletes them through the
+        `_playable_characters` list, so that is kept as storage.
+        """
+        return PlayableCharacters(self, legacy=True)
@@ -8,9 +8,14 @@ creation commands.
 
 """
 from evennia.objects.objects import DefaultCharacter
-from evennia.typeclasses.attributes import AttributeProperty
+from evennia.typeclasses.attributes import ModelAttributeBackend
+from evennia.utils.utils import lazy_property
 from .objects import ObjectParent
+from world import statussheet, who
+from world.nicks import CompiledNickHandler
+from world.statblock import StatBlock, StatProperty
 
+from commands.cmdset_cache import SharedCmdSetHandler, install_cmdset
 from commands.d_commands import DeuCmdSet
 
 class Character(ObjectParent, DefaultCharacter):
@@ -35,28 +40,59 @@ class Character(ObjectParent, DefaultCharacter):
     """
     def at_post_puppet(self):
         super().at_post_puppet()
-        self.cmdset.add(DeuCmdSet, persistent=True)
+        # idempotent; only writes to the database the first time
+        install_cmdset(self, DeuCmdSet)
+        who.ROSTER.changed()
 
+    def at_post_unpuppet(self, account=None, session=None, **kwargs):
+        super().at_post_unpuppet(account=account, session=session, **kwargs)
+        who.ROSTER.changed()
+
+    def at_stat_change(self, name):
+        """
+        Called by the stat block when a stat changed (`name` is None if
+        any stat may have changed).
+        """
+        statussheet.invalidate(self, name)
+
+    def at_rename(self, oldname, newname):
+        super().at_rename(oldname, newname)
+        statussheet.invalidate(self, "name")
+
+
+    @lazy_property
+    def cmdset(self):
+        """Cmdset handler sharing stateless cmdsets and their merges."""
+        return SharedCmdSetHandler(self, True)
+
+    @lazy_property
+    def nicks(self):
+        """Nicks, compiled for fast input-line replacement."""
+        return CompiledNickHandler(self, ModelAttributeBackend)
+
+    @lazy_property
+    def stats(self):
+        """Packed stat record, see `world.statblock`."""
+        return StatBlock(self)
 
     #basiswerte
-    staerke = AttributeProperty(1, category='stat')
-    intelligenz = AttributeProperty(1, category='stat')
-    schnelligkeit = AttributeProperty(1, category='stat')
-    weissheit = AttributeProperty(1, category='stat')
-    ausdauer = AttributeProperty(1, category='stat')
-    willenskraft = AttributeProperty(1, category='stat')
-    vitalitaet = AttributeProperty(1, category='stat')
-    aura = AttributeProperty(1, category='stat')
-    konsentrazion = AttributeProperty(1, category='stat')
-
-    level = AttributeProperty(1, category='lvl')
-    erfahrungspunke = AttributeProperty(0, category='lvl')
-
-    rasse = AttributeProperty("none", category='rasse')
-    rang = AttributeProperty("none", category='rang')
-
-    lebenspunkte = AttributeProperty(50, category='werte')
-    zauberpunke = AttributeProperty(30, category='werte')
-    aktionspunke = AttributeProperty(30, category='werte')
-    manapunkte = AttributeProperty(2500, category='werte')
+    staerke = StatProperty("staerke")
+    intelligenz = StatProperty("intelligenz")
+    schnelligkeit = StatProperty("schnelligkeit")
+    weissheit = StatProperty("weissheit")
+    ausdauer = StatProperty("ausdauer")
+    willenskraft = StatProperty("willenskraft")
+    vitalitaet = StatProperty("vitalitaet")
+    aura = StatProperty("aura")
+    konsentrazion = StatProperty("konsentrazion")
+
+    level = StatProperty("level")
+    erfahrungspunke = StatProperty("erfahrungspunke")
+
+    rasse = StatProperty("rasse")
+    rang = StatProperty("rang")
 
+    lebenspunkte = StatProperty("lebenspunkte")
+    zauberpunke = StatProperty("zauberpunke")
+    aktionspunke = StatProperty("aktionspunke")
+    manapunkte = StatProperty("manapunkte")
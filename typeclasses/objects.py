@@ -12,6 +12,9 @@ inheritance.
 """
 from evennia.objects.objects import DefaultObject
 
+from world import inventory, nameindex
+from world.broadcast import broadcast
+
 
 class ObjectParent:
     """
@@ -24,6 +27,32 @@ class ObjectParent:
 
     """
 
+    def msg_contents(self, text=None, exclude=None, from_obj=None, mapping=None, **kwargs):
+        """
+        Emit a message to all objects inside this object. Same as the default,
+        but renders and sends the message once per group of receivers that
+        see the same text (see `world.broadcast`).
+
+        """
+        broadcast(self, text=text, exclude=exclude, from_obj=from_obj, mapping=mapping, **kwargs)
+
+    def at_object_receive(self, moved_obj, source_location, **kwargs):
+        super().at_object_receive(moved_obj, source_location, **kwargs)
+        nameindex.object_received(self, moved_obj)
+        inventory.invalidate(self)
+
+    def at_object_leave(self, moved_obj, target_location, **kwargs):
+        super().at_object_leave(moved_obj, target_location, **kwargs)
+        nameindex.object_left(self, moved_obj)
+        inventory.invalidate(self)
+
+    def at_rename(self, oldname, newname):
+        super().at_rename(oldname, newname)
+        # the index of where we are still has the old name
+        nameindex.invalidate(self.location)
+        if self.location:
+            inventory.invalidate(self.location)
+
 
 class Object(ObjectParent, DefaultObject):
     """
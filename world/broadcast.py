@@ -0,0 +1,315 @@
+"""
+Broadcast
+
+Room-wide messages (`sag`, poses, `nimm`, `lege` ...) go through
+`location.msg_contents()`, which by default runs the `$You()`/`$conj()`
+template through the funcparser and serializes the result once for every
+single receiver. In a full tavern that is the same work done fifty times
+over for what is, for everyone but the actor, the same line of text.
+
+This module does the fan-out in groups instead:
+
+- Receivers are grouped by what they will see. The actor and everyone
+  named in the `mapping` get a personal rendering; all other viewers are
+  grouped by how they see the names involved (e.g. builders also see
+  dbrefs), so a bystander group is rendered only once.
+- Templates without any `$func()` or `{key}` markers are not parsed at all.
+- Every group's payload is cleaned for the wire once and then pushed to
+  all sessions of the group through the session handler.
+
+Objects without sessions (NPCs, items) still get a normal `msg()` call, so
+their `at_msg_receive` hooks keep working.
+
+    broadcast(room, "$You() $conj(grin).", from_obj=caller)
+
+`ObjectParent.msg_contents` uses this, so all typeclasses get it.
+
+Whispers to several people use the same delivery path, see `whisper`.
+
+"""
+from functools import lru_cache
+from string import Formatter
+
+from django.conf import settings
+
+from evennia.objects.objects import _MSG_CONTENTS_PARSER
+from evennia.server.sessionhandler import SESSIONS
+from evennia.utils import logger
+from evennia.utils.utils import is_iter, make_iter
+
+_FUNCPARSE_OUTGOING = settings.FUNCPARSER_PARSE_OUTGOING_MESSAGES_ENABLED
+
+
+@lru_cache(maxsize=512)
+def _is_template(text):
+    """
+    If a message needs to be run through the funcparser/`format_map` at all.
+
+    """
+    return "$" in text or "{" in text
+
+
+def _display_name(obj, looker):
+    return obj.get_display_name(looker=looker) if hasattr(obj, "get_display_name") else str(obj)
+
+
+def _render(template, you, receiver, mapping, raise_errors):
+    """
+    Render a template for one receiver, exactly like the default `msg_contents`.
+
+    """
+    outmessage = _MSG_CONTENTS_PARSER.parse(
+        template,
+        raise_errors=raise_errors,
+        return_string=True,
+        caller=you,
+        receiver=receiver,
+        mapping=mapping,
+    )
+    return outmessage.format_map(
+        {key: _display_name(obj, receiver) for key, obj in mapping.items()}
+    )
+
+
+def group_receivers(template, receivers, you, mapping, raise_errors=False):
+    """
+    Render a message template once per group of receivers that see the same
+    thing.
+
+    Args:
+        template (str): The message, with `$You()`, `$conj()`, `{key}` etc.
+        receivers (list): The objects to receive it.
+        you (Object): The actor (`$You()`).
+        mapping (dict): Extra `{key: obj}` replacements; must contain `you`.
+        raise_errors (bool, optional): Raise on funcparser errors.
+
+    Returns:
+        dict: `{rendered_message: [receiver, ...]}`, in receiver order.
+
+    """
+    if not _is_template(template):
+        return {template: list(receivers)} if receivers else {}
+
+    named = {id(obj) for obj in mapping.values()}
+    named_objs = tuple(mapping.values())
+    views = {}
+    groups = {}
+    for receiver in receivers:
+        if id(receiver) in named:
+            # the actor or someone addressed; gets their own rendering
+            output = _render(template, you, receiver, mapping, raise_errors)
+        else:
+            view = tuple(_display_name(obj, receiver) for obj in named_objs)
+            output = views.get(view)
+            if output is None:
+                output = views[view] = _render(template, you, receiver, mapping, raise_errors)
+        groups.setdefault(output, []).append(receiver)
+    return groups
+
+
+def send_to_sessions(sessions, **kwargs):
+    """
+    Send the same output to many sessions, cleaning it for the wire only once.
+
+    Args:
+        sessions (list): Server sessions to send to.
+        **kwargs: Output instructions, as for `session.data_out`.
+
+    """
+    if not sessions:
+        return
+    if len(sessions) == 1 or _FUNCPARSE_OUTGOING:
+        # outgoing inlinefuncs are parsed per session, so nothing to share
+        for session in sessions:
+            SESSIONS.data_out(session, **kwargs)
+        return
+    cleaned = SESSIONS.clean_senddata(sessions[0], kwargs)
+    amp = SESSIONS.server.amp_protocol
+    for session in sessions:
+        amp.send_MsgServer2Portal(session, **cleaned)
+
+
+def broadcast(
+    location,
+    text=None,
+    exclude=None,
+    from_obj=None,
+    mapping=None,
+    raise_funcparse_errors=False,
+    **kwargs,
+):
+    """
+    Emit a message to all objects inside `location`. Takes the same arguments
+    as `DefaultObject.msg_contents`, which it replaces.
+
+    """
+    is_outcmd = text and is_iter(text)
+    template = text[0] if is_outcmd else text
+    outkwargs = text[1] if is_outcmd and len(text) > 1 else {}
+    mapping = mapping or {}
+    you = from_obj or location
+
+    if "you" not in mapping:
+        mapping[you] = you
+
+    contents = location.contents
+    if exclude:
+        exclude = make_iter(exclude)
+        contents = [obj for obj in contents if obj not in exclude]
+
+    if not isinstance(template, str):
+        # not a template; nothing to share between receivers
+        for receiver in contents:
+            receiver.msg(text=(template, outkwargs), from_obj=from_obj, **kwargs)
+        return
+
+    deliver(
+        group_receivers(template, contents, you, mapping, raise_funcparse_errors),
+        outkwargs,
+        from_obj=from_obj,
+        **kwargs,
+    )
+
+
+def deliver(groups, outkwargs=None, from_obj=None, **kwargs):
+    """
+    Send pre-rendered output to groups of receivers, one payload per group.
+
+    Args:
+        groups (dict): `{message: [receiver, ...]}`.
+        outkwargs (dict, optional): Options for the `text` outputfunc, like `{"type": "say"}`.
+        from_obj (Object, optional): The sender.
+        **kwargs: Passed on like to `msg()`.
+
+    """
+    outkwargs = outkwargs or {}
+    for output, receivers in groups.items():
+        outtext = (output, outkwargs)
+        sessions = []
+        for receiver in receivers:
+            receiver_sessions = receiver.sessions.all()
+            if not receiver_sessions:
+                receiver.msg(text=outtext, from_obj=from_obj, **kwargs)
+                continue
+            # the hooks DefaultObject.msg would call
+            for obj in make_iter(from_obj) if from_obj else ():
+                try:
+                    obj.at_msg_send(text=outtext, to_obj=receiver, **kwargs)
+                except Exception:
+                    logger.log_trace()
+            try:
+                if not receiver.at_msg_receive(text=outtext, from_obj=from_obj, **kwargs):
+                    continue
+            except Exception:
+                logger.log_trace()
+            sessions.extend(receiver_sessions)
+        send_to_sessions(sessions, text=outtext, **kwargs)
+
+
+@lru_cache(maxsize=128)
+def _template_fields(template):
+    return frozenset(field for _, field, _, _ in Formatter().parse(template) if field)
+
+
+def whisper(speaker, message, receivers, msg_self=True, msg_receivers=None):
+    """
+    Whisper to several receivers at once. Produces the same messages as
+    `speaker.at_say(message, receivers=receivers, whisper=True)`, but
+    formats the whisper once per distinct output and delivers it in batch.
+
+    Args:
+        speaker (Object): Who is whispering.
+        message (str): What is whispered.
+        receivers (list): Who to whisper to.
+        msg_self (bool or str, optional): Echo to the speaker; a string is
+            used as template for it.
+        msg_receivers (str, optional): Template for the receivers.
+
+    """
+    location = speaker.location
+    if msg_self:
+        if msg_self is True:
+            msg_self = '{self} whisper to {all_receivers}, "|n{speech}|n"'
+        speaker.msg(
+            text=(
+                msg_self.format_map(
+                    {
+                        "self": "You",
+                        "object": speaker.get_display_name(speaker),
+                        "location": location.get_display_name(speaker) if location else None,
+                        "receiver": None,
+                        "all_receivers": ", ".join(
+                            recv.get_display_name(speaker) for recv in receivers
+                        ),
+                        "speech": message,
+                    }
+                ),
+                {"type": "whisper"},
+            ),
+            from_obj=speaker,
+        )
+
+    template = msg_receivers or '{object} whispers: "|n{speech}|n"'
+    fields = _template_fields(template)
+    all_receivers = (
+        ", ".join(recv.get_display_name(recv) for recv in receivers)
+        if "all_receivers" in fields
+        else None
+    )
+    rendered = {}
+    groups = {}
+    for receiver in receivers:
+        # only what the template shows decides if two receivers see the same
+        view = (
+            speaker.get_display_name(receiver) if "object" in fields else None,
+            location.get_display_name(receiver) if location and "location" in fields else None,
+            receiver.get_display_name(receiver) if "receiver" in fields else None,
+        )
+        output = rendered.get(view)
+        if output is None:
+            output = rendered[view] = template.format_map(
+                {
+                    "self": "You",
+                    "object": view[0],
+                    "location": view[1],
+                    "receiver": view[2],
+                    "all_receivers": all_receivers,
+                    "speech": message,
+                }
+            )
+        groups.setdefault(output, []).append(receiver)
+    deliver(groups, {"type": "whisper"}, from_obj=speaker)
+
+
+def resolve_names(searcher, names):
+    """
+    Find several objects by name in one go, looking through the searcher's
+    location and inventory once instead of running a full search per name.
+
+    Names that don't match exactly one object by key fall back to
+    `searcher.search(name)`, which also takes care of the error messages.
+
+    Args:
+        searcher (Object): Who is searching.
+        names (list): The names to look for.
+
+    Returns:
+        list: The found objects, in the order of `names`, without duplicates.
+
+    """
+    location = searcher.location
+    candidates = (location.contents if location else []) + searcher.contents
+    by_key = {}
+    for obj in candidates:
+        by_key.setdefault(obj.key.lower(), []).append(obj)
+
+    found = []
+    for name in names:
+        matches = by_key.get(name.lower(), ())
+        if len(matches) == 1 and matches[0].access(searcher, "search", default=True):
+            obj = matches[0]
+        else:
+            obj = searcher.search(name)
+        if obj and obj not in found:
+            found.append(obj)
+    return found
@@ -58,14 +58,45 @@ the decisions players made earlier. Initializing skills, creating starting gear,
 and other one-time method calls and set-up should be put here.
 """
 
-import inflect
-from typeclasses.characters import Character
+from django.utils.functional import SimpleLazyObject
 
-from evennia.prototypes.spawner import spawn
 from evennia.utils import dedent
 from evennia.utils.evtable import EvTable
 
-_INFLECT = inflect.engine()
+from world.chargen_draft import STEP, open_draft
+from world.charnames import CHARNAMES
+
+
+def _inflect_engine():
+    import inflect
+
+    return inflect.engine()
+
+
+# only built when chargen first needs it
+_INFLECT = SimpleLazyObject(_inflect_engine)
+
+# Node texts and option lists, rendered once by `compile_content()` instead of
+# on every display. The `_build_*` functions below do the rendering; the nodes
+# only pick from here and apply what depends on the character.
+_COMPILED = {}
+
+
+def _compiled():
+    if not _COMPILED:
+        # first chargen since the module was (re)loaded
+        compile_content()
+    return _COMPILED
+
+
+def _draft(caller):
+    """
+    The unsaved choices for the character being created. Choices are kept
+    in memory and saved together when moving on to the next decision (see
+    `world.chargen_draft`).
+
+    """
+    return open_draft(caller, caller.new_char)
 
 
 #########################################################
@@ -73,8 +104,7 @@ _INFLECT = inflect.engine()
 #########################################################
 
 
-def menunode_welcome(caller):
-    """Starting page."""
+def _build_welcome():
     text = dedent(
         """\
         |wWillkommen zur Character erschaffung!|n
@@ -90,6 +120,11 @@ def menunode_welcome(caller):
     return (text, help), options
 
 
+def menunode_welcome(caller):
+    """Starting page."""
+    return _compiled()["welcome"]
+
+
 #########################################################
 #                 Informational Pages
 #########################################################
@@ -127,11 +162,7 @@ _CLASS_INFO_DICT = {
 }
 
 
-def menunode_info_base(caller):
-    """Base node for the informational choices."""
-    # this is a base node for a decision, so we want to save the character's progress here
-    caller.new_char.db.chargen_step = "menunode_info_base"
-
+def _build_info_base():
     text = dedent(
         """\
         |wHier ist eine Uebersicht aller spielbaren Rassen.
@@ -149,20 +180,17 @@ def menunode_info_base(caller):
                 "goto": ("menunode_info_class", {"selected_class": pclass}),
             }
         )
-    return (text, help), options
+    return (text, help), tuple(options)
 
 
-# putting your kwarg in the menu declaration helps keep track of what variables the node needs
-def menunode_info_class(caller, raw_string, selected_class=None, **kwargs):
-    """Informational overview of a particular class"""
+def menunode_info_base(caller):
+    """Base node for the informational choices."""
+    # this is a base node for a decision, so we want to save the character's progress here
+    _draft(caller).step = "menunode_info_base"
+    return _compiled()["info_base"]
 
-    # sometimes weird bugs happen - it's best to check for them rather than let the game break
-    if not selected_class:
-        # reset back to the previous step
-        caller.new_char.db.chargen_step = "menunode_welcome"
-        # print error to player and quit the menu
-        return "UPS! etwas ging schief!"
 
+def _build_info_class(selected_class):
     # Since you have all the info in a nice dict, you can just grab it to display here
     text = _CLASS_INFO_DICT[selected_class]
     help = "If you want option-specific help, you can define it in your info dict and reference it."
@@ -186,7 +214,20 @@ def menunode_info_class(caller, raw_string, selected_class=None, **kwargs):
                     "goto": ("menunode_info_class", {"selected_class": pclass}),
                 }
             )
-    return (text, help), options
+    return (text, help), tuple(options)
+
+
+# putting your kwarg in the menu declaration helps keep track of what variables the node needs
+def menunode_info_class(caller, raw_string, selected_class=None, **kwargs):
+    """Informational overview of a particular class"""
+
+    # sometimes weird bugs happen - it's best to check for them rather than let the game break
+    if not selected_class:
+        # reset back to the previous step
+        _draft(caller).step = "menunode_welcome"
+        # print error to player and quit the menu
+        return "UPS! etwas ging schief!"
+    return _compiled()["info_class"][selected_class]
 
 
 def _set_class(caller, raw_string, selected_class=None, **kwargs):
@@ -195,10 +236,9 @@ def _set_class(caller, raw_string, selected_class=None, **kwargs):
         # go back to the base node for this decision
         return "menunode_info_base"
 
-    char = caller.new_char
     # any special code for setting this option would go here!
-    # but we'll just set an attribute
-    char.db.player_class = selected_class
+    # but we'll just set an attribute (saved with the next step)
+    _draft(caller).set("player_class", selected_class)
 
     # move on to the next step!
     return "menunode_categories"
@@ -228,11 +268,7 @@ _APPEARANCE_DICT = {
 }
 
 
-def menunode_categories(caller, **kwargs):
-    """Base node for categorized options."""
-    # this is a new decision step, so save your resume point here
-    caller.new_char.db.chargen_step = "menunode_categories"
-
+def _build_categories():
     text = dedent(
         """\
         |wOption Categories|n
@@ -273,15 +309,17 @@ def menunode_categories(caller, **kwargs):
             "goto": "menunode_info_base",
         }
     )
-    return (text, help), options
+    return (text, help), tuple(options)
 
 
-def menunode_category_options(caller, raw_string, category=None, **kwargs):
-    """Choosing an option within the categories."""
-    if not category:
-        # this shouldn't have happened, so quit and retry
-        return "Etwas ging Schief. Versuche nochmal."
+def menunode_categories(caller, **kwargs):
+    """Base node for categorized options."""
+    # this is a new decision step, so save your resume point here
+    _draft(caller).step = "menunode_categories"
+    return _compiled()["categories"]
 
+
+def _build_category_options(category):
     # for mechanics-related choices, you can combine this with the
     # informational options approach to give specific info
     text = f"Waehle deine {category}:"
@@ -301,7 +339,15 @@ def menunode_category_options(caller, raw_string, category=None, **kwargs):
             "goto": "menunode_categories",
         }
     )
-    return (text, help), options
+    return (text, help), tuple(options)
+
+
+def menunode_category_options(caller, raw_string, category=None, **kwargs):
+    """Choosing an option within the categories."""
+    if not category:
+        # this shouldn't have happened, so quit and retry
+        return "Etwas ging Schief. Versuche nochmal."
+    return _compiled()["category_options"][category]
 
 
 def _set_category_opt(caller, raw_string, category, value, **kwargs):
@@ -309,7 +355,7 @@ def _set_category_opt(caller, raw_string, category, value, **kwargs):
 
     # this is where you would put any more complex code involved in setting the option,
     # but we're just doing simple attributes
-    caller.new_char.attributes.add(category, value)
+    _draft(caller).set(category, value)
 
     # go back to the base node for the categories choice to pick another
     return "menunode_categories"
@@ -334,18 +380,7 @@ _SKILL_OPTIONS = [
 ]
 
 
-def menunode_multi_choice(caller, raw_string, **kwargs):
-    """A multiple-choice menu node."""
-    char = caller.new_char
-
-    # another decision, so save the resume point
-    char.db.chargen_step = "menunode_multi_choice"
-
-    # in order to support picking up from where we left off, get the options from the character
-    # if they weren't passed in
-    # this is again just a simple attribute, but you could retrieve this list however
-    selected = kwargs.get("selected") or char.attributes.get("skill_list", [])
-
+def _build_multi_choice():
     text = dedent(
         """\
         |wMultiple Choice|n
@@ -363,38 +398,52 @@ def menunode_multi_choice(caller, raw_string, **kwargs):
         " requires exactly 3."
     )
 
+    # each option's description as it is, and highlighted for when it's been selected
+    descs = tuple((option, option, f"|y{option} (selected)|n") for option in _SKILL_OPTIONS)
+    next_option = {
+        "key": ("(weiter)", "next", "w"),
+        "desc": "Continue to the next step",
+        "goto": "menunode_choose_objects",
+    }
+    back_option = {
+        "key": ("(zurueck)", "back", "z"),
+        "desc": "Go back to the previous step",
+        "goto": "menunode_categories",
+    }
+    return (text, help), descs, next_option, back_option
+
+
+def menunode_multi_choice(caller, raw_string, **kwargs):
+    """A multiple-choice menu node."""
+    draft = _draft(caller)
+
+    # another decision, so save the resume point
+    draft.step = "menunode_multi_choice"
+
+    # in order to support picking up from where we left off, get the options from the character
+    # if they weren't passed in
+    # this is again just a simple attribute, but you could retrieve this list however
+    selected = kwargs.get("selected") or draft.get("skill_list", [])
+
+    textinfo, descs, next_option, back_option = _compiled()["multi_choice"]
     options = []
-    for option in _SKILL_OPTIONS:
-        # check if the option has been selected
-        if option in selected:
-            # if it's been selected, we want to highlight that
-            opt_desc = f"|y{option} (selected)|n"
-        else:
-            opt_desc = option
+    for option, opt_desc, selected_desc in descs:
+        # if it's been selected, we want to highlight that
         options.append(
-            {"desc": opt_desc, "goto": (_set_multichoice, {"selected": selected, "option": option})}
+            {
+                "desc": selected_desc if option in selected else opt_desc,
+                "goto": (_set_multichoice, {"selected": selected, "option": option}),
+            }
         )
 
     # only display the Next option if the requirements are met!
     # for this example, you need exactly 3 choices, but you can use an inequality
     # for "no more than X", or "at least X"
     if len(selected) == 3:
-        options.append(
-            {
-                "key": ("(weiter)", "next", "w"),
-                "desc": "Continue to the next step",
-                "goto": "menunode_choose_objects",
-            }
-        )
-    options.append(
-        {
-            "key": ("(zurueck)", "back", "z"),
-            "desc": "Go back to the previous step",
-            "goto": "menunode_categories",
-        }
-    )
+        options.append(next_option)
+    options.append(back_option)
 
-    return (text, help), options
+    return textinfo, options
 
 
 def _set_multichoice(caller, raw_string, selected=[], **kwargs):
@@ -408,9 +457,9 @@ def _set_multichoice(caller, raw_string, selected=[], **kwargs):
         else:
             selected.append(option)
 
-        # now that the options are updated, save it to the character
+        # now that the options are updated, save it to the character (with the next step)
         # this is just setting an attribute but it could be anything
-        caller.new_char.attributes.add("skill_list", selected)
+        _draft(caller).set("skill_list", selected)
 
     # pass the list back so we don't need to retrieve it again
     return ("menunode_multi_choice", {"selected": selected})
@@ -441,21 +490,15 @@ _EXAMPLE_PROTOTYPES = [
 # this method will be run to create the starting objects
 def create_objects(character):
     """do the actual object spawning"""
-    # since our example chargen saves the starting prototype to an attribute, we retrieve that here
-    proto = dict(character.db.starter_weapon)
-    # set the location to our character, so they actually have it
-    proto["location"] = character
-    # create the object
-    spawn(proto)
-
+    from world.starter_gear import spawn_gear
 
-def menunode_choose_objects(caller, raw_string, **kwargs):
-    """Selecting objects to start with"""
-    char = caller.new_char
+    # since our example chargen saves the starting prototype to an attribute, we retrieve that here
+    proto = character.db.starter_weapon
+    # create the object from the compiled prototype, in our character so they actually have it
+    spawn_gear((proto, character))
 
-    # another decision, so save the resume point
-    char.db.chargen_step = "menunode_choose_objects"
 
+def _build_choose_objects():
     text = dedent(
         """\
         |wStarting Objects|n
@@ -490,7 +533,14 @@ def menunode_choose_objects(caller, raw_string, **kwargs):
         }
     )
 
-    return (text, help), options
+    return (text, help), tuple(options)
+
+
+def menunode_choose_objects(caller, raw_string, **kwargs):
+    """Selecting objects to start with"""
+    # another decision, so save the resume point
+    _draft(caller).step = "menunode_choose_objects"
+    return _compiled()["choose_objects"]
 
 
 def _set_object_choice(caller, raw_string, proto, **kwargs):
@@ -499,7 +549,7 @@ def _set_object_choice(caller, raw_string, proto, **kwargs):
     # we DON'T want to actually create the object, yet! that way players can still go back and
     # change their mind instead, we save what object was chosen - in this case, by saving the
     # prototype dict to the character
-    caller.new_char.db.starter_weapon = proto
+    _draft(caller).set("starter_weapon", proto)
 
     # continue to the next step
     return "menunode_choose_name"
@@ -510,25 +560,9 @@ def _set_object_choice(caller, raw_string, proto, **kwargs):
 #########################################################
 
 
-def menunode_choose_name(caller, raw_string, **kwargs):
-    """Name selection"""
-    char = caller.new_char
-
-    # another decision, so save the resume point
-    char.db.chargen_step = "menunode_choose_name"
-
-    # check if an error message was passed to the node. if so, you'll want to include it
-    # into your "name prompt" at the end of the node text.
-    if error := kwargs.get("error"):
-        prompt_text = f"{error}. Enter a different name."
-    else:
-        # there was no error, so just ask them to enter a name.
-        prompt_text = "Enter a name here to check if it's available."
-
-    # this will print every time the player is prompted to choose a name,
-    # including the prompt text defined above
+def _build_choose_name():
     text = dedent(
-        f"""\
+        """\
         |wChoosing a Name|n
 
         Especially for roleplaying-centric games, being able to choose your
@@ -542,7 +576,26 @@ def menunode_choose_name(caller, raw_string, **kwargs):
     help = "You'll have a chance to change your mind before confirming, even if the name is free."
     # since this is a free-text field, we just have the one
     options = {"key": "_default", "goto": _check_charname}
-    return (text, help), options
+    return text, help, options
+
+
+def menunode_choose_name(caller, raw_string, **kwargs):
+    """Name selection"""
+    # another decision, so save the resume point
+    _draft(caller).step = "menunode_choose_name"
+
+    # check if an error message was passed to the node. if so, you'll want to include it
+    # into your "name prompt" at the end of the node text.
+    if error := kwargs.get("error"):
+        prompt_text = f"{error}. Enter a different name."
+    else:
+        # there was no error, so just ask them to enter a name.
+        prompt_text = "Enter a name here to check if it's available."
+
+    # this will print every time the player is prompted to choose a name,
+    # including the prompt text defined above
+    template, help, options = _compiled()["choose_name"]
+    return (template.format(prompt_text=prompt_text), help), options
 
 
 def _check_charname(caller, raw_string, **kwargs):
@@ -557,17 +610,18 @@ def _check_charname(caller, raw_string, **kwargs):
     # some useful cleanup on the input, just in case they try something sneaky
     charname = caller.account.normalize_username(charname)
 
-    # check to make sure that the name doesn't already exist
-    candidates = Character.objects.filter_family(db_key__iexact=charname)
-    if len(candidates):
+    char = caller.new_char
+    # check to make sure that the name doesn't already exist, and reserve it in the
+    # same step so no parallel chargen can take it in the meantime
+    if not CHARNAMES.reserve(charname, owner=char, obj=char):
         # the name is already taken - report back with the error
         return (
             "menunode_choose_name",
             {"error": f"|w{charname}|n is unavailable.\n\nEnter a different name."},
         )
     else:
-        # it's free! set the character's key to the name to reserve it
-        caller.new_char.key = charname
+        # it's free! set the character's key to the name to keep it
+        char.key = charname
         # continue on to the confirmation node
         return "menunode_confirm_name"
 
@@ -596,16 +650,45 @@ def menunode_confirm_name(caller, raw_string, **kwargs):
 def menunode_end(caller, raw_string):
     """End-of-chargen cleanup."""
     char = caller.new_char
+    draft = _draft(caller)
     # since everything is finished and confirmed, we actually create the starting objects now
+    draft.flush()
     create_objects(char)
 
     # clear in-progress status
-    caller.new_char.attributes.remove("chargen_step")
-    text = dedent(
-        """
-        Gratulations!
+    draft.remove(STEP)
+    draft.flush()
+    return _compiled()["end"], None
+
+
+#########################################################
+#                 Compiling the content
+#########################################################
+
 
-        Du hast einen neuen Character erstellt, Viel Spass im der Timepit!
+def compile_content():
     """
+    Render the texts and option lists of all nodes from the dicts and lists
+    above. Runs when a node is first shown after the module was (re)loaded;
+    call it again after changing those at runtime.
+
+    """
+    _COMPILED.update(
+        welcome=_build_welcome(),
+        info_base=_build_info_base(),
+        info_class={pclass: _build_info_class(pclass) for pclass in _CLASS_INFO_DICT},
+        categories=_build_categories(),
+        category_options={
+            category: _build_category_options(category) for category in _APPEARANCE_DICT
+        },
+        multi_choice=_build_multi_choice(),
+        choose_objects=_build_choose_objects(),
+        choose_name=_build_choose_name(),
+        end=dedent(
+            """
+            Gratulations!
+
+            Du hast einen neuen Character erstellt, Viel Spass im der Timepit!
+        """
+        ),
     )
-    return text, None
@@ -0,0 +1,241 @@
+"""
+Chargen draft
+
+Every node of the chargen menu (`world.char_menu`) saved the resume point
+`chargen_step` on the new character, and every choice saved another
+Attribute right away - a database write per click.
+
+A `ChargenDraft` keeps the choices in memory on the session instead
+(`session.chargen_draft`) and writes them all in one transaction
+
+- at checkpoints, when the menu moves on to another decision step,
+- when the menu closes,
+- when the session logs out, or the server stops.
+
+Until then every change is also appended to a small journal file per
+character (in `CHARGEN_JOURNAL_DIR`), which costs no database round trip.
+Should the server die before a flush, the journal is replayed the next
+time the draft is opened, and for all characters at server start
+(`recover_all()`). The journal isn't fsync'd, so it survives the server
+process dying, but not the whole machine going down.
+
+    draft = open_draft(session, char)
+    draft.set("skill_list", skills)         # memory and journal only
+    draft.step = "menunode_multi_choice"    # a new step flushes
+    close_draft(session)                    # flushes
+
+"""
+import os
+import pickle
+
+from django.conf import settings
+from django.db import transaction
+
+import evennia
+from evennia.server.signals import SIGNAL_ACCOUNT_POST_LOGOUT
+from evennia.utils import logger
+from evennia.utils.dbserialize import deserialize
+
+JOURNAL_DIR = getattr(
+    settings, "CHARGEN_JOURNAL_DIR", os.path.join(settings.GAME_DIR, "server", "chargen_journal")
+)
+STEP = "chargen_step"
+
+# marks an Attribute to remove on the next flush
+_REMOVED = object()
+
+
+class ChargenDraft:
+    """
+    The unsaved chargen choices for one character.
+
+    """
+
+    __slots__ = ("char", "_changes")
+
+    def __init__(self, char):
+        self.char = char
+        # Attribute key -> value (or _REMOVED) not written yet
+        self._changes = {}
+
+    @property
+    def journal_path(self):
+        return os.path.join(JOURNAL_DIR, f"{self.char.id}.journal")
+
+    def _journal(self, key, value):
+        record = (key,) if value is _REMOVED else (key, value)
+        try:
+            os.makedirs(JOURNAL_DIR, exist_ok=True)
+            with open(self.journal_path, "ab") as journal:
+                pickle.dump(record, journal, protocol=pickle.HIGHEST_PROTOCOL)
+        except (OSError, pickle.PicklingError) as err:
+            # not worth losing the choice over - write it through instead
+            logger.log_err(f"Chargen journal of {self.char}: {err}")
+            self.flush()
+
+    def replay(self):
+        """
+        Load changes left in the journal by a server that died before
+        flushing them. A record cut off by the crash is ignored.
+
+        Returns:
+            int: The number of changes loaded.
+
+        """
+        num = 0
+        try:
+            with open(self.journal_path, "rb") as journal:
+                while True:
+                    record = pickle.load(journal)
+                    self._changes[record[0]] = record[1] if len(record) > 1 else _REMOVED
+                    num += 1
+        except FileNotFoundError:
+            pass
+        except (EOFError, pickle.UnpicklingError, ValueError, IndexError):
+            # end of the journal, or a record cut off
+            pass
+        return num
+
+    def get(self, key, default=None):
+        """
+        Get a chargen value, unsaved or saved.
+
+        Returns:
+            any: The value; lists and dicts are plain copies, changing them
+                doesn't save anything.
+
+        """
+        if key in self._changes:
+            value = self._changes[key]
+            return default if value is _REMOVED else value
+        return deserialize(self.char.attributes.get(key, default))
+
+    def set(self, key, value):
+        """
+        Change a chargen value, to be saved on the next flush.
+
+        """
+        self._changes[key] = value
+        self._journal(key, value)
+
+    def remove(self, key):
+        """
+        Remove a chargen value on the next flush.
+
+        """
+        self._changes[key] = _REMOVED
+        self._journal(key, _REMOVED)
+
+    @property
+    def step(self):
+        """The node to resume chargen at."""
+        return self.get(STEP)
+
+    @step.setter
+    def step(self, nodename):
+        # moving on to another decision is a checkpoint
+        if nodename != self.step:
+            self.set(STEP, nodename)
+            self.flush()
+
+    def flush(self):
+        """
+        Write all changes in one transaction, and drop the journal.
+
+        """
+        if self._changes:
+            changes, self._changes = self._changes, {}
+            attributes = self.char.attributes
+            with transaction.atomic():
+                attributes.batch_add(
+                    *((key, value) for key, value in changes.items() if value is not _REMOVED)
+                )
+                for key in (key for key, value in changes.items() if value is _REMOVED):
+                    attributes.remove(key)
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+
+def open_draft(session, char):
+    """
+    Get the draft of `char` on a session, opening it (and replaying what
+    a crash left in its journal) if needed.
+
+    Returns:
+        ChargenDraft: The draft.
+
+    """
+    draft = getattr(session, "chargen_draft", None)
+    if draft is not None and draft.char == char:
+        return draft
+    if draft is not None:
+        draft.flush()
+    draft = ChargenDraft(char)
+    if draft.replay():
+        draft.flush()
+    session.chargen_draft = draft
+    return draft
+
+
+def close_draft(session):
+    """
+    Flush and forget the draft of a session, if it has one.
+
+    """
+    draft = getattr(session, "chargen_draft", None)
+    if draft is not None:
+        session.chargen_draft = None
+        draft.flush()
+
+
+def flush_all():
+    """
+    Flush the drafts of all sessions; called when the server stops.
+
+    """
+    for session in evennia.SESSION_HANDLER.get_sessions():
+        draft = getattr(session, "chargen_draft", None)
+        if draft is not None:
+            draft.flush()
+
+
+def recover_all():
+    """
+    Replay all journals left behind by a crash; called at server start.
+
+    Returns:
+        int: The number of characters recovered.
+
+    """
+    from evennia.objects.models import ObjectDB
+
+    try:
+        names = os.listdir(JOURNAL_DIR)
+    except FileNotFoundError:
+        return 0
+    ids = {
+        int(name.split(".")[0]): name
+        for name in names
+        if name.endswith(".journal") and name.split(".")[0].isdigit()
+    }
+    chars = list(ObjectDB.objects.filter(id__in=ids))
+    for char in chars:
+        draft = ChargenDraft(char)
+        if draft.replay():
+            draft.flush()
+    # journals of characters deleted in the meantime
+    for charid in set(ids) - {char.id for char in chars}:
+        os.remove(os.path.join(JOURNAL_DIR, ids[charid]))
+    if chars:
+        logger.log_info(f"Chargen: recovered unsaved choices of {len(chars)} character(s).")
+    return len(chars)
+
+
+def _session_logged_out(sender, session=None, **kwargs):
+    if session is not None:
+        close_draft(session)
+
+
+SIGNAL_ACCOUNT_POST_LOGOUT.connect(_session_logged_out, dispatch_uid="chargen_draft_logout")
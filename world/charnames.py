@@ -0,0 +1,235 @@
+"""
+Character names
+
+Chargen checked if a name was free with a case-insensitive filter over all
+character objects (`db_key__iexact`, which no index serves) and then
+loaded the whole result just to see if it was empty. Two players picking
+the same name at the same moment could also both find it free, as the
+check and setting the key were separate steps.
+
+`CHARNAMES` keeps the lower-case keys of all characters in memory, kept
+up to date through signals like the username index of the login
+(`server.menu_login.usernames`). On top of it, a name is taken with
+`reserve()`, which checks and reserves under a lock, so of two parallel
+chargens only one gets it:
+
+- names not in the index and not reserved are free without a query,
+- a hit is confirmed with one `exists()` query on `LOWER(db_key)`, in case
+  the character was deleted from outside the server,
+- the reservation holds until `release()`, by which time the name has
+  become the key of the new character.
+
+`create_lower_index()` adds a matching functional index on the object
+table; it's created at server start if the `CHARNAME_LOWER_INDEX` setting
+is set.
+
+    if CHARNAMES.reserve(name, owner=char, obj=char):
+        char.key = name
+    ...
+    CHARNAMES.release(char)
+
+"""
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db.models.functions import Lower
+from django.db.models.signals import post_delete, post_save
+
+from evennia.objects.models import ObjectDB
+
+from server import dbindex
+
+LOWER_INDEX_NAME = "objects_objectdb_key_lower"
+
+_CHARACTER = None
+
+
+def _character_class():
+    global _CHARACTER
+    if _CHARACTER is None:
+        from typeclasses.characters import Character
+
+        _CHARACTER = Character
+    return _CHARACTER
+
+
+class CharacterNames:
+    """
+    The lower-case keys of all characters, and the names reserved by
+    chargens in progress.
+
+    """
+
+    __slots__ = ("_keys", "_names", "_reserved", "_lock")
+
+    def __init__(self):
+        # object id -> lower-case key
+        self._keys = None
+        # lower-case key -> number of characters with it
+        self._names = Counter()
+        # lower-case name -> owner
+        self._reserved = {}
+        self._lock = threading.RLock()
+
+    def load(self):
+        """
+        (Re)load the keys of all characters with one query.
+
+        """
+        with self._lock:
+            self._keys = {
+                pk: key.lower()
+                for pk, key in _character_class()
+                .objects.filter_family()
+                .values_list("id", "db_key")
+            }
+            self._names = Counter(self._keys.values())
+
+    def _in_db(self, name, obj=None):
+        query = (
+            _character_class()
+            .objects.filter_family()
+            .annotate(key_lower=Lower("db_key"))
+            .filter(key_lower=name.lower())
+        )
+        if obj is not None:
+            query = query.exclude(id=obj.id)
+        return query.exists()
+
+    def _indexed(self, name, obj=None):
+        count = self._names.get(name, 0)
+        if obj is not None and self._keys.get(obj.id) == name:
+            # its own name
+            count -= 1
+        return count > 0
+
+    def is_taken(self, name, owner=None, obj=None):
+        """
+        Check if a name belongs to a character or is reserved.
+
+        Args:
+            name (str): The name, in any case.
+            owner (any, optional): Names reserved by this owner count as free.
+            obj (Object, optional): The character to get the name; its
+                own current key counts as free.
+
+        Returns:
+            bool: If the name is taken.
+
+        """
+        with self._lock:
+            if self._keys is None:
+                self.load()
+            name = name.lower()
+            reserved_by = self._reserved.get(name)
+            if reserved_by is not None and reserved_by != owner:
+                return True
+            if not self._indexed(name, obj):
+                return False
+            if self._in_db(name, obj):
+                return True
+            # deleted behind our back
+            self._names.pop(name, None)
+            self._keys = {pk: key for pk, key in self._keys.items() if key != name}
+            return False
+
+    def reserve(self, name, owner, obj=None):
+        """
+        Reserve a name, if it's free. An owner holds only one name at a
+        time; reserving another releases the previous one.
+
+        Args:
+            name (str): The name, in any case.
+            owner (any): Who reserves it, like the character in chargen.
+            obj (Object, optional): The character to get the name.
+
+        Returns:
+            bool: If the name was free and is now reserved for `owner`.
+
+        """
+        with self._lock:
+            if self.is_taken(name, owner=owner, obj=obj):
+                return False
+            self.release(owner)
+            self._reserved[name.lower()] = owner
+            return True
+
+    def release(self, owner):
+        """
+        Release the name reserved by `owner`, if any.
+
+        """
+        with self._lock:
+            for name in [name for name, holder in self._reserved.items() if holder == owner]:
+                del self._reserved[name]
+
+    def update(self, obj):
+        """
+        Track the (new) key of a character.
+
+        """
+        with self._lock:
+            if self._keys is None:
+                return
+            old = self._keys.get(obj.id)
+            new = obj.db_key.lower()
+            if old == new:
+                return
+            if old is not None:
+                self._names[old] -= 1
+                if self._names[old] <= 0:
+                    del self._names[old]
+            self._keys[obj.id] = new
+            self._names[new] += 1
+
+    def discard(self, obj):
+        """
+        Forget a deleted character.
+
+        """
+        with self._lock:
+            if self._keys is None:
+                return
+            old = self._keys.pop(obj.id, None)
+            if old is not None:
+                self._names[old] -= 1
+                if self._names[old] <= 0:
+                    del self._names[old]
+
+
+CHARNAMES = CharacterNames()
+
+
+def _object_saved(sender, instance, **kwargs):
+    if isinstance(instance, ObjectDB) and isinstance(instance, _character_class()):
+        CHARNAMES.update(instance)
+
+
+def _object_deleted(sender, instance, **kwargs):
+    if isinstance(instance, ObjectDB):
+        CHARNAMES.discard(instance)
+
+
+# typeclasses are proxy models sending as themselves, so no `sender` filter
+post_save.connect(_object_saved, dispatch_uid="charnames_saved")
+post_delete.connect(_object_deleted, dispatch_uid="charnames_deleted")
+
+
+def create_lower_index():
+    """
+    Create a functional index on `LOWER(db_key)` for the object table, if
+    the database supports it. Does nothing if the index exists.
+
+    """
+    return dbindex.create_lower_index(ObjectDB._meta.db_table, "db_key", LOWER_INDEX_NAME)
+
+
+def at_server_start():
+    """
+    Load the names, and create the index if wanted. Called at server start.
+
+    """
+    if getattr(settings, "CHARNAME_LOWER_INDEX", False):
+        create_lower_index()
+    CHARNAMES.load()
@@ -0,0 +1,179 @@
+"""
+Inventory view
+
+`inventory` used to build one table row per carried object, fetching every
+object's `desc` Attribute on its own. For characters carrying hundreds of
+things that is hundreds of queries and a table nobody can read anyway.
+
+The view here
+
+- groups identical objects (same key and description) into one row with
+  a count (`three Pfeils`),
+- fetches the descriptions of all carried objects in one query,
+- renders only the requested page (`inv 2`) or search result
+  (`inv /suche schwert`),
+
+and keeps the rows and rendered pages on the owner (`ndb`) until something
+enters or leaves the inventory (see the move hooks of `ObjectParent`) or the
+desc of something in it changes. Only the pages of the last search are
+kept.
+
+    table, page, npages = get_view(char).render(cmd.styled_table, page=2)
+
+"""
+from django.db.models.signals import post_save, pre_delete
+
+from evennia.objects.models import ObjectDB
+from evennia.typeclasses.attributes import Attribute
+from evennia.utils.ansi import raw as raw_ansi
+from evennia.utils.utils import crop
+
+PAGE_SIZE = 20
+DESC_WIDTH = 50
+
+
+def prefetch_descs(objs):
+    """
+    Get the `desc` Attribute of many objects in one query.
+
+    Args:
+        objs (list): The objects.
+
+    Returns:
+        dict: `{object id: desc}` for all objects having a desc.
+
+    """
+    if not objs:
+        return {}
+    return dict(
+        Attribute.objects.filter(
+            objectdb__id__in=[obj.id for obj in objs], db_key="desc", db_category__isnull=True
+        ).values_list("objectdb__id", "db_value")
+    )
+
+
+class InventoryView:
+    """
+    Grouped, paginated and cached listing of what one object carries.
+
+    """
+
+    __slots__ = ("obj", "_rows", "_pages", "_search", "_size")
+
+    def __init__(self, obj):
+        self.obj = obj
+        self._rows = None
+        # page -> rendered page, of the search in `_search`
+        self._pages = {}
+        self._search = None
+        self._size = 0
+
+    def invalidate(self):
+        """
+        Forget the rows and rendered pages; called when the inventory changes.
+
+        """
+        self._rows = None
+        self._pages = {}
+
+    @property
+    def rows(self):
+        """
+        The grouped rows as `(search_key, name, desc)`, in inventory order.
+
+        """
+        contents = self.obj.contents
+        if self._rows is not None and len(contents) != self._size:
+            # things were created in/deleted from the inventory directly,
+            # without passing through the move hooks
+            self.invalidate()
+        if self._rows is None:
+            self._size = len(contents)
+            descs = prefetch_descs(contents)
+            groups = {}
+            for item in contents:
+                desc = descs.get(item.id) or ""
+                groups.setdefault((item.key, desc), []).append(item)
+            rows = []
+            for (key, desc), items in groups.items():
+                singular, plural = items[0].get_numbered_name(len(items), self.obj)
+                rows.append(
+                    (
+                        key.lower(),
+                        f"|C{singular if len(items) == 1 else plural}|n",
+                        "{}|n".format(crop(raw_ansi(desc), width=DESC_WIDTH)),
+                    )
+                )
+            self._rows = rows
+        return self._rows
+
+    def render(self, make_table, page=1, search=None):
+        """
+        Render one page of the inventory.
+
+        Args:
+            make_table (callable): Table factory called as
+                `make_table(border="header")`, like `Command.styled_table`.
+            page (int, optional): Page number, starting at 1. Out-of-range
+                numbers are clamped.
+            search (str, optional): Only list rows whose key contains this.
+
+        Returns:
+            tuple: `(table, page, npages)`; `table` is `None` if there
+                is nothing to show.
+
+        """
+        search = search.strip().lower() if search else None
+        rows = self.rows  # first, as it may invalidate the rendered pages
+        if search:
+            rows = [row for row in rows if search in row[0]]
+        npages = max(1, -(-len(rows) // PAGE_SIZE))
+        page = min(max(1, page), npages)
+        if search != self._search:
+            # searches are typed by players; don't pile up pages for each
+            self._pages = {}
+            self._search = search
+        cached = self._pages.get(page)
+        if cached is None:
+            visible = rows[(page - 1) * PAGE_SIZE : page * PAGE_SIZE]
+            table = None
+            if visible:
+                table = make_table(border="header")
+                for _, name, desc in visible:
+                    table.add_row(name, desc)
+                table = str(table)
+            cached = self._pages[page] = (table, page, npages)
+        return cached
+
+
+def get_view(obj):
+    """
+    Get (or create) the cached inventory view of an object.
+
+    """
+    view = obj.ndb._inventory_view
+    if view is None:
+        view = obj.ndb._inventory_view = InventoryView(obj)
+    return view
+
+
+def invalidate(obj):
+    """
+    Mark an object's inventory view as stale, if it has one.
+
+    """
+    view = obj.ndb._inventory_view
+    if view is not None:
+        view.invalidate()
+
+
+def _desc_changed(sender, instance, **kwargs):
+    if instance.db_key != "desc" or instance.db_category or instance.db_model != "objectdb":
+        return
+    for obj in ObjectDB.objects.filter(db_attributes=instance).exclude(db_location=None):
+        invalidate(obj.location)
+
+
+post_save.connect(_desc_changed, sender=Attribute, dispatch_uid="inventory_desc_saved")
+# before, as the links to the objects are gone after
+pre_delete.connect(_desc_changed, sender=Attribute, dispatch_uid="inventory_desc_deleted")
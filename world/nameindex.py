@@ -0,0 +1,207 @@
+"""
+Name index
+
+`caller.search(name, location=room)` asks the database for exact key/alias
+matches among the room contents and, failing that, loads all their keys
+and runs the partial matcher over them. In a loot room with hundreds of
+items that is slow for what is usually an unambiguous `nimm schwert`.
+
+Every location can keep an in-memory index of its contents instead:
+
+- `exact`: lower-case key and aliases -> object ids
+- `prefixes`: every lower-case prefix of every word of a key -> object ids
+
+It is built the first time something is searched for in a location and
+then kept up to date by the `at_object_receive`/`at_object_leave` hooks of
+`ObjectParent` (and dropped when something in it is renamed). Aliases
+added to an object while it lies in an indexed location are not seen until
+the index is rebuilt; call `invalidate(location)` after changing them.
+
+    obj = search(caller, "schwert", caller.location)
+
+`search` only answers when the index gives exactly one unambiguous match
+that `caller.search` would also have returned; everything else (no match,
+multi-matches, `schwert-2`, `me`, dbrefs ...) falls back to the normal
+`caller.search`, including its error messages.
+
+"""
+import re
+
+from django.conf import settings
+
+from evennia.utils.utils import string_partial_matching
+
+_MULTIMATCH_REGEX = re.compile(settings.SEARCH_MULTIMATCH_REGEX, re.I + re.U)
+_SPECIAL_QUERIES = ("me", "self", "here")
+
+
+def _aliases(obj):
+    return [alias.lower() for alias in obj.aliases.all()]
+
+
+class NameIndex:
+    """
+    Name index of the contents of one location.
+
+    """
+
+    __slots__ = ("objects", "exact", "prefixes", "_entries")
+
+    def __init__(self, contents=()):
+        self.objects = {}
+        self.exact = {}
+        self.prefixes = {}
+        # object id -> (exact names, prefixes) it was indexed under
+        self._entries = {}
+        for obj in contents:
+            self.add(obj)
+
+    def add(self, obj):
+        """
+        Index an object that entered the location.
+
+        """
+        if obj.id in self.objects:
+            return
+        self.objects[obj.id] = obj
+        key = obj.key.lower()
+        names = {key, *_aliases(obj)}
+        prefixes = {word[:end] for word in key.split() for end in range(1, len(word) + 1)}
+        self._entries[obj.id] = (names, prefixes)
+        for name in names:
+            self.exact.setdefault(name, set()).add(obj.id)
+        for prefix in prefixes:
+            self.prefixes.setdefault(prefix, set()).add(obj.id)
+
+    def remove(self, obj):
+        """
+        Drop an object that left the location.
+
+        """
+        if self.objects.pop(obj.id, None) is None:
+            return
+        names, prefixes = self._entries.pop(obj.id)
+        for index, entries in ((self.exact, names), (self.prefixes, prefixes)):
+            for name in entries:
+                ids = index[name]
+                ids.discard(obj.id)
+                if not ids:
+                    del index[name]
+
+    def find(self, query):
+        """
+        Look up a lower-case search string, following the same rules as the
+        object search: exact key/alias matches first, then partial matches
+        on the words of the key.
+
+        Args:
+            query (str): The lower-case search string.
+
+        Returns:
+            obj (Object or None): The match, or `None` if there is no match,
+                more than one, or the index can't tell.
+
+        """
+        ids = self.exact.get(query)
+        if ids:
+            return self.objects[next(iter(ids))] if len(ids) == 1 else None
+        words = query.split()
+        if not words or _MULTIMATCH_REGEX.match(query):
+            return None
+        ids = self.prefixes.get(words[0])
+        if not ids:
+            # could still be a partial alias match
+            return None
+        candidates = [self.objects[dbid] for dbid in sorted(ids)]
+        matches = string_partial_matching([obj.key for obj in candidates], query, ret_index=True)
+        return candidates[matches[0]] if len(matches) == 1 else None
+
+    def is_current(self, obj, query):
+        """
+        Check that a hit still matches, in case a key or alias was changed
+        without the index noticing.
+
+        """
+        key = obj.key.lower()
+        return (
+            query == key
+            or query in _aliases(obj)
+            or bool(string_partial_matching([key], query))
+        )
+
+
+def get_index(location):
+    """
+    Get the name index of a location, building it if needed.
+
+    """
+    index = location.ndb._name_index
+    contents = location.contents
+    if index is None or len(index.objects) != len(contents):
+        # first use, or objects were created in/deleted from the location
+        # without passing through the move hooks
+        index = location.ndb._name_index = NameIndex(contents)
+    return index
+
+
+def object_received(location, obj):
+    """
+    Add an object to the location's index, if it has one.
+
+    """
+    index = location.ndb._name_index
+    if index is not None:
+        index.add(obj)
+
+
+def object_left(location, obj):
+    """
+    Remove an object from the location's index, if it has one.
+
+    """
+    index = location.ndb._name_index
+    if index is not None:
+        index.remove(obj)
+
+
+def invalidate(location):
+    """
+    Throw away the index of a location; it is rebuilt on next search.
+
+    """
+    if location and location.ndb._name_index is not None:
+        location.ndb._name_index = None
+
+
+def search(searcher, searchdata, location, **kwargs):
+    """
+    Search the contents of `location` using its name index, falling back to
+    `searcher.search(searchdata, location=location, **kwargs)`.
+
+    Args:
+        searcher (Object): Who is searching.
+        searchdata (str): What to search for.
+        location (Object): Where to search.
+        **kwargs: Passed on to `searcher.search` (`nofound_string` etc).
+
+    Returns:
+        Object, None or list: Like `searcher.search`.
+
+    """
+    if isinstance(searchdata, str) and not kwargs.get("global_search"):
+        # not stripped - the object search doesn't either, so " schwert"
+        # is a partial match while "schwert" can match exactly
+        query = searcher.nicks.nickreplace(
+            searchdata, categories=("object", "account"), include_account=True
+        ).lower()
+        if query.strip() and query not in _SPECIAL_QUERIES and not query.startswith("#"):
+            index = get_index(location)
+            obj = index.find(query)
+            if (
+                obj
+                and obj.location == location
+                and index.is_current(obj, query)
+                and obj.access(searcher, "search", default=True)
+            ):
+                return [obj] if kwargs.get("quiet") else obj
+    return searcher.search(searchdata, location=location, **kwargs)
@@ -0,0 +1,209 @@
+"""
+Compiled nicks
+
+Every line a player types goes through `nicks.nickreplace()`. The default
+handler fetches the nicks category by category (plus those of the account),
+then tries the regex of every single nick against the input in turn - with
+a couple of hundred nicks that is a couple of hundred regex matches per
+command.
+
+`CompiledNickHandler` keeps the nicks of all categories (one query, through
+the Attribute cache) compiled into a single combined regex per set of
+categories:
+
+    (?P<_n0>grin (?P<_n0_arg1>.+?)...\\Z)|(?P<_n1>...)|...
+
+Alternatives are tried left to right, so the first nick that matches wins -
+the same one the default handler would have picked. The compiled regexes are
+kept until a nick is added or removed on the object (or on its account, if
+the account uses this handler too).
+
+"""
+import re
+
+from evennia.typeclasses.attributes import NickHandler
+from evennia.utils import logger
+from evennia.utils.utils import make_iter
+
+_RE_FLAGS = re.I + re.DOTALL + re.U
+_RE_GROUP = re.compile(r"\(\?P([<=])(arg[1-9][0-9]?)")
+
+
+def _prefix_groups(nick_regex, prefix):
+    """
+    Rename the `argN` groups of a nick regex to `<prefix>_argN` so several
+    nicks can live in one regex.
+
+    """
+    return _RE_GROUP.sub(lambda m: f"(?P{m.group(1)}{prefix}_{m.group(2)}", nick_regex)
+
+
+class CompiledNickMatcher:
+    """
+    All nicks of one set of categories, compiled into one regex.
+
+    """
+
+    __slots__ = ("regex", "templates", "fallback")
+
+    def __init__(self, nicks):
+        """
+        Args:
+            nicks (list): `(nick_regex, template)` tuples, in matching order.
+
+        """
+        self.regex = None
+        self.templates = {}
+        self.fallback = None
+        parts = []
+        for num, (nick_regex, template) in enumerate(nicks):
+            name = f"_n{num}"
+            parts.append(f"(?P<{name}>{_prefix_groups(nick_regex, name)})")
+            self.templates[name] = template
+        if not parts:
+            return
+        try:
+            self.regex = re.compile("|".join(parts), _RE_FLAGS)
+        except re.error:
+            # some nick regex doesn't combine; match them one by one instead
+            logger.log_trace("Nicks: could not combine nick regexes, matching one by one.")
+            self.fallback = []
+            for nick_regex, template in nicks:
+                try:
+                    self.fallback.append((re.compile(nick_regex, _RE_FLAGS), template))
+                except re.error:
+                    logger.log_trace("Probably nick being created with unvalidated regex mapping.")
+
+    def replace(self, raw_string):
+        """
+        Returns:
+            str: `raw_string` with the first matching nick applied.
+
+        """
+        if self.fallback is not None:
+            for regex, template in self.fallback:
+                match = regex.match(raw_string)
+                if match:
+                    return template.format_map(
+                        {key: value or "" for key, value in match.groupdict().items()}
+                    )
+            return raw_string
+        if self.regex is None:
+            return raw_string
+        match = self.regex.match(raw_string)
+        if not match:
+            return raw_string
+        name = match.lastgroup
+        offset = len(name) + 1
+        args = {
+            key[offset:]: value or ""
+            for key, value in match.groupdict().items()
+            if key.startswith(name + "_")
+        }
+        return self.templates[name].format_map(args)
+
+
+class CompiledNickHandler(NickHandler):
+    """
+    NickHandler caching the nicks of the object as compiled regexes.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # bumped on every change, so dependent caches know to rebuild
+        self.version = 0
+        self._matchers = {}
+
+    def _changed(self):
+        self.version += 1
+        self._matchers = {}
+
+    def add(self, *args, **kwargs):
+        super().add(*args, **kwargs)
+        self._changed()
+
+    def batch_add(self, *args, **kwargs):
+        super().batch_add(*args, **kwargs)
+        self._changed()
+
+    def remove(self, *args, **kwargs):
+        super().remove(*args, **kwargs)
+        self._changed()
+
+    def clear(self, *args, **kwargs):
+        super().clear(*args, **kwargs)
+        self._changed()
+
+    def reset_cache(self):
+        super().reset_cache()
+        self._changed()
+
+    def by_category(self):
+        """
+        All nicks of the object, loaded with one query.
+
+        Returns:
+            dict: `{category: [nick, ...]}`.
+
+        """
+        nicks = {}
+        for nick in self.all():
+            nicks.setdefault(nick.category, []).append(nick)
+        return nicks
+
+    def _account_handler(self, include_account):
+        if include_account and self.obj.has_account:
+            return self.obj.account.nicks
+        return None
+
+    def get_matcher(self, categories=("inputline", "channel"), include_account=True):
+        """
+        Get the compiled nicks for a set of categories.
+
+        Args:
+            categories (tuple, optional): Nick categories to include.
+            include_account (bool, optional): Also include the account's nicks
+                (these take precedence over the object's ones with the same key).
+
+        Returns:
+            CompiledNickMatcher: The compiled nicks.
+
+        """
+        categories = tuple(make_iter(categories))
+        account_nicks = self._account_handler(include_account)
+        # account nicks can only be cached if we learn when they change
+        account_version = getattr(account_nicks, "version", None)
+        cachekey = (categories, account_nicks is not None)
+        cached = self._matchers.get(cachekey)
+        if cached and (
+            account_nicks is None or (account_version is not None and cached[0] == account_version)
+        ):
+            return cached[1]
+
+        nicks = {}
+        handlers = [self] + ([account_nicks] if account_nicks is not None else [])
+        for handler in handlers:
+            by_category = (
+                handler.by_category()
+                if isinstance(handler, CompiledNickHandler)
+                else {
+                    category: make_iter(handler.get(category=category, return_obj=True))
+                    for category in categories
+                }
+            )
+            for category in categories:
+                nicks.update(
+                    {nick.key: nick for nick in by_category.get(category, ()) if nick and nick.key}
+                )
+        matcher = CompiledNickMatcher([nick.value[:2] for nick in nicks.values()])
+        self._matchers[cachekey] = (account_version, matcher)
+        return matcher
+
+    def nickreplace(self, raw_string, categories=("inputline", "channel"), include_account=True):
+        """
+        Apply nick replacement of entries in raw_string with nick replacement.
+        Same as `NickHandler.nickreplace`, using the compiled nicks.
+
+        """
+        return self.get_matcher(categories, include_account).replace(raw_string)
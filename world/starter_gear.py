@@ -0,0 +1,265 @@
+"""
+Starter gear
+
+Finishing chargen spawned the chosen starter weapon with `spawn()`, which
+validates the prototype, flattens it and resolves every value from scratch
+for each new character, and then adds every Tag and Attribute of the new
+object one by one - several queries each.
+
+Here a prototype is compiled once - validated, flattened and resolved into
+what `spawn()` would create from it - and cached by a hash of its content.
+`spawn_gear()` then creates any number of objects from compiled prototypes
+in one transaction:
+
+- the objects are saved one by one, so all their creation hooks run as with
+  `spawn()`,
+- the Tags are looked up (or created) once for all objects, and their links
+  to the objects inserted in one query,
+- the Attributes are inserted in one query, and their links in another.
+
+Prototypes with callables or protfuncs (`$func(...)`) give another result
+every time, so these are compiled anew for every object instead of cached.
+
+    spawn_gear((proto, char1), (proto, char2))
+
+`precompile()` compiles the chargen prototypes and those of the prototype
+modules ahead of time.
+
+"""
+import hashlib
+import json
+
+from django.db import connection, transaction
+
+import evennia
+from evennia.objects.models import ObjectDB
+from evennia.prototypes import prototypes as protlib
+from evennia.prototypes.spawner import batch_create_object, spawn
+from evennia.typeclasses.attributes import Attribute
+from evennia.typeclasses.tags import Tag
+from evennia.utils import logger
+from evennia.utils.dbserialize import deserialize, to_pickle
+
+# prototype hash -> compiled prototype
+_COMPILED = {}
+
+
+def prototype_hash(prototype):
+    """
+    Returns:
+        str: A hash of the content of a prototype, without its location.
+
+    """
+    content = {key: value for key, value in prototype.items() if key != "location"}
+    return hashlib.md5(
+        json.dumps(content, sort_keys=True, default=repr).encode("utf-8")
+    ).hexdigest()
+
+
+def is_dynamic(value):
+    """
+    Check if a prototype (value) contains callables or protfuncs, which
+    must be resolved every time it's spawned.
+
+    """
+    if callable(value):
+        return True
+    if isinstance(value, str):
+        return "$" in value
+    if isinstance(value, dict):
+        return any(is_dynamic(key) or is_dynamic(val) for key, val in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return any(is_dynamic(val) for val in value)
+    return False
+
+
+def _compile(prototype):
+    prototype = protlib.homogenize_prototype(
+        {key: value for key, value in prototype.items() if key != "location"}
+    )
+    # validates, flattens and resolves, but creates nothing
+    return spawn(prototype, only_validate=True)[0]
+
+
+def compile_prototype(prototype):
+    """
+    Get the compiled form of a prototype, compiling it on first use.
+
+    Args:
+        prototype (dict): The prototype; a `location` in it is ignored.
+
+    Returns:
+        tuple: What `spawn()` creates an object from (see
+            `evennia.prototypes.spawner.batch_create_object`).
+
+    """
+    prototype = deserialize(prototype)
+    if is_dynamic(prototype):
+        return _compile(prototype)
+    key = prototype_hash(prototype)
+    compiled = _COMPILED.get(key)
+    if compiled is None:
+        compiled = _COMPILED[key] = _compile(prototype)
+    return compiled
+
+
+def precompile():
+    """
+    Compile the starter gear of chargen and the prototypes of the prototype
+    modules, so the first new characters don't wait for it.
+
+    Returns:
+        int: The number of prototypes compiled.
+
+    """
+    from world.char_menu import _EXAMPLE_PROTOTYPES
+
+    num = 0
+    for prototype in list(_EXAMPLE_PROTOTYPES) + protlib.search_prototype(no_db=True):
+        try:
+            compile_prototype(prototype)
+            num += 1
+        except Exception as err:
+            logger.log_err(f"Starter gear: could not compile {prototype.get('key')}: {err}")
+    return num
+
+
+def clear_cache():
+    """
+    Forget all compiled prototypes, after the prototypes were edited.
+
+    """
+    _COMPILED.clear()
+
+
+def _tag_id(key, category):
+    # the same case-insensitive key and category `tags.add()` uses
+    return str(key).strip().lower(), str(category).strip().lower() if category else None
+
+
+def _add_tags(objs, taglists):
+    # find the Tags of all objects with one query, create the missing ones
+    wanted = {}
+    for tags in taglists:
+        for key, category, *data in tags:
+            wanted.setdefault(_tag_id(key, category), data[0] if data else None)
+    if not wanted:
+        return
+    found = {
+        (tag.db_key, tag.db_category): tag
+        for tag in Tag.objects.filter(
+            db_key__in={key for key, _ in wanted},
+            db_model="objectdb",
+            db_tagtype__isnull=True,
+        )
+    }
+    for (key, category), data in wanted.items():
+        if (key, category) not in found or data is not None:
+            # also updates the data of an existing Tag, like `tags.add()`
+            found[(key, category)] = ObjectDB.objects.create_tag(
+                key=key, category=category, data=data
+            )
+    through = ObjectDB.db_tags.through
+    rows = []
+    for obj, tags in zip(objs, taglists):
+        tag_ids = {found[_tag_id(key, category)].id for key, category, *_ in tags}
+        rows.extend(through(objectdb_id=obj.id, tag_id=tag_id) for tag_id in tag_ids)
+    # the creation hooks may have added some of them already
+    through.objects.bulk_create(rows, ignore_conflicts=True)
+    for obj in objs:
+        obj.tags.reset_cache()
+
+
+def _add_attributes(objs, attrlists):
+    if not any(attrlists):
+        return
+    # Attributes set by the creation hooks are updated rather than added twice
+    attrlists = [
+        [
+            # the same case-insensitive key and category `attributes.add()` uses
+            (key.strip().lower(), value, category.strip().lower() if category else None, locks)
+            for key, value, category, locks in attrs
+        ]
+        for attrs in attrlists
+    ]
+    existing = set(
+        Attribute.objects.filter(
+            objectdb__in=objs, db_key__in={attr[0] for attrs in attrlists for attr in attrs}
+        ).values_list("objectdb__id", "db_key", "db_category")
+    )
+    new, owners = [], []
+    for obj, attrs in zip(objs, attrlists):
+        for key, value, category, lockstring in attrs:
+            if (obj.id, key, category) in existing:
+                obj.attributes.add(key, value, category=category, lockstring=lockstring or "")
+                continue
+            new.append(
+                Attribute(
+                    db_key=key,
+                    db_category=category,
+                    db_model="objectdb",
+                    db_lock_storage=lockstring or "",
+                    db_attrtype=None,
+                    db_value=to_pickle(value),
+                    db_strvalue=None,
+                )
+            )
+            owners.append(obj)
+    if connection.features.can_return_rows_from_bulk_insert:
+        Attribute.objects.bulk_create(new)
+    else:
+        # no ids back from a bulk insert
+        for attr in new:
+            attr.save()
+    ObjectDB.db_attributes.through.objects.bulk_create(
+        ObjectDB.db_attributes.through(objectdb_id=obj.id, attribute_id=attr.id)
+        for obj, attr in zip(owners, new)
+    )
+    for obj in objs:
+        obj.attributes.reset_cache()
+
+
+def spawn_gear(*requests):
+    """
+    Spawn objects from prototypes, compiled once, all in one transaction.
+
+    Args:
+        *requests (tuple): `(prototype, location)` for every object to
+            spawn; the location (like the new character) overrides the one
+            in the prototype.
+
+    Returns:
+        list: The new objects, in the order of `requests`.
+
+    Notes:
+        The Tags and Attributes of the prototype are added after the
+        creation hooks of the object ran, not during them.
+
+    """
+    params = []
+    for prototype, location in requests:
+        create_kwargs, permissions, locks, aliases, nattributes, attributes, tags, execs = (
+            compile_prototype(prototype)
+        )
+        params.append(
+            (
+                dict(create_kwargs, db_location=location),
+                permissions,
+                locks,
+                aliases,
+                nattributes,
+                attributes,
+                tags,
+                execs,
+            )
+        )
+    with transaction.atomic():
+        # no Tags, Attributes or code yet, these follow for all at once
+        objs = batch_create_object(*(param[:5] + ([], [], []) for param in params))
+        _add_tags(objs, [param[6] for param in params])
+        _add_attributes(objs, [param[5] for param in params])
+        for obj, param in zip(objs, params):
+            for code in param[7]:
+                if code:
+                    exec(code, {}, {"evennia": evennia, "obj": obj})
+    return objs
@@ -0,0 +1,345 @@
+"""
+Stat block
+
+The base values of a Character (staerke, intelligenz, ..., manapunkte) are
+stored together in one packed, versioned record instead of one Attribute
+per value. The record is a single Attribute holding a flat list
+
+    [version, staerke, intelligenz, ...]
+
+so loading all stats of a character is one Attribute fetch and writing back
+any number of changed stats is one Attribute save.
+
+Usage on a typeclass:
+
+    class Character(DefaultCharacter):
+
+        @lazy_property
+        def stats(self):
+            return StatBlock(self)
+
+        staerke = StatProperty("staerke")
+
+    char.staerke += 1             # one write
+
+    with char.stats.batch():      # one write for all three
+        char.level += 1
+        char.erfahrungspunke = 0
+        char.lebenspunkte = 60
+
+Every change calls `at_stat_change(name)` on the owner, if defined, so
+caches of derived output (like the status sheet) can be invalidated.
+
+Characters created before the stat block existed still have their values in
+separate Attributes. These are picked up the first time the stat block is
+loaded; `migrate_legacy_stats` converts all characters in one go and removes
+the old Attributes (see the `statmigrate` command).
+
+"""
+from contextlib import contextmanager
+
+from evennia.typeclasses.attributes import Attribute
+from evennia.utils import logger
+
+STATBLOCK_KEY = "statblock"
+STATBLOCK_CATEGORY = "statblock"
+
+# bump this when appending fields to STAT_FIELDS
+STATBLOCK_VERSION = 1
+
+# (name, default, legacy Attribute category)
+# The order is the storage layout of the packed record - only ever append to this!
+STAT_FIELDS = (
+    # basiswerte
+    ("staerke", 1, "stat"),
+    ("intelligenz", 1, "stat"),
+    ("schnelligkeit", 1, "stat"),
+    ("weissheit", 1, "stat"),
+    ("ausdauer", 1, "stat"),
+    ("willenskraft", 1, "stat"),
+    ("vitalitaet", 1, "stat"),
+    ("aura", 1, "stat"),
+    ("konsentrazion", 1, "stat"),
+    # level
+    ("level", 1, "lvl"),
+    ("erfahrungspunke", 0, "lvl"),
+    # herkunft
+    ("rasse", "none", "rasse"),
+    ("rang", "none", "rang"),
+    # werte
+    ("lebenspunkte", 50, "werte"),
+    ("zauberpunke", 30, "werte"),
+    ("aktionspunke", 30, "werte"),
+    ("manapunkte", 2500, "werte"),
+)
+
+STAT_NAMES = tuple(name for name, _, _ in STAT_FIELDS)
+STAT_DEFAULTS = tuple(default for _, default, _ in STAT_FIELDS)
+LEGACY_CATEGORIES = tuple(sorted(set(category for _, _, category in STAT_FIELDS)))
+
+_FIELD_INDEX = {name: index for index, name in enumerate(STAT_NAMES)}
+
+
+def _unpack(record):
+    """
+    Turn a stored record into a full list of values, upgrading older
+    versions by filling in defaults for fields appended since.
+
+    Args:
+        record (list): The stored `[version, value, ...]` record.
+
+    Returns:
+        unpacked (tuple or None): `(version, values, extra)` - the version
+            to save the record as, one value per entry in `STAT_FIELDS` and
+            the values of fields appended by a newer version of the game.
+            `None` if the record is unusable.
+
+    """
+    if not record:
+        return None
+    version, values = record[0], list(record[1:])
+    if version > STATBLOCK_VERSION:
+        # stored by a newer version of the game; keep its version and the
+        # fields we don't know, so saving doesn't lose them
+        logger.log_warn(f"StatBlock: record version {version} is newer than {STATBLOCK_VERSION}.")
+        return version, values[: len(STAT_FIELDS)], values[len(STAT_FIELDS) :]
+    if len(values) < len(STAT_FIELDS):
+        values.extend(STAT_DEFAULTS[len(values) :])
+    return STATBLOCK_VERSION, values, []
+
+
+def _legacy_attributes(obj):
+    """
+    Get the pre-statblock per-stat Attributes of an object. This goes
+    through the (fully cached) `attributes.all()`, so it is one query at most.
+
+    """
+    return [
+        attr
+        for attr in obj.attributes.all()
+        if attr.category in LEGACY_CATEGORIES and attr.key in _FIELD_INDEX
+    ]
+
+
+class StatBlock:
+    """
+    Handler holding the packed stat record of one object.
+
+    Each stat is available as a slot-backed property (`stats.staerke`), but
+    the values themselves live in one flat list mirroring the stored record.
+
+    """
+
+    __slots__ = ("obj", "_values", "_version", "_extra", "_dirty", "_batch_depth")
+
+    def __init__(self, obj):
+        self.obj = obj
+        self._values = None
+        # stored version, and fields of a newer version, written back as-is
+        self._version = STATBLOCK_VERSION
+        self._extra = []
+        self._dirty = set()
+        self._batch_depth = 0
+
+    def _load(self):
+        """
+        Fetch the packed record; falls back to (and converts) the legacy
+        one-Attribute-per-stat layout if no record exists yet.
+
+        """
+        unpacked = _unpack(self.obj.attributes.get(STATBLOCK_KEY, category=STATBLOCK_CATEGORY))
+        if unpacked is None:
+            self._version, self._extra = STATBLOCK_VERSION, []
+            legacy = _legacy_attributes(self.obj)
+            values = self._values = self._pack_legacy(legacy)
+            if legacy:
+                # store the converted record right away; the old Attributes
+                # are left for migrate_legacy_stats to clean up
+                self._dirty.update(range(len(STAT_FIELDS)))
+                self.save()
+        else:
+            self._version, values, self._extra = unpacked
+            self._values = values
+        return values
+
+    @staticmethod
+    def _pack_legacy(legacy):
+        """
+        Build values from Attributes stored in the pre-statblock layout.
+
+        """
+        attrs = {(attr.key, attr.category): attr.value for attr in legacy}
+        return [attrs.get((name, category), default) for name, default, category in STAT_FIELDS]
+
+    @property
+    def values(self):
+        """The unpacked values, loaded on first access."""
+        return self._values if self._values is not None else self._load()
+
+    def load(self):
+        """
+        Load the record now rather than on first access, converting (and
+        storing) the legacy layout if there is no record yet.
+
+        Returns:
+            values (list): The unpacked values.
+
+        """
+        return self.values
+
+    def get(self, name):
+        """
+        Get a stat by name.
+
+        Args:
+            name (str): The stat name, like `"staerke"`.
+
+        Returns:
+            value (any): The current value.
+
+        Raises:
+            KeyError: If there is no such stat.
+
+        """
+        return self.values[_FIELD_INDEX[name]]
+
+    def set(self, name, value):
+        """
+        Set a stat by name. This is saved immediately unless inside a `batch()`.
+
+        Args:
+            name (str): The stat name, like `"staerke"`.
+            value (any): The new value.
+
+        Raises:
+            KeyError: If there is no such stat.
+
+        """
+        index = _FIELD_INDEX[name]
+        values = self.values
+        if values[index] == value:
+            return
+        values[index] = value
+        self._dirty.add(index)
+        if not self._batch_depth:
+            self.save()
+        self._notify(name)
+
+    def all(self):
+        """
+        Returns:
+            stats (dict): All stats as `{name: value}`.
+
+        """
+        return dict(zip(STAT_NAMES, self.values))
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager collecting all stat changes made inside it into one
+        write when the outermost batch exits.
+
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.save()
+
+    def save(self):
+        """
+        Write the record back if any field changed since the last save.
+
+        """
+        if not self._dirty or self._values is None:
+            return
+        self.obj.attributes.add(
+            STATBLOCK_KEY,
+            [self._version] + self._values + self._extra,
+            category=STATBLOCK_CATEGORY,
+        )
+        self._dirty.clear()
+
+    def reset_cache(self):
+        """
+        Forget the loaded values; they are re-read on next access.
+
+        """
+        self._values = None
+        self._dirty.clear()
+        self._notify(None)
+
+    def _notify(self, name):
+        """
+        Call the owner's `at_stat_change(name)` hook, if it has one. A `name`
+        of `None` means any stat may have changed.
+
+        """
+        hook = getattr(self.obj, "at_stat_change", None)
+        if hook:
+            hook(name)
+
+
+def _make_accessor(name):
+    index = _FIELD_INDEX[name]
+
+    def _get(self):
+        return self.values[index]
+
+    def _set(self, value):
+        self.set(name, value)
+
+    return property(_get, _set, doc=f"The `{name}` stat.")
+
+
+for _name in STAT_NAMES:
+    setattr(StatBlock, _name, _make_accessor(_name))
+
+
+class StatProperty:
+    """
+    Descriptor exposing one stat of the owner's `stats` handler as a plain
+    attribute, keeping `char.staerke` working as with `AttributeProperty`.
+
+    """
+
+    def __init__(self, name):
+        if name not in _FIELD_INDEX:
+            raise KeyError(f"StatProperty: unknown stat '{name}'.")
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.stats.get(self.name)
+
+    def __set__(self, instance, value):
+        instance.stats.set(self.name, value)
+
+
+def migrate_legacy_stats(objs):
+    """
+    Pack the legacy per-stat Attributes of the given objects into stat blocks
+    and delete the old Attributes.
+
+    Args:
+        objs (iterable): Objects with a `stats` handler.
+
+    Returns:
+        migrated (int): How many objects had legacy Attributes converted.
+
+    """
+    migrated = 0
+    for obj in objs:
+        legacy = _legacy_attributes(obj)
+        if not legacy:
+            continue
+        # converts the legacy values unless a record exists already, in
+        # which case the record is authoritative
+        obj.stats.load()
+        Attribute.objects.filter(id__in=[attr.id for attr in legacy]).delete()
+        obj.attributes.reset_cache()
+        migrated += 1
+    return migrated
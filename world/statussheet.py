@@ -0,0 +1,180 @@
+"""
+Status sheet
+
+Cached rendering of the `spielerstatus` sheet. The template is split into
+its literal text and its value cells once, at import. Every character gets
+a `StatusSheet` (on `ndb`) that memoizes the rendered cells and the final
+output; when a stat changes only the cells showing that stat are marked
+stale and re-rendered on the next look.
+
+    text = get_sheet(char).render()
+
+Cache hits and misses are counted module-wide and can be viewed with the
+`statuscache` admin command.
+
+"""
+from string import Formatter
+
+SHEET_TEMPLATE = """
++-----------------------------------------------------------------------------+
+|  Name: {name:60}         |
++-----------------------------------------------------------------------------+
+|  Staerke      :{sta:3d}        Intelligenz :{int:3d}        Weissheit     :{wei:3d}        |
+|  Ausdauer     :{ausd:3d}        Vitalitaet  :{vit:3d}        konsentrazion :{kons:3d}        |
+|  Schnelligkeit:{schn:3d}        Aura        :{aur:3d}        Willenskraft  :{will:3d}        |
++-----------------------------------------------------------------------------+
+|  lebenspunkte  :                                                            |
+|  Aktionspunkte :                                                            |
+|  Zauberpunkte  :                                                            |
+|  Manapunkte    :                                                            |
++-----------------------------------------------------------------------------+
+|  Rasse : {rasse:15}        Rang : {rang:30}       |
++-----------------------------------------------------------------------------+
+|  Level :{lvl:3d}                Erfahrungspunkte: {ep:30d} |
++-----------------------------------------------------------------------------+ 
+                                                                   
+        """
+
+# template field -> the Character property it shows
+SHEET_FIELDS = {
+    "name": "name",
+    "sta": "staerke",
+    "int": "intelligenz",
+    "wei": "weissheit",
+    "ausd": "ausdauer",
+    "vit": "vitalitaet",
+    "kons": "konsentrazion",
+    "schn": "schnelligkeit",
+    "aur": "aura",
+    "will": "willenskraft",
+    "rasse": "rasse",
+    "rang": "rang",
+    "lvl": "level",
+    "ep": "erfahrungspunke",
+}
+
+
+def _compile(template):
+    """
+    Split a format template into literal parts and cells.
+
+    Returns:
+        tuple: `(literals, cells)` where `literals` has one more entry than
+            `cells` and each cell is `(source_property, format_spec)`.
+
+    """
+    literals, cells = [], []
+    pending = ""
+    for literal, field, spec, _ in Formatter().parse(template):
+        pending += literal
+        if field is None:
+            continue
+        literals.append(pending)
+        cells.append((SHEET_FIELDS[field], spec))
+        pending = ""
+    literals.append(pending)
+    return tuple(literals), tuple(cells)
+
+
+_LITERALS, _CELLS = _compile(SHEET_TEMPLATE)
+
+# property name -> indices of the cells showing it
+_CELL_INDEX = {}
+for _index, (_source, _) in enumerate(_CELLS):
+    _CELL_INDEX.setdefault(_source, []).append(_index)
+
+_CACHE_STATS = {"hits": 0, "misses": 0, "cells": 0}
+
+
+class StatusSheet:
+    """
+    The memoized status sheet of one character.
+
+    """
+
+    __slots__ = ("obj", "_cells", "_output")
+
+    def __init__(self, obj):
+        self.obj = obj
+        self._cells = [None] * len(_CELLS)
+        self._output = None
+
+    def invalidate(self, name=None):
+        """
+        Mark the cells showing a property as stale.
+
+        Args:
+            name (str, optional): The changed property. If not given, the
+                whole sheet is re-rendered next time.
+
+        """
+        if name is None:
+            self._cells = [None] * len(_CELLS)
+        elif name in _CELL_INDEX:
+            for index in _CELL_INDEX[name]:
+                self._cells[index] = None
+        else:
+            return
+        self._output = None
+
+    def render(self):
+        """
+        Returns:
+            str: The sheet, re-rendering only stale cells.
+
+        """
+        if self._output is not None:
+            _CACHE_STATS["hits"] += 1
+            return self._output
+        _CACHE_STATS["misses"] += 1
+        obj, cells = self.obj, self._cells
+        for index, cell in enumerate(cells):
+            if cell is None:
+                source, spec = _CELLS[index]
+                cells[index] = format(getattr(obj, source), spec)
+                _CACHE_STATS["cells"] += 1
+        parts = [_LITERALS[0]]
+        for cell, literal in zip(cells, _LITERALS[1:]):
+            parts.append(cell)
+            parts.append(literal)
+        self._output = "".join(parts)
+        return self._output
+
+
+def get_sheet(obj):
+    """
+    Get (or create) the cached status sheet of an object.
+
+    """
+    sheet = obj.ndb._status_sheet
+    if sheet is None:
+        sheet = obj.ndb._status_sheet = StatusSheet(obj)
+    return sheet
+
+
+def invalidate(obj, name=None):
+    """
+    Mark cells of an object's status sheet as stale, if it has one.
+
+    """
+    sheet = obj.ndb._status_sheet
+    if sheet is not None:
+        sheet.invalidate(name)
+
+
+def cache_stats():
+    """
+    Returns:
+        dict: Copy of the `hits`, `misses` and re-rendered `cells` counters.
+
+    """
+    return dict(_CACHE_STATS)
+
+
+def reset_cache_stats():
+    """
+    Zero the hit/miss counters.
+
+    """
+    for key in _CACHE_STATS:
+        _CACHE_STATS[key] = 0
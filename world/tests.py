@@ -0,0 +1,763 @@
+"""
+Tests for the world systems.
+
+"""
+
+import os
+import threading
+import time
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, PropertyMock, patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from evennia.objects.models import ObjectDB
+from evennia.prototypes.spawner import spawn
+from evennia.typeclasses.attributes import ModelAttributeBackend, NickHandler
+from evennia.utils import create
+from evennia.utils.test_resources import EvenniaTest
+
+from server.benchmarks import benchmark, compare
+from typeclasses.accounts import Guest
+
+from . import (
+    broadcast,
+    char_menu,
+    chargen_draft,
+    charnames,
+    nameindex,
+    nicks,
+    starter_gear,
+    statblock,
+    statussheet,
+    who,
+)
+
+
+class TestStatBlock(EvenniaTest):
+    def test_defaults(self):
+        self.assertEqual(self.char1.staerke, 1)
+        self.assertEqual(self.char1.rasse, "none")
+        self.assertEqual(self.char1.manapunkte, 2500)
+        # nothing is stored until a stat changes
+        self.assertFalse(
+            self.char1.attributes.has(statblock.STATBLOCK_KEY, category=statblock.STATBLOCK_CATEGORY)
+        )
+
+    def test_set_packs_into_one_attribute(self):
+        self.char1.staerke = 5
+        self.char1.rasse = "Zwerg"
+        record = self.char1.attributes.get(
+            statblock.STATBLOCK_KEY, category=statblock.STATBLOCK_CATEGORY
+        )
+        self.assertEqual(record[0], statblock.STATBLOCK_VERSION)
+        self.assertEqual(len(record), len(statblock.STAT_FIELDS) + 1)
+        self.char1.stats.reset_cache()
+        self.assertEqual(self.char1.staerke, 5)
+        self.assertEqual(self.char1.rasse, "Zwerg")
+
+    def test_batch_writes_once(self):
+        with self.char1.stats.batch():
+            self.char1.level = 2
+            self.char1.erfahrungspunke = 10
+            self.assertFalse(
+                self.char1.attributes.has(
+                    statblock.STATBLOCK_KEY, category=statblock.STATBLOCK_CATEGORY
+                )
+            )
+        self.char1.stats.reset_cache()
+        self.assertEqual((self.char1.level, self.char1.erfahrungspunke), (2, 10))
+
+    def test_old_record_version_is_upgraded(self):
+        self.char1.attributes.add(
+            statblock.STATBLOCK_KEY, [1, 7, 8], category=statblock.STATBLOCK_CATEGORY
+        )
+        self.char1.stats.reset_cache()
+        self.assertEqual(self.char1.staerke, 7)
+        self.assertEqual(self.char1.intelligenz, 8)
+        self.assertEqual(self.char1.manapunkte, 2500)
+
+    def test_newer_record_kept(self):
+        newer = statblock.STATBLOCK_VERSION + 1
+        record = [newer, 7] + list(statblock.STAT_DEFAULTS[1:]) + ["neu", 42]
+        self.char1.attributes.add(
+            statblock.STATBLOCK_KEY, record, category=statblock.STATBLOCK_CATEGORY
+        )
+        self.char1.stats.reset_cache()
+        self.assertEqual(self.char1.staerke, 7)
+        self.char1.staerke = 8
+        record[1] = 8
+        self.assertEqual(
+            self.char1.attributes.get(
+                statblock.STATBLOCK_KEY, category=statblock.STATBLOCK_CATEGORY
+            ),
+            record,
+        )
+
+    def test_migrate_legacy_attributes(self):
+        self.char1.attributes.add("staerke", 12, category="stat")
+        self.char1.attributes.add("rasse", "Elf", category="rasse")
+        self.char1.stats.reset_cache()
+
+        self.assertEqual(statblock.migrate_legacy_stats([self.char1, self.char2]), 1)
+        self.assertFalse(self.char1.attributes.has("staerke", category="stat"))
+        self.assertFalse(self.char1.attributes.has("rasse", category="rasse"))
+        self.char1.stats.reset_cache()
+        self.assertEqual(self.char1.staerke, 12)
+        self.assertEqual(self.char1.rasse, "Elf")
+        self.assertEqual(self.char1.level, 1)
+
+
+class TestStatusSheet(EvenniaTest):
+    def setUp(self):
+        super().setUp()
+        statussheet.reset_cache_stats()
+
+    def test_render_matches_template(self):
+        self.char1.staerke = 4
+        expected = statussheet.SHEET_TEMPLATE.format(
+            name=self.char1.name,
+            sta=4,
+            int=1,
+            wei=1,
+            ausd=1,
+            vit=1,
+            kons=1,
+            schn=1,
+            aur=1,
+            will=1,
+            rasse="none",
+            rang="none",
+            lvl=1,
+            ep=0,
+        )
+        self.assertEqual(statussheet.get_sheet(self.char1).render(), expected)
+
+    def test_memoized_until_stat_changes(self):
+        sheet = statussheet.get_sheet(self.char1)
+        first = sheet.render()
+        self.assertIs(sheet.render(), first)
+        self.assertEqual(statussheet.cache_stats()["hits"], 1)
+
+        self.char1.level = 7
+        cells = statussheet.cache_stats()["cells"]
+        self.assertIn("Level :  7", sheet.render())
+        # only the level cell was re-rendered
+        self.assertEqual(statussheet.cache_stats()["cells"], cells + 1)
+        self.assertEqual(statussheet.cache_stats()["misses"], 2)
+
+    def test_rename_invalidates_name(self):
+        sheet = statussheet.get_sheet(self.char1)
+        sheet.render()
+        self.char1.key = "Gimli"
+        self.assertIn("Name: Gimli", sheet.render())
+
+
+class TestBroadcast(EvenniaTest):
+    def _groups(self, template, mapping=None):
+        mapping = mapping or {}
+        mapping.setdefault(self.char1, self.char1)
+        return broadcast.group_receivers(template, self.room1.contents, self.char1, mapping)
+
+    def test_bystanders_rendered_once(self):
+        self.char2.permissions.clear()
+        parser = broadcast._MSG_CONTENTS_PARSER
+        with patch.object(parser, "parse", wraps=parser.parse) as parse:
+            groups = self._groups("$You() $conj(grin).")
+        # one rendering for the actor, one for everybody else
+        self.assertEqual(parse.call_count, 2)
+        self.assertEqual(groups["You grin."], [self.char1])
+        bystanders = groups[f"{self.char1.name} grins."]
+        self.assertIn(self.char2, bystanders)
+        self.assertIn(self.obj1, bystanders)
+
+    def test_builders_see_their_own_version(self):
+        self.char2.account.permissions.add("Builder")
+        groups = self._groups("$You() $conj(grin).")
+        self.assertEqual(groups[f"{self.char1.name}(#{self.char1.id}) grins."], [self.char2])
+
+    def test_plain_text_is_not_parsed(self):
+        parser = broadcast._MSG_CONTENTS_PARSER
+        with patch.object(parser, "parse") as parse:
+            groups = self._groups("Es regnet.")
+        parse.assert_not_called()
+        self.assertEqual(list(groups), ["Es regnet."])
+
+    def test_one_payload_per_group(self):
+        self.char2.permissions.clear()
+        amp = MagicMock()
+        with patch.object(self.char1, "msg") as actor_msg, patch.object(
+            self.char2.sessions, "all", return_value=[self.session, self.session]
+        ), patch.object(broadcast.SESSIONS, "server") as server, patch.object(
+            broadcast.SESSIONS, "clean_senddata", wraps=broadcast.SESSIONS.clean_senddata
+        ) as clean:
+            server.amp_protocol = amp
+            self.room1.msg_contents("$You() $conj(grin).", from_obj=self.char1)
+        actor_msg.assert_called_once_with(text=("You grin.", {}), from_obj=self.char1)
+        clean.assert_called_once()
+        self.assertEqual(amp.send_MsgServer2Portal.call_count, 2)
+        self.assertEqual(
+            amp.send_MsgServer2Portal.call_args.kwargs["text"][0][0],
+            f"{self.char1.name} grins.",
+        )
+
+    def test_resolve_names(self):
+        with patch.object(self.char1, "search", wraps=self.char1.search) as search:
+            found = broadcast.resolve_names(self.char1, ["char2", "Obj", "CHAR2", "Obj2"])
+        self.assertEqual(found, [self.char2, self.obj1, self.obj2])
+        search.assert_not_called()
+        with patch.object(self.char1, "msg"):
+            self.assertEqual(broadcast.resolve_names(self.char1, ["gibtsnicht"]), [])
+
+    def test_whisper_formats_once_per_output(self):
+        self.char2.permissions.clear()
+        with patch.object(self.char1, "msg") as own, patch.object(
+            self.char2, "msg"
+        ) as msg2, patch.object(self.obj1, "msg") as msg1:
+            broadcast.whisper(self.char1, "psst", [self.char2, self.obj1])
+        names = ", ".join(obj.get_display_name(self.char1) for obj in (self.char2, self.obj1))
+        own.assert_called_once_with(
+            text=(f'You whisper to {names}, "|npsst|n"', {"type": "whisper"}), from_obj=self.char1
+        )
+        expected = (f'{self.char1.name} whispers: "|npsst|n"', {"type": "whisper"})
+        msg2.assert_called_once_with(text=expected, from_obj=self.char1)
+        msg1.assert_called_once_with(text=expected, from_obj=self.char1)
+
+
+class TestNameIndex(EvenniaTest):
+    def setUp(self):
+        super().setUp()
+        self.sword = create.create_object(
+            "typeclasses.objects.Object", key="rostiges Schwert", location=self.room1
+        )
+        self.scabbard = create.create_object(
+            "typeclasses.objects.Object", key="Scheide", location=self.room1, aliases=["huelle"]
+        )
+
+    def _search(self, query, **kwargs):
+        with patch.object(self.char1, "search", wraps=self.char1.search) as search:
+            result = nameindex.search(self.char1, query, self.room1, **kwargs)
+        return result, search.called
+
+    def test_exact_and_partial_hits_skip_search(self):
+        self.assertEqual(self._search("Scheide"), (self.scabbard, False))
+        self.assertEqual(self._search("huelle"), (self.scabbard, False))
+        self.assertEqual(self._search(" schw"), (self.sword, False))
+        self.assertEqual(self._search("rost schw", quiet=True), ([self.sword], False))
+        for query in ("Scheide", "huelle", " schw", "rost schw"):
+            self.assertEqual(
+                nameindex.search(self.char1, query, self.room1),
+                self.char1.search(query, location=self.room1),
+            )
+
+    def test_ambiguous_falls_back(self):
+        # "sch" starts both "Schwert" and "Scheide"
+        with patch.object(self.char1, "msg"):
+            self.assertEqual(self._search("sch"), (None, True))
+        self.assertEqual(self._search("me"), (self.char1, True))
+
+    def test_index_follows_moves_and_renames(self):
+        index = nameindex.get_index(self.room1)
+        self.sword.move_to(self.char1, quiet=True)
+        self.assertIs(nameindex.get_index(self.room1), index)
+        self.assertNotIn(self.sword.id, index.objects)
+        self.assertEqual(self._search("sch"), (self.scabbard, False))
+        self.sword.move_to(self.room1, quiet=True)
+        self.assertIn("rostiges schwert", index.exact)
+
+        self.scabbard.key = "Koecher"
+        self.assertIsNone(self.room1.ndb._name_index)
+        self.assertEqual(self._search("koe"), (self.scabbard, False))
+
+
+class TestCompiledNicks(EvenniaTest):
+    INPUTS = (
+        "gr Bob",
+        "gr Bob Alice",
+        "hi",
+        "HI",
+        "hiho",
+        "tm hallo du",
+        "build Kiste Holz",
+        "zz1",
+        "zzz",
+        "nichts passendes",
+        "",
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.char1.nicks.add("gr $1", "emote grinst $1 an")
+        self.char1.nicks.add("hi", "sag Hallo!")
+        self.char1.nicks.add("tm $1", "fluester tallman = $1")
+        self.char1.nicks.add("build $1 $2", "create/drop $1;$2")
+        self.char1.nicks.add("zz?", "sag Glob!")
+        self.char1.nicks.add("tom", "der grosse Mann", category="object")
+        self.char1.nicks.add(r"sch(?P<arg1>\d)", "sag $1", pattern_is_regex=True)
+
+    def _plain(self, obj):
+        return NickHandler(obj, ModelAttributeBackend)
+
+    def test_same_result_as_default_handler(self):
+        plain = self._plain(self.char1)
+        for raw_string in self.INPUTS + ("sch5", "tom"):
+            for categories in (("inputline", "channel"), ("object",)):
+                with self.subTest(raw_string=raw_string, categories=categories):
+                    self.assertEqual(
+                        self.char1.nicks.nickreplace(raw_string, categories=categories),
+                        plain.nickreplace(raw_string, categories=categories),
+                    )
+
+    def test_cached_until_changed(self):
+        matcher = self.char1.nicks.get_matcher()
+        self.assertIs(self.char1.nicks.get_matcher(), matcher)
+        self.char1.nicks.add("yo", "sag Yo!")
+        self.assertIsNot(self.char1.nicks.get_matcher(), matcher)
+        self.assertEqual(self.char1.nicks.nickreplace("yo"), "sag Yo!")
+        self.char1.nicks.remove("yo")
+        self.assertEqual(self.char1.nicks.nickreplace("yo"), "yo")
+
+    def test_account_nicks(self):
+        self.assertIsInstance(self.char1.account.nicks, nicks.CompiledNickHandler)
+        with patch.object(
+            type(self.char1), "has_account", new_callable=PropertyMock, return_value=True
+        ):
+            self.assertEqual(self.char1.nicks.nickreplace("hi"), "sag Hallo!")
+            self.char1.account.nicks.add("hi", "sag Servus!")
+            # the account's nick wins, and its change is noticed
+            self.assertEqual(self.char1.nicks.nickreplace("hi"), "sag Servus!")
+
+    def test_guest_nicks_cached(self):
+        guest = create.create_account("Gast1", None, "Wurzelbrot77", typeclass=Guest)
+        self.addCleanup(guest.delete)
+        self.assertIsInstance(guest.nicks, nicks.CompiledNickHandler)
+        with patch.object(
+            type(self.char1), "has_account", new_callable=PropertyMock, return_value=True
+        ), patch.object(
+            type(self.char1), "account", new_callable=PropertyMock, return_value=guest
+        ):
+            matcher = self.char1.nicks.get_matcher()
+            self.assertIs(self.char1.nicks.get_matcher(), matcher)
+
+    def _add_200_nicks(self):
+        for num in range(200):
+            self.char1.nicks.add(f"k{num} $1", f"sag {num} $1")
+        return ("k199 hallo", "schau", "k5 du", "nimm schwert")
+
+    def test_200_nicks_one_regex(self):
+        inputs = self._add_200_nicks()
+        plain = self._plain(self.char1)
+        self.assertEqual(
+            [self.char1.nicks.nickreplace(raw) for raw in inputs],
+            [plain.nickreplace(raw) for raw in inputs],
+        )
+        matcher = self.char1.nicks.get_matcher()
+        # one regex match per command, not one per nick
+        self.assertIsNotNone(matcher.regex)
+        self.assertIsNone(matcher.fallback)
+        with self.assertNumQueries(0):
+            for raw_string in inputs:
+                self.char1.nicks.nickreplace(raw_string)
+        self.assertIs(self.char1.nicks.get_matcher(), matcher)
+
+    @benchmark
+    def test_benchmark_200_nicks(self):
+        inputs = self._add_200_nicks()
+        plain = self._plain(self.char1)
+
+        def run(handler):
+            for raw_string in inputs:
+                handler.nickreplace(raw_string)
+
+        times = compare(
+            f"nickreplace, {len(inputs)} commands, 200 nicks",
+            20,
+            compiled=lambda: run(self.char1.nicks),
+            default=lambda: run(plain),
+        )
+        self.assertLess(times["compiled"], times["default"])
+
+
+class TestWho(EvenniaTest):
+    def setUp(self):
+        super().setUp()
+        self.roster = who.Roster()
+        self.handler = {}
+        patcher = patch("evennia.SESSION_HANDLER", new=MagicMock())
+        self.addCleanup(patcher.stop)
+        mock_handler = patcher.start()
+        mock_handler.get_sessions.side_effect = lambda: list(self.handler.values())
+        mock_handler.__contains__.side_effect = lambda sessid: sessid in self.handler
+
+    def _session(self, sessid, key):
+        account = MagicMock(key=key)
+        account.get_display_name.return_value = key
+        session = MagicMock(
+            sessid=sessid,
+            account=account,
+            puppet=None,
+            logged_in=True,
+            conn_time=0,
+            cmd_last_visible=0,
+            cmd_total=0,
+            protocol_key="telnet",
+            address="127.0.0.1",
+        )
+        self.handler[sessid] = session
+        return session
+
+    def _table(self, *headers):
+        table = MagicMock()
+        rows = []
+        table.add_row.side_effect = lambda *row: rows.append(row[0])
+        table.__str__ = lambda _: ",".join(rows)
+        return table
+
+    def test_sorted_incremental(self):
+        self._session(1, "Zora")
+        self._session(2, "Anton")
+        self.assertEqual([sess.account.key for sess in self.roster.sessions()], ["Anton", "Zora"])
+        self.roster.add(self._session(3, "Mia"))
+        self.assertEqual(
+            [sess.account.key for sess in self.roster.sessions()], ["Anton", "Mia", "Zora"]
+        )
+        del self.handler[2]
+        self.roster.remove_disconnected()
+        self.assertEqual([sess.account.key for sess in self.roster.sessions()], ["Mia", "Zora"])
+
+    def test_render_cached_per_bucket(self):
+        self._session(1, "Zora")
+        self._session(2, "Anton")
+        make_table = MagicMock(side_effect=self._table)
+        text = self.roster.render(False, self.account, make_table, now=100)
+        self.assertIn("Anton,Zora", text)
+        self.assertIn("2 unique accounts logged in.", text)
+        self.assertEqual(self.roster.render(False, self.account, make_table, now=101), text)
+        self.assertEqual(make_table.call_count, 1)
+        # the staff view is cached separately
+        self.roster.render(True, self.account, make_table, now=101)
+        self.assertEqual(make_table.call_count, 2)
+        # a new time bucket renders again
+        self.roster.render(False, self.account, make_table, now=100 + who.BUCKET_SECONDS)
+        self.assertEqual(make_table.call_count, 3)
+
+    def test_render_invalidated_on_change(self):
+        self._session(1, "Zora")
+        make_table = MagicMock(side_effect=self._table)
+        self.assertIn("One unique account", self.roster.render(False, self.account, make_table, 0))
+        self.roster.add(self._session(2, "Anton"))
+        self.assertIn("Anton,Zora", self.roster.render(False, self.account, make_table, 0))
+        self.assertEqual(make_table.call_count, 2)
+
+    def test_parse_options(self):
+        self.assertIsNone(who.parse_options(" "))
+        self.assertEqual(
+            who.parse_options(" /raum /idle>10m /seite 3"),
+            {"room": True, "idle": (">", 600), "page": 3},
+        )
+        self.assertEqual(who.parse_options("/idle < 30s")["idle"], ("<", 30))
+        for text in ("/foo", "/seite", "/idle", "bob", "/raum x"):
+            with self.assertRaises(ValueError):
+                who.parse_options(text)
+
+    def test_filter_sessions(self):
+        idle = self._session(1, "Anton")
+        busy = self._session(2, "Bea")
+        busy.cmd_last_visible = 1000
+        busy.puppet = self.char1
+        sessions = self.roster.sessions()
+        self.assertEqual(who.filter_sessions(sessions, 1000, idle=(">", 600)), [idle])
+        self.assertEqual(who.filter_sessions(sessions, 1000, idle=("<", 600)), [busy])
+        self.assertEqual(who.filter_sessions(sessions, 1000, location=self.room1), [busy])
+
+    def test_pager_builds_shown_page_only(self):
+        for num in range(who.PAGE_SIZE * 3):
+            self._session(num + 1, f"Spieler{num:03}")
+        make_table = MagicMock(side_effect=self._table)
+        self.account.msg = MagicMock()
+        pager = who.WhoPager(
+            self.account, self.roster.sessions(), False, make_table, 0, page=2, session=self.session
+        )
+        self.assertEqual(make_table.call_count, 1)
+        text = self.account.msg.call_args[1]["text"]
+        self.assertIn(f"Spieler{who.PAGE_SIZE:03}", text)
+        self.assertNotIn("Spieler000", text)
+        self.assertIn("60 unique accounts found.", text)
+        pager.page_next()
+        self.assertEqual(make_table.call_count, 2)
+        self.assertIn(f"Spieler{who.PAGE_SIZE * 2:03}", self.account.msg.call_args[1]["text"])
+
+
+class TestChargenDraft(EvenniaTest):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = TemporaryDirectory()
+        patcher = patch.object(chargen_draft, "JOURNAL_DIR", self.tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.session.new_char = self.char2
+        self.char2.db.chargen_step = "menunode_multi_choice"
+
+    def test_choices_saved_at_checkpoints(self):
+        draft = chargen_draft.open_draft(self.session, self.char2)
+        self.assertEqual(draft.get("skill_list", []), [])
+        with self.assertNumQueries(0):
+            for option in ("alchemy", "archery", "dancing", "archery"):
+                char_menu._set_multichoice(
+                    self.session, "", selected=draft.get("skill_list", []), option=option
+                )
+            # showing the same step again saves nothing
+            char_menu.menunode_multi_choice(self.session, "")
+        self.assertFalse(self.char2.attributes.has("skill_list"))
+        self.assertTrue(os.path.exists(draft.journal_path))
+        char_menu.menunode_choose_objects(self.session, "")
+        self.assertEqual(self.char2.db.skill_list, ["alchemy", "dancing"])
+        self.assertEqual(self.char2.db.chargen_step, "menunode_choose_objects")
+        self.assertFalse(os.path.exists(draft.journal_path))
+
+    def test_flushed_on_logout(self):
+        draft = chargen_draft.open_draft(self.session, self.char2)
+        draft.set("player_class", "Zwerg")
+        chargen_draft.SIGNAL_ACCOUNT_POST_LOGOUT.send(sender=self.account, session=self.session)
+        self.assertEqual(self.char2.db.player_class, "Zwerg")
+        self.assertIsNone(self.session.chargen_draft)
+
+    def test_recovered_from_journal(self):
+        draft = chargen_draft.open_draft(self.session, self.char2)
+        draft.set("player_class", "Elf")
+        draft.remove("chargen_step")
+        # a crash in the middle of the next record
+        with open(draft.journal_path, "ab") as journal:
+            journal.write(b"\x80\x05\x95")
+        self.session.chargen_draft = None
+        self.assertEqual(chargen_draft.recover_all(), 1)
+        self.assertEqual(self.char2.db.player_class, "Elf")
+        self.assertFalse(self.char2.attributes.has("chargen_step"))
+        self.assertFalse(os.listdir(self.tmpdir.name))
+
+
+class TestCharacterNames(EvenniaTest):
+    def setUp(self):
+        super().setUp()
+        self.charnames = charnames.CharacterNames()
+        patcher = patch.object(charnames, "CHARNAMES", self.charnames)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.charnames.load()
+
+    def test_free_names_need_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(self.charnames.is_taken("Niemand"))
+        with self.assertNumQueries(1):
+            self.assertTrue(self.charnames.is_taken(self.char1.key.upper()))
+        # its own name is free for a character
+        self.assertFalse(self.charnames.is_taken(self.char1.key, obj=self.char1))
+
+    def test_reserve_and_release(self):
+        self.assertTrue(self.charnames.reserve("Bodo", owner=self.char2, obj=self.char2))
+        self.assertFalse(self.charnames.reserve("BODO", owner=self.char1))
+        self.assertTrue(self.charnames.reserve("bodo", owner=self.char2))
+        # a new name releases the old one
+        self.assertTrue(self.charnames.reserve("Berta", owner=self.char2))
+        self.assertTrue(self.charnames.reserve("Bodo", owner=self.char1))
+        self.char2.key = "Berta"
+        self.charnames.release(self.char2)
+        self.assertTrue(self.charnames.is_taken("berta"))
+        self.char2.delete()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.charnames.is_taken("berta"))
+
+    def test_parallel_chargens(self):
+        # widen the window between checking and reserving
+        def _slow_in_db(self, name, obj=None):
+            time.sleep(0.01)
+            return False
+
+        patcher = patch.object(charnames.CharacterNames, "_in_db", _slow_in_db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.charnames._names["bodo"] = 1
+        barrier = threading.Barrier(8)
+        results = []
+
+        def _chargen(num):
+            barrier.wait()
+            results.append((num, self.charnames.reserve("Bodo", owner=num)))
+
+        threads = [threading.Thread(target=_chargen, args=(num,)) for num in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        winners = [num for num, reserved in results if reserved]
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(self.charnames._reserved, {"bodo": winners[0]})
+
+    def test_chargen_name_node(self):
+        self.session.new_char = self.char2
+        nodename, kwargs = char_menu._check_charname(self.session, self.char1.key)
+        self.assertEqual(nodename, "menunode_choose_name")
+        self.assertEqual(char_menu._check_charname(self.session, "Bodo"), "menunode_confirm_name")
+        self.assertEqual(self.char2.key, "Bodo")
+
+    def test_lower_index(self):
+        self.assertTrue(charnames.create_lower_index())
+        self.assertTrue(charnames.create_lower_index())
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, ObjectDB._meta.db_table)
+        self.assertIn(charnames.LOWER_INDEX_NAME, indexes)
+        self.assertTrue(self.charnames.is_taken(self.char1.key))
+
+
+class TestCompiledCharMenu(EvenniaTest):
+    def setUp(self):
+        super().setUp()
+        self.session.new_char = self.char2
+        self.char2.db.chargen_step = "menunode_info_base"
+
+    def test_nodes_compiled(self):
+        self.assertEqual(len(char_menu.menunode_info_base(self.session)[1]), 5)
+        for pclass in char_menu._CLASS_INFO_DICT:
+            (text, _), options = char_menu.menunode_info_class(
+                self.session, "", selected_class=pclass
+            )
+            self.assertEqual(text, char_menu._CLASS_INFO_DICT[pclass])
+            self.assertEqual(options[0]["desc"], f"Become {char_menu._INFLECT.an(pclass)}")
+        for category, values in char_menu._APPEARANCE_DICT.items():
+            _, options = char_menu.menunode_category_options(self.session, "", category=category)
+            self.assertEqual([option["desc"] for option in options[:-1]], values)
+        (text, _), _ = char_menu.menunode_choose_name(self.session, "", error="Vergeben")
+        self.assertTrue(text.startswith("|wChoosing a Name|n"))
+        self.assertIn("Vergeben. Enter a different name.", text)
+
+    def test_selection_highlighted(self):
+        selected = ["alchemy", "dancing", "pottery"]
+        _, options = char_menu.menunode_multi_choice(self.session, "", selected=selected)
+        descs = [option["desc"] for option in options]
+        self.assertEqual(len(descs), len(char_menu._SKILL_OPTIONS) + 2)
+        self.assertIn("|yalchemy (selected)|n", descs)
+        self.assertIn("archery", descs)
+        self.assertEqual(options[-2]["goto"], "menunode_choose_objects")
+        _, options = char_menu.menunode_multi_choice(self.session, "", selected=["alchemy"])
+        self.assertEqual(len(options), len(char_menu._SKILL_OPTIONS) + 1)
+
+    def test_not_rebuilt(self):
+        char_menu._compiled()
+        with patch.object(char_menu, "_build_info_class") as info, patch.object(
+            char_menu, "_build_category_options"
+        ) as category:
+            for _ in range(5):
+                char_menu.menunode_info_class(self.session, "", selected_class="Zwerg")
+                char_menu.menunode_category_options(self.session, "", category="body type")
+        self.assertFalse(info.called)
+        self.assertFalse(category.called)
+
+    @benchmark
+    def test_render_time(self):
+        def compiled():
+            char_menu.menunode_info_class(self.session, "", selected_class="Zwerg")
+            char_menu.menunode_category_options(self.session, "", category="body type")
+
+        def rebuilt():
+            # what the nodes did on every display before
+            char_menu._build_info_class("Zwerg")
+            char_menu._build_category_options("body type")
+
+        times = compare("chargen nodes, 2 rendered", 500, compiled=compiled, rebuilt=rebuilt)
+        self.assertLess(times["compiled"], times["rebuilt"])
+
+
+class TestStarterGear(EvenniaTest):
+    def setUp(self):
+        super().setUp()
+        starter_gear.clear_cache()
+        self.sword, self.staff = char_menu._EXAMPLE_PROTOTYPES
+
+    def test_compiled_once(self):
+        with patch.object(starter_gear, "_compile", wraps=starter_gear._compile) as compile_:
+            first = starter_gear.compile_prototype(self.sword)
+            self.assertIs(starter_gear.compile_prototype(dict(self.sword)), first)
+            starter_gear.compile_prototype(self.staff)
+            self.assertEqual(compile_.call_count, 2)
+            # resolved anew every time
+            dynamic = dict(self.sword, desc="$random(1, 6)")
+            starter_gear.compile_prototype(dynamic)
+            starter_gear.compile_prototype(dynamic)
+            self.assertEqual(compile_.call_count, 4)
+        self.assertEqual(starter_gear.precompile(), 2)
+
+    def test_spawn_gear(self):
+        sword, staff = starter_gear.spawn_gear((self.sword, self.char1), (self.staff, self.char2))
+        self.assertEqual((sword.key, sword.location), ("basic sword", self.char1))
+        self.assertEqual((staff.key, staff.location), ("basic staff", self.char2))
+        self.assertIn(sword, self.char1.contents)
+        self.assertEqual(sword.db.desc, self.sword["desc"])
+        self.assertEqual(sword.tags.get(category="weapon"), "sword")
+        self.assertEqual(staff.tags.get("staff", category="focus"), "staff")
+        self.assertEqual(
+            sword.tags.get(category="from_prototype", return_list=True)[0][:10], "prototype-"
+        )
+        # the same as spawn() creates
+        (spawned,) = spawn(dict(self.staff, location=self.char2))
+        self.assertEqual(
+            sorted(staff.tags.all(return_key_and_category=True))[1:],
+            sorted(spawned.tags.all(return_key_and_category=True))[1:],
+        )
+        self.assertEqual(staff.attributes.all()[0].value, spawned.attributes.all()[0].value)
+        self.assertEqual(staff.typeclass_path, spawned.typeclass_path)
+
+    def test_create_objects(self):
+        self.char2.db.starter_weapon = self.staff
+        char_menu.create_objects(self.char2)
+        (staff,) = [obj for obj in self.char2.contents if obj.key == "basic staff"]
+        self.assertTrue(staff.tags.has("staff", category="weapon"))
+        self.assertEqual(staff.db.desc, self.staff["desc"])
+
+    def _kits(self, num):
+        chars = [create.create_object(key=f"Neu{num}", location=self.room1) for num in range(num)]
+        kits = [self.sword if num % 2 else self.staff for num in range(num)]
+        # compiled once, like after the first new character
+        starter_gear.precompile()
+        return chars, kits
+
+    def test_spawn_cost(self):
+        chars, kits = self._kits(100)
+        with CaptureQueriesContext(connection) as plain_queries:
+            for char, kit in zip(chars, kits):
+                spawn(dict(kit, location=char))
+        with CaptureQueriesContext(connection) as compiled_queries:
+            objs = starter_gear.spawn_gear(*zip(kits, chars))
+        self.assertEqual(sum(len(char.contents) for char in chars), 200)
+        self.assertLess(len(compiled_queries), len(plain_queries))
+        # Tags and Attributes of all 100 objects take a fixed number of queries
+        taglists = [starter_gear.compile_prototype(kit)[6] for kit in kits]
+        attrlists = [starter_gear.compile_prototype(kit)[5] for kit in kits]
+        for obj in objs:
+            obj.tags.clear()
+            obj.attributes.clear()
+        # find the Tags, link them
+        with self.assertNumQueries(2):
+            starter_gear._add_tags(objs, taglists)
+        # look for Attributes set by hooks, insert, link
+        with self.assertNumQueries(3):
+            starter_gear._add_attributes(objs, attrlists)
+        self.assertEqual(objs[0].db.desc, kits[0]["desc"])
+        self.assertTrue(objs[1].tags.has("sword", category="weapon"))
+
+    @benchmark
+    def test_benchmark_spawn(self):
+        chars, kits = self._kits(100)
+
+        def plain():
+            for char, kit in zip(chars, kits):
+                spawn(dict(kit, location=char))
+
+        times = compare(
+            "starter gear for 100 characters",
+            1,
+            spawn=plain,
+            compiled=lambda: starter_gear.spawn_gear(*zip(kits, chars)),
+        )
+        self.assertLess(times["compiled"], times["spawn"])
@@ -0,0 +1,135 @@
+"""
+Bulk transfer
+
+`nimm alles`, `nimm 5 schwert`, `lege alles` and `gib alles = Bob` move
+many objects at once. Doing that one `nimm` at a time means one DB commit,
+one set of hooks and one room message per object. Here the objects are
+
+1. checked (locks and `at_pre_*` hooks) in one pass up front,
+2. moved inside a single DB transaction,
+3. handed their `at_get`/`at_drop`/`at_give` hooks once everything moved,
+
+and the command reports the result in one aggregated room message
+(see `describe`) instead of one line per object.
+
+"""
+import re
+from itertools import groupby
+
+from django.db import transaction
+
+from evennia.utils.utils import iter_to_str
+
+ALL_KEYWORDS = ("alles", "alle", "all")
+
+_AMOUNT_REGEX = re.compile(r"^\s*(?P<amount>\d+)\s+(?P<name>\S.*)$")
+
+
+def parse_amount(args):
+    """
+    Split a bulk request into an amount and a name.
+
+    Args:
+        args (str): Command arguments, like `"alles"` or `"5 schwert"`.
+
+    Returns:
+        tuple or None: `(amount, name)`, where `amount` is `None` for
+            everything (`alles`). `None` if this is no bulk request.
+
+    """
+    args = args.strip()
+    if args.lower() in ALL_KEYWORDS:
+        return None, None
+    match = _AMOUNT_REGEX.match(args)
+    if match:
+        return int(match.group("amount")), match.group("name").strip()
+    return None
+
+
+def find_stack(searcher, name, amount, location):
+    """
+    Find up to `amount` identical objects named `name` in `location`. Error
+    messages (nothing found, mixed matches) are sent by the search.
+
+    Returns:
+        list: The objects found, possibly empty.
+
+    """
+    found = searcher.search(name, location=location, stacked=amount)
+    if not found:
+        return []
+    return list(found) if isinstance(found, list) else [found]
+
+
+def select(searcher, amount, name, container):
+    """
+    Pick the objects a bulk request refers to.
+
+    Args:
+        searcher (Object): Who is asking.
+        amount (int or None): How many; `None` for everything.
+        name (str or None): What to look for; ignored for everything.
+        container (Object): Where to look.
+
+    Returns:
+        list: The objects, possibly empty.
+
+    """
+    if amount is None:
+        return movable_contents(container, searcher)
+    return find_stack(searcher, name, amount, container)
+
+
+def movable_contents(container, mover):
+    """
+    Everything in `container` that could be moved by `mover` - that is, no
+    exits and not the mover itself. Locks are checked by `transfer`.
+
+    """
+    return [obj for obj in container.contents if obj != mover and not obj.destination]
+
+
+def transfer(objs, destination, move_type, check=None):
+    """
+    Move many objects into `destination` within one DB transaction.
+
+    Args:
+        objs (list): The objects to move.
+        destination (Object): Where to move them.
+        move_type (str): Passed to `move_to`, like `"get"`.
+        check (callable, optional): Called as `check(obj)` for every object
+            before anything is moved; objects for which it returns `False`
+            are skipped.
+
+    Returns:
+        list: The objects that were actually moved.
+
+    """
+    if check:
+        objs = [obj for obj in objs if check(obj)]
+    moved = []
+    with transaction.atomic():
+        for obj in objs:
+            if obj.move_to(destination, quiet=True, move_type=move_type):
+                moved.append(obj)
+    return moved
+
+
+def describe(objs, looker):
+    """
+    List objects by name, grouping same-named ones: `"three Schwerts und a Schild"`.
+
+    Args:
+        objs (list): The objects.
+        looker (Object): Who the names are for.
+
+    Returns:
+        str: The description.
+
+    """
+    names = []
+    for _, group in groupby(sorted(objs, key=lambda obj: obj.key), key=lambda obj: obj.key):
+        group = list(group)
+        singular, plural = group[0].get_numbered_name(len(group), looker)
+        names.append(singular if len(group) == 1 else plural)
+    return iter_to_str(names, endsep=" und")
@@ -0,0 +1,329 @@
+"""
+Who list
+
+`wer` used to fetch all sessions, sort them and build the whole table on
+every call. Here a module-wide `ROSTER` keeps the logged-in sessions sorted
+by account name at all times:
+
+- a login inserts the session at its place (`bisect`),
+- a logout marks the roster to drop disconnected sessions on next use,
+- puppeting/unpuppeting and other changes just bump its version.
+
+The rendered listing is cached per variant (privileged staff view or the
+plain one) for a short time bucket, so during busy times `wer` costs a dict
+lookup for everyone but the first caller every few seconds.
+
+    text = ROSTER.render(privileged, looker, make_table)
+
+With 500 people online even the cached listing is one huge message. The
+filtered/paged mode (`wer /raum`, `wer /idle>10m`, `wer /seite 3`) only
+filters the session list and hands it to `WhoPager`, which builds the table
+of a page when that page is shown. All pages of one call share the same
+timestamp, so idle and online times don't drift while paging.
+
+"""
+import re
+import time
+from bisect import insort
+
+from django.core.paginator import Paginator
+
+import evennia
+from evennia.utils import utils
+from evennia.utils.evmore import CmdSetMore, EvMore
+
+# seconds a rendered listing is reused
+BUCKET_SECONDS = 5
+# sessions per page in the paged mode
+PAGE_SIZE = 20
+
+_OPTION_REGEX = re.compile(
+    r"/(?P<option>raum|idle|seite)\b\s*"
+    r"(?:(?P<op>[<>])\s*(?P<duration>\d+)\s*(?P<unit>[smhd]?)|(?P<number>\d+))?",
+    re.I,
+)
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_options(text):
+    """
+    Parse the options of the paged `wer`.
+
+    Args:
+        text (str): Like `"/raum /idle>10m /seite 3"`. A duration without
+            unit is in minutes.
+
+    Returns:
+        dict or None: With keys `room` (bool), `idle` (`None` or a tuple
+            `(op, seconds)`, `op` being `"<"` or `">"`) and `page` (int or
+            `None`). `None` if `text` has no options.
+
+    Raises:
+        ValueError: If `text` contains something that is no valid option.
+
+    """
+    if not text.strip():
+        return None
+    options = {"room": False, "idle": None, "page": None}
+    end = 0
+    for match in _OPTION_REGEX.finditer(text):
+        if text[end : match.start()].strip():
+            raise ValueError(text[end : match.start()].strip())
+        end = match.end()
+        option = match.group("option").lower()
+        if option == "raum" and not match.group("op") and not match.group("number"):
+            options["room"] = True
+        elif option == "idle" and match.group("op"):
+            unit = _UNITS[(match.group("unit") or "m").lower()]
+            options["idle"] = (match.group("op"), int(match.group("duration")) * unit)
+        elif option == "seite" and match.group("number"):
+            options["page"] = int(match.group("number"))
+        else:
+            raise ValueError(match.group(0).strip())
+    if text[end:].strip():
+        raise ValueError(text[end:].strip())
+    return options
+
+
+def filter_sessions(sessions, now, location=None, idle=None):
+    """
+    Filter sessions without building any rows.
+
+    Args:
+        sessions (list): Sessions, like `ROSTER.sessions()`.
+        now (float): Timestamp to compute idle times from.
+        location (Object, optional): Only sessions puppeting something here.
+        idle (tuple, optional): `(op, seconds)`; only sessions idle longer
+            (`">"`) or shorter (`"<"`) than `seconds`.
+
+    Returns:
+        list: The matching sessions, in order.
+
+    """
+    if location is not None:
+        sessions = [
+            sess for sess in sessions if sess.puppet and sess.puppet.location == location
+        ]
+    if idle:
+        op, seconds = idle
+        if op == ">":
+            sessions = [sess for sess in sessions if now - sess.cmd_last_visible > seconds]
+        else:
+            sessions = [sess for sess in sessions if now - sess.cmd_last_visible < seconds]
+    return sessions
+
+
+def build_table(sessions, privileged, looker, make_table, now):
+    """
+    Build the who-table of some sessions.
+
+    Args:
+        sessions (iterable): The sessions, in display order.
+        privileged (bool): Show the staff variant (puppets, rooms, hosts).
+        looker (Account): Who is looking; used for display names.
+        make_table (callable): Table factory, like `Command.styled_table`.
+        now (float): Timestamp to compute idle and online times from.
+
+    Returns:
+        EvTable: The table.
+
+    """
+    if privileged:
+        table = make_table(
+            "|wAccount Name",
+            "|wOn for",
+            "|wIdle",
+            "|wPuppeting",
+            "|wRoom",
+            "|wCmds",
+            "|wProtocol",
+            "|wHost",
+        )
+    else:
+        table = make_table("|wAccount name", "|wOn for", "|wIdle")
+    for session in sessions:
+        if not session.logged_in:
+            # logged out while someone was paging
+            continue
+        row = [
+            utils.crop(session.account.get_display_name(looker), width=25),
+            utils.time_format(now - session.conn_time, 0),
+            utils.time_format(now - session.cmd_last_visible, 1),
+        ]
+        if privileged:
+            puppet = session.puppet
+            location = puppet.location.key if puppet and puppet.location else "None"
+            row += [
+                utils.crop(puppet.get_display_name(looker) if puppet else "None", width=25),
+                utils.crop(location, width=25),
+                session.cmd_total,
+                session.protocol_key,
+                isinstance(session.address, tuple) and session.address[0] or session.address,
+            ]
+        table.add_row(*row)
+    return table
+
+
+def _footer(naccounts, state="logged in"):
+    is_one = naccounts == 1
+    return "%s unique account%s %s." % (
+        "One" if is_one else naccounts,
+        "" if is_one else "s",
+        state,
+    )
+
+
+class Roster:
+    """
+    The sorted list of logged-in sessions, and the rendered who-listings.
+
+    """
+
+    __slots__ = ("_entries", "_sessions", "_stale", "_check", "version", "_cache")
+
+    def __init__(self):
+        # sorted (account key, sessid)
+        self._entries = []
+        self._sessions = {}
+        # rebuild from the session handler on next use
+        self._stale = True
+        # drop disconnected sessions on next use
+        self._check = False
+        self.version = 0
+        self._cache = {}
+
+    def changed(self):
+        """
+        Mark the roster as changed, e.g. after someone (un)puppeted.
+
+        """
+        self.version += 1
+        self._cache = {}
+
+    def add(self, session):
+        """
+        Add a session that just logged in.
+
+        """
+        if self._stale or session.sessid in self._sessions:
+            self.changed()
+            return
+        insort(self._entries, (session.account.key, session.sessid))
+        self._sessions[session.sessid] = session
+        self.changed()
+
+    def remove_disconnected(self):
+        """
+        Drop sessions that are disconnecting; they leave the session handler
+        only after the account's logout hook ran, so this is checked lazily.
+
+        """
+        self._check = True
+        self.changed()
+
+    def reset(self):
+        """
+        Rebuild the roster from the session handler on next use.
+
+        """
+        self._stale = True
+        self.changed()
+
+    def _sync(self):
+        if self._stale:
+            sessions = [sess for sess in evennia.SESSION_HANDLER.get_sessions() if sess.logged_in]
+            self._entries = sorted((sess.account.key, sess.sessid) for sess in sessions)
+            self._sessions = {sess.sessid: sess for sess in sessions}
+            self._stale = self._check = False
+        elif self._check:
+            live = evennia.SESSION_HANDLER
+            gone = [sessid for sessid in self._sessions if sessid not in live]
+            if gone:
+                for sessid in gone:
+                    del self._sessions[sessid]
+                self._entries = [entry for entry in self._entries if entry[1] in self._sessions]
+            self._check = False
+
+    def sessions(self):
+        """
+        Returns:
+            list: The logged-in sessions, sorted by account name.
+
+        """
+        self._sync()
+        return [self._sessions[sessid] for _, sessid in self._entries]
+
+    def render(self, privileged, looker, make_table, now=None):
+        """
+        Get the who-listing, cached for `BUCKET_SECONDS`.
+
+        Args:
+            privileged (bool): Show the staff variant (puppets, rooms, hosts).
+            looker (Account): Who is looking; used for display names.
+            make_table (callable): Table factory, like `Command.styled_table`.
+            now (float, optional): Current time.
+
+        Returns:
+            str: The listing.
+
+        """
+        now = time.time() if now is None else now
+        self._sync()
+        cachekey = (privileged, int(now // BUCKET_SECONDS))
+        text = self._cache.get(cachekey)
+        if text is None:
+            # only the current bucket is worth keeping
+            self._cache = {cachekey: self._render(privileged, looker, make_table, now)}
+            text = self._cache[cachekey]
+        return text
+
+    def _render(self, privileged, looker, make_table, now):
+        table = build_table(self.sessions(), privileged, looker, make_table, now)
+        naccounts = len({key for key, _ in self._entries})
+        return "|wAccounts:|n\n%s\n%s" % (table, _footer(naccounts))
+
+ROSTER = Roster()
+
+
+class WhoPager(EvMore):
+    """
+    Pager over a list of sessions, building the table of a page only when
+    that page is shown.
+
+    """
+
+    def __init__(self, caller, sessions, privileged, make_table, now, page=1, **kwargs):
+        """
+        Args:
+            caller (Account): Who is looking.
+            sessions (list): The (filtered) sessions to list.
+            privileged (bool): Show the staff variant of the table.
+            make_table (callable): Table factory, like `Command.styled_table`.
+            now (float): Timestamp all pages compute their times from.
+            page (int, optional): Page to start at, starting at 1.
+            **kwargs: Passed on to `EvMore`.
+
+        """
+        self._privileged = privileged
+        self._make_table = make_table
+        self._now = now
+        self._start_page = page
+        self._naccounts = len({sess.account.key for sess in sessions})
+        super().__init__(caller, Paginator(sessions, PAGE_SIZE), **kwargs)
+
+    def page_formatter(self, page):
+        table = build_table(page, self._privileged, self._caller, self._make_table, self._now)
+        return "|wAccounts:|n\n%s\n%s" % (table, _footer(self._naccounts, "found"))
+
+    def start(self):
+        """
+        Start at the requested page instead of the first one.
+
+        """
+        self._npos = min(max(0, self._start_page - 1), max(0, self._npages - 1))
+        if self._npages <= 1 and not self._always_page:
+            self.display(show_footer=False)
+        else:
+            self._caller.ndb._more = self
+            self._caller.cmdset.add(CmdSetMore)
+            self.display()